@@ -0,0 +1,9 @@
+"""Benchmarks of vcfstats, on synthetic VCF files.
+
+Run from the root of the repository:
+
+    python -m benchmarks run [--variants N] [--samples N] [-o results.json]
+    python -m benchmarks compare baseline.json results.json
+
+See `python -m benchmarks --help` for all options.
+"""
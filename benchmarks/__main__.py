@@ -0,0 +1,184 @@
+"""Command line of the benchmarks"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import cyvcf2
+from rich.console import Console
+from rich.table import Table
+
+from vcfstats import __version__
+from vcfstats.utils import logger
+
+from .run import STAGES, compare, run
+from .synth import FORMAT_FIELDS, write_vcf
+
+
+def get_parser():
+    """Get the argument parser"""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=__doc__
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", help="Run the benchmarks on a synthetic VCF file"
+    )
+    run_parser.add_argument("--variants", type=int, default=10000)
+    run_parser.add_argument("--samples", type=int, default=10)
+    run_parser.add_argument(
+        "--multiallelic",
+        type=float,
+        default=0.05,
+        help="Fraction of the variants with two ALT alleles",
+    )
+    run_parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=list(FORMAT_FIELDS),
+        choices=list(FORMAT_FIELDS),
+        help="The FORMAT fields of the samples",
+    )
+    run_parser.add_argument("--seed", type=int, default=8525)
+    run_parser.add_argument(
+        "--format",
+        dest="vcf_format",
+        choices=["vcf", "vcf.gz", "bcf"],
+        default="vcf.gz",
+        help="The format of the synthetic file",
+    )
+    run_parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=list(STAGES)
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--plot-repeat",
+        type=int,
+        help="Number of runs for plotting, default: --repeat",
+    )
+    run_parser.add_argument(
+        "-o", "--output", type=Path, help="Write the results to a JSON file"
+    )
+    run_parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Compare the results with the baseline JSON file",
+    )
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare the results with a baseline"
+    )
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Flag the benchmarks more than this fraction slower",
+    )
+    return parser
+
+
+def print_results(results):
+    """Print the results as a table"""
+    table = Table(title="Benchmarks (seconds)")
+    table.add_column("Benchmark")
+    table.add_column("Min", justify="right")
+    table.add_column("Median", justify="right")
+    for name, result in results.items():
+        table.add_row(name, f"{result['min']:.4f}", f"{result['median']:.4f}")
+    Console().print(table)
+
+
+def print_comparison(rows, threshold):
+    """Print the comparison as a table,
+    returns the number of regressions"""
+    table = Table(title=f"Compared with the baseline (threshold: {threshold:.0%})")
+    table.add_column("Benchmark")
+    table.add_column("Baseline", justify="right")
+    table.add_column("Current", justify="right")
+    table.add_column("Ratio", justify="right")
+    table.add_column("Status")
+    styles = {"regression": "red", "improvement": "green"}
+    for name, base, cur, ratio, status in rows:
+        table.add_row(
+            name,
+            "-" if base is None else f"{base:.4f}",
+            "-" if cur is None else f"{cur:.4f}",
+            "-" if ratio is None else f"{ratio:.2f}",
+            f"[{styles[status]}]{status}[/]" if status in styles else status,
+        )
+    Console().print(table)
+    return sum(status == "regression" for *_, status in rows)
+
+
+def load_results(path):
+    """Load the results from a JSON file"""
+    with open(path) as fin:
+        return json.load(fin)["results"]
+
+
+def main(args=None):
+    """Main entrance of the benchmarks"""
+    opts = get_parser().parse_args(args)
+
+    if opts.command == "compare":
+        rows = compare(
+            load_results(opts.baseline),
+            load_results(opts.current),
+            opts.threshold,
+        )
+        return 1 if print_comparison(rows, opts.threshold) else 0
+
+    params = {
+        "variants": opts.variants,
+        "samples": opts.samples,
+        "multiallelic": opts.multiallelic,
+        "formats": opts.formats,
+        "seed": opts.seed,
+        "format": opts.vcf_format,
+        "repeat": opts.repeat,
+        "plot_repeat": opts.plot_repeat,
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        vcffile = write_vcf(
+            Path(tmpdir) / f"synthetic.{opts.vcf_format}",
+            n_variants=opts.variants,
+            n_samples=opts.samples,
+            multiallelic=opts.multiallelic,
+            formats=opts.formats,
+            seed=opts.seed,
+        )
+        results = run(vcffile, opts.stages, opts.repeat, opts.plot_repeat)
+
+    print_results(results)
+    if opts.output:
+        output = {
+            "meta": {
+                "vcfstats": __version__,
+                "cyvcf2": cyvcf2.__version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": datetime.now(timezone.utc).isoformat(),
+                "params": params,
+            },
+            "results": results,
+        }
+        with open(opts.output, "w") as fout:
+            json.dump(output, fout, indent=2)
+
+    if opts.baseline:
+        rows = compare(load_results(opts.baseline), results, opts.threshold)
+        return 1 if print_comparison(rows, opts.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    # keep the warnings of the scans and plots out of the tables
+    logger.setLevel("ERROR")
+    sys.exit(main())
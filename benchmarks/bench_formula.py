@@ -0,0 +1,81 @@
+"""Micro-benchmark of the per-variant overhead of the formulas.
+
+Runs each formula over the variants of examples/sample.vcf, one by one
+(the path that `Formula.run` takes for macros without batch versions),
+and reports the time spent on each variant in microseconds, along with
+the overhead: the time on top of calling the bare macros.
+
+Usage:
+    python -m benchmarks.bench_formula [--repeat N]
+"""
+import argparse
+import time
+from pathlib import Path
+
+from cyvcf2 import VCF
+
+from vcfstats.formula import MACRO_CACHE, Formula
+from vcfstats.utils import logger
+
+HERE = Path(__file__).parent.resolve()
+VCFFILE = HERE.parent / "examples" / "sample.vcf"
+
+FORMULAS = {
+    "Term ~ Term": "AAF ~ CONTIG",
+    "Term ~ Term (samples, subsets)": "GTTYPEs[HET,HOM_ALT]{0,1} ~ CHROM",
+    "Aggr ~ Term": "MEAN(AAF, group=VARTYPE) ~ CONTIG",
+    "Aggr ~ Aggr": "COUNT(1, group=VARTYPE) ~ MEAN(AAF[0.1, 1], group=VARTYPE)",
+}
+
+
+def best_of(repeat, func, variants):
+    """Get the best time per variant (us) of running func on the variants"""
+    best = float("inf")
+    for _ in range(repeat):
+        MACRO_CACHE.reset()
+        start = time.perf_counter()
+        for variant in variants:
+            func(variant)
+        best = min(best, time.perf_counter() - start)
+    return best / len(variants) * 1e6
+
+
+def bench(formula, variants, samples, repeat):
+    """Get the time per variant (us) of a formula and of its bare macros"""
+    fmula = Formula(formula, samples, False, "bench")
+    data = []
+    macros = {term.term["func"]: term.term["nargs"] for term in fmula.terms()}
+
+    def run_macros(variant):
+        for func, nargs in macros.items():
+            if nargs == 2:
+                func(variant, None)
+            else:
+                func(variant)
+
+    def run_formula(variant):
+        fmula.run(variant, None, data.append, data.extend)
+
+    bare = best_of(repeat, run_macros, variants)
+    total = best_of(repeat, run_formula, variants)
+    return total, total - bare
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    logger.setLevel("WARNING")
+    vcf = VCF(str(VCFFILE), gts012=True)
+    variants = list(vcf)
+    print(f"{len(variants)} variants, best of {args.repeat} runs (us/variant)")
+    print(f"{'':32} {'total':>8} {'overhead':>8}")
+    for name, formula in FORMULAS.items():
+        total, overhead = bench(formula, variants, vcf.samples, args.repeat)
+        print(f"{name:32} {total:8.2f} {overhead:8.2f}  {formula}")
+
+
+if __name__ == "__main__":
+    main()
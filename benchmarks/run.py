@@ -0,0 +1,271 @@
+"""The benchmarks of the stages of vcfstats: starting up, parsing the
+formulas, scanning the variants with each built-in macro, aggregating and
+plotting.
+
+Each benchmark is run a number of times, the results are the times of
+the runs in seconds.
+"""
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cyvcf2 import VCF
+
+from vcfstats.cli import scan_variants
+from vcfstats.formula import MACRO_CACHE, Formula
+from vcfstats.instance import Instance
+from vcfstats.utils import MACROS, capture_c_msg
+
+PARSE_FORMULAS = [
+    "AAF ~ CONTIG",
+    "GTTYPEs[HET,HOM_ALT]{0} ~ CHROM[1-5]",
+    "MEAN(AAF[0.05, 0.95], filter=FILTER[PASS], group=VARTYPE) ~ CONTIG",
+    "COUNT(1, group=VARTYPE) ~ MEAN(QUAL, group=VARTYPE)",
+]
+
+AGGR_FORMULAS = [
+    "COUNT(1, group=VARTYPE) ~ CONTIG",
+    "SUM(QUAL) ~ CONTIG",
+    "MEAN(AAF, group=VARTYPE) ~ CONTIG",
+    "MEAN(GQs{0}) ~ MEAN(DEPTHs{0}, group=CONTIG)",
+    "QUANTILE(QUAL, q=0.9) ~ CONTIG",
+    "DISTINCT(SUBST) ~ CONTIG",
+    "COUNT(1, group=CONTIG) ~ WINDOW[10000]",
+]
+
+# TERM ~ TERM formulas adding the data by rows (the ones of TERM ~ 1 are
+# scanned with the macros)
+SCAN_FORMULAS = [
+    "TITV ~ CONTIG",
+    "GQs{0} ~ DEPTHs{0}",
+]
+
+# formula, figtype
+PLOTS = [
+    ("COUNT(1, group=VARTYPE) ~ CONTIG", "col"),
+    ("AAF ~ CONTIG", "boxplot"),
+    ("AAF ~ 1", "histogram"),
+    ("GQs{0} ~ DEPTHs{0}", "scatter"),
+]
+
+# the commands to time the startup with, in a new process each time
+STARTUP_COMMANDS = {
+    "import": ["-c", "import vcfstats.cli"],
+    "list": ["-m", "vcfstats", "--list"],
+    "help": ["-m", "vcfstats", "--help"],
+}
+
+STAGES = ("startup", "parse", "scan", "aggr", "plot")
+
+# where vcfstats is imported from by the startup commands
+ROOT = Path(__file__).parent.parent
+
+
+def builtin_macros():
+    """The names of the built-in macros that are not aggregations,
+    without the aliases"""
+    seen = set()
+    for name, macro in MACROS.items():
+        if macro.get("aggr") or id(macro) in seen:
+            continue
+        if macro["func"].__module__ != "vcfstats.macros":
+            continue
+        seen.add(id(macro))
+        yield name
+
+
+def summary(runs):
+    """Summarize the times of the runs"""
+    return {
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+    }
+
+
+def timeit(func, repeat, setup=None):
+    """Time func for `repeat` runs, each after `setup` if given,
+    whose return value is passed to func"""
+    runs = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        if setup:
+            func(arg)
+        else:
+            func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def new_instance(formula, samples, outdir, figtype=None):
+    """Create an instance to benchmark"""
+    return Instance(
+        formula,
+        "bench",
+        "",
+        {"width": 600, "height": 600, "res": 100},
+        outdir,
+        samples,
+        figtype,
+        False,
+    )
+
+
+def scan(vcffile, ones):
+    """Scan all the variants of the vcf file for the instances"""
+    MACRO_CACHE.reset()
+    with capture_c_msg("cyvcf2"):
+        vcf = VCF(str(vcffile), gts012=True)
+    return scan_variants(vcf, ones)
+
+
+def bench_startup(vcffile, repeat, **_):
+    """Starting vcfstats in a new process, which is paid by every run"""
+    results = {}
+    for name, args in STARTUP_COMMANDS.items():
+
+        def start():
+            subprocess.run(
+                [sys.executable, *args],
+                cwd=ROOT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+
+        results[f"startup/{name}"] = summary(timeit(start, repeat))
+    return results
+
+
+def bench_parse(vcffile, repeat, number=100, **_):
+    """Parsing the formulas, `number` times in each run"""
+    samples = VCF(str(vcffile)).samples
+    results = {}
+    for formula in PARSE_FORMULAS:
+
+        def parse():
+            for _ in range(number):
+                Formula(formula, samples, False, "bench")
+
+        results[f"parse/{formula}"] = summary(timeit(parse, repeat))
+    return results
+
+
+def bench_scan(vcffile, repeat, outdir, **_):
+    """Scanning the variants with each built-in macro, with the TERM ~ TERM
+    formulas that add the data by rows, and only reading the variants as
+    the baseline"""
+    samples = VCF(str(vcffile)).samples
+    results = {
+        "scan/(read)": summary(timeit(lambda: scan(vcffile, []), repeat))
+    }
+    for name in builtin_macros():
+        formula = f"{name} ~ 1"
+        results[f"scan/{name}"] = summary(
+            timeit(
+                lambda ones: scan(vcffile, ones),
+                repeat,
+                setup=lambda: [new_instance(formula, samples, outdir)],
+            )
+        )
+    for formula in SCAN_FORMULAS:
+        results[f"scan/{formula}"] = summary(
+            timeit(
+                lambda ones: scan(vcffile, ones),
+                repeat,
+                setup=lambda: [new_instance(formula, samples, outdir)],
+            )
+        )
+    return results
+
+
+def bench_aggr(vcffile, repeat, outdir, **_):
+    """Scanning the variants with the aggregations, and summarizing them
+    (`Aggr.dump`)"""
+    samples = VCF(str(vcffile)).samples
+    results = {}
+    for formula in AGGR_FORMULAS:
+        scans = []
+        dumps = []
+        for _ in range(repeat):
+            instance = new_instance(formula, samples, outdir)
+            scans.extend(timeit(lambda: scan(vcffile, [instance]), 1))
+            dumps.extend(timeit(instance.summarize, 1))
+        results[f"aggr/{formula}/scan"] = summary(scans)
+        results[f"aggr/{formula}/dump"] = summary(dumps)
+    return results
+
+
+def bench_plot(vcffile, repeat, outdir, **_):
+    """Plotting the figures from the summarized data"""
+    samples = VCF(str(vcffile)).samples
+    results = {}
+    for i, (formula, figtype) in enumerate(PLOTS):
+        instance = new_instance(formula, samples, outdir, figtype)
+        scan(vcffile, [instance])
+        instance.summarize()
+        if i == 0:
+            # warm up, not to count importing the plotting libraries
+            instance.plot()
+        results[f"plot/{figtype}/{formula}"] = summary(
+            timeit(instance.plot, repeat)
+        )
+    return results
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "parse": bench_parse,
+    "scan": bench_scan,
+    "aggr": bench_aggr,
+    "plot": bench_plot,
+}
+
+
+def run(vcffile, stages=STAGES, repeat=5, plot_repeat=None):
+    """Run the benchmarks of the stages on the vcf file.
+    Returns a dict of the benchmark names and their results"""
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        for stage in stages:
+            results.update(
+                BENCHMARKS[stage](
+                    vcffile,
+                    repeat=plot_repeat or repeat if stage == "plot" else repeat,
+                    outdir=Path(outdir),
+                )
+            )
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare the results with the baseline, by the medians.
+
+    Returns a list of (name, baseline median, current median, ratio,
+    status), where the status is "regression" if the ratio is more than
+    1 + threshold, "improvement" if it is less than 1 - threshold, "new"
+    or "removed" for the benchmarks in only one of them, otherwise "ok".
+    """
+    rows = []
+    for name in {**baseline, **current}:
+        if name not in current:
+            rows.append((name, baseline[name]["median"], None, None, "removed"))
+            continue
+        if name not in baseline:
+            rows.append((name, None, current[name]["median"], None, "new"))
+            continue
+        base = baseline[name]["median"]
+        cur = current[name]["median"]
+        ratio = cur / base if base else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append((name, base, cur, ratio, status))
+    return rows
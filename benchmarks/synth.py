@@ -0,0 +1,201 @@
+"""Deterministic synthetic VCF/BCF files for the benchmarks"""
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+from cyvcf2 import VCF, Writer
+
+BASES = "ACGT"
+# the FORMAT fields that can be generated
+FORMAT_FIELDS = {
+    "GT": '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    "GQ": '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype Quality">',
+    "DP": '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">',
+    "AD": (
+        "##FORMAT=<ID=AD,Number=R,Type=Integer,"
+        'Description="Allelic depths">'
+    ),
+}
+
+
+def _header(n_samples, n_contigs, contig_length, formats):
+    """The header lines of the synthetic VCF file"""
+    lines = [
+        "##fileformat=VCFv4.2",
+        '##FILTER=<ID=PASS,Description="All filters passed">',
+        '##FILTER=<ID=LowQual,Description="Low quality">',
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">',
+        '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele Frequency">',
+        *(FORMAT_FIELDS[field] for field in formats),
+        *(
+            f"##contig=<ID={contig},length={contig_length}>"
+            for contig in _contigs(n_contigs)
+        ),
+    ]
+    columns = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+    if formats and n_samples:
+        columns.append("FORMAT")
+        columns.extend(f"S{i}" for i in range(n_samples))
+    lines.append("\t".join(columns))
+    return lines
+
+
+def _contigs(n_contigs):
+    """The names of the contigs"""
+    return [str(i + 1) for i in range(n_contigs)]
+
+
+def _bases(rng, max_length=5):
+    """Some random bases, inserted or deleted"""
+    return "".join(
+        rng.choice(BASES) for _ in range(rng.randint(1, max_length))
+    )
+
+
+def _alleles(rng, multiallelic):
+    """A REF and the ALTs of a variant: mostly SNPs, with some indels"""
+    ref = rng.choice(BASES)
+    if rng.random() < 0.07:
+        # deletion
+        ref += _bases(rng)
+    n_alts = 2 if rng.random() < multiallelic else 1
+    alts = []
+    while len(alts) < n_alts:
+        if rng.random() < 0.9:
+            alt = rng.choice([base for base in BASES if base != ref[0]])
+        else:
+            alt = ref[0] + _bases(rng)
+        if alt not in alts and alt != ref:
+            alts.append(alt)
+    return ref, alts
+
+
+def _sample(rng, n_alleles, freq, formats):
+    """The FORMAT values of a sample"""
+    missing = rng.random() < 0.02
+    if missing:
+        alleles = None
+        gt = "./."
+    else:
+        alleles = [
+            rng.randint(1, n_alleles - 1) if rng.random() < freq else 0
+            for _ in range(2)
+        ]
+        alleles.sort()
+        gt = f"{alleles[0]}/{alleles[1]}"
+    depth = rng.randint(5, 60)
+    values = []
+    for field in formats:
+        if field == "GT":
+            values.append(gt)
+        elif field == "GQ":
+            values.append("." if missing else str(rng.randint(1, 99)))
+        elif field == "DP":
+            values.append(str(depth))
+        elif field == "AD":
+            depths = [0] * n_alleles
+            for allele in alleles or [0]:
+                depths[allele] += depth // 2
+            values.append(",".join(map(str, depths)))
+    return ":".join(values), depth
+
+
+def generate_lines(
+    n_variants=10000,
+    n_samples=10,
+    multiallelic=0.05,
+    formats=("GT", "GQ", "DP", "AD"),
+    n_contigs=5,
+    seed=8525,
+):
+    """Generate the lines of a synthetic VCF file.
+
+    The variants are spread evenly over `n_contigs` contigs, a fraction
+    of `multiallelic` of them have two ALT alleles. The same arguments
+    always generate the same lines.
+    """
+    unknown = set(formats) - set(FORMAT_FIELDS)
+    if unknown:
+        raise ValueError(
+            f"Unknown FORMAT fields: {sorted(unknown)}, "
+            f"expect some of {list(FORMAT_FIELDS)}."
+        )
+    rng = random.Random(seed)
+    per_contig = -(-n_variants // n_contigs)
+    contig_length = per_contig * 200 + 1000
+    yield from _header(n_samples, n_contigs, contig_length, formats)
+
+    n_written = 0
+    for contig in _contigs(n_contigs):
+        pos = 0
+        for _ in range(min(per_contig, n_variants - n_written)):
+            pos += rng.randint(1, 300)
+            ref, alts = _alleles(rng, multiallelic)
+            freq = rng.betavariate(0.5, 2)
+            qual = round(rng.uniform(1, 1000), 1)
+            filt = "LowQual" if qual < 30 else "PASS"
+            samples = [
+                _sample(rng, len(alts) + 1, freq, formats)
+                for _ in range(n_samples)
+            ]
+            depth = sum(dp for _, dp in samples) or rng.randint(5, 60)
+            afs = ",".join(f"{freq / len(alts):.4f}" for _ in alts)
+            fields = [
+                contig,
+                str(pos),
+                ".",
+                ref,
+                ",".join(alts),
+                str(qual),
+                filt,
+                f"DP={depth};AF={afs}",
+            ]
+            if formats and n_samples:
+                fields.append(":".join(formats))
+                fields.extend(values for values, _ in samples)
+            yield "\t".join(fields)
+            n_written += 1
+
+
+def write_vcf(path, index=True, **kwargs):
+    """Write a synthetic VCF file, see `generate_lines` for the arguments.
+
+    The format is decided by the extension: `.vcf`, `.vcf.gz` (bgzipped)
+    or `.bcf`. Compressed files are indexed if `index` is True and
+    `tabix`/`bcftools` is available.
+    Returns the path of the file.
+    """
+    path = Path(path)
+    name = path.name
+    plain = (
+        path if name.endswith(".vcf") else path.with_name(name + ".tmp.vcf")
+    )
+    with open(plain, "w") as fout:
+        for line in generate_lines(**kwargs):
+            fout.write(line + "\n")
+    if plain == path:
+        return path
+
+    if name.endswith(".vcf.gz"):
+        mode = "wz"
+    elif name.endswith(".bcf"):
+        mode = "wb"
+    else:
+        plain.unlink()
+        raise ValueError(f"Expect a .vcf, .vcf.gz or .bcf file, got {path}")
+
+    template = VCF(str(plain))
+    writer = Writer(str(path), template, mode=mode)
+    for variant in template:
+        writer.write_record(variant)
+    writer.close()
+    template.close()
+    plain.unlink()
+
+    if index:
+        if mode == "wz" and shutil.which("tabix"):
+            subprocess.run(["tabix", "-f", "-p", "vcf", str(path)], check=True)
+        elif mode == "wb" and shutil.which("bcftools"):
+            subprocess.run(["bcftools", "index", "-f", str(path)], check=True)
+    return path
@@ -1,7 +1,7 @@
 from vcfstats.macros import continuous, categorical
 
 
-@continuous
+@continuous(fields=("INFO/DP",))
 def INFO_DP(variant):
     """DP from INFO"""
     return variant.INFO["DP"]
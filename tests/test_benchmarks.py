@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from cyvcf2 import VCF
+
+from benchmarks.__main__ import main
+from benchmarks.run import bench_startup, compare
+from benchmarks.synth import generate_lines, write_vcf
+
+
+def test_generate_lines():
+    lines = list(generate_lines(n_variants=100, n_samples=4, seed=1))
+    assert lines == list(generate_lines(n_variants=100, n_samples=4, seed=1))
+    assert lines != list(generate_lines(n_variants=100, n_samples=4, seed=2))
+
+    records = [line for line in lines if not line.startswith("#")]
+    assert len(records) == 100
+    assert lines[len(lines) - 101].split("\t")[9:] == ["S0", "S1", "S2", "S3"]
+    assert all(len(rec.split("\t")) == 13 for rec in records)
+    assert {rec.split("\t")[8] for rec in records} == {"GT:GQ:DP:AD"}
+
+    with pytest.raises(ValueError, match="Unknown FORMAT fields"):
+        list(generate_lines(formats=("GT", "PL")))
+
+
+@pytest.mark.parametrize("multiallelic", [0, 0.5, 1])
+def test_generate_lines_multiallelic(multiallelic):
+    records = [
+        line.split("\t")
+        for line in generate_lines(
+            n_variants=1000, n_samples=0, multiallelic=multiallelic
+        )
+        if not line.startswith("#")
+    ]
+    assert len(records[0]) == 8
+    fraction = sum("," in rec[4] for rec in records) / len(records)
+    assert fraction == pytest.approx(multiallelic, abs=0.05)
+
+
+@pytest.mark.parametrize("ext", ["vcf", "vcf.gz", "bcf"])
+def test_write_vcf(tmp_path, ext):
+    vcffile = write_vcf(
+        tmp_path / f"synthetic.{ext}",
+        n_variants=50,
+        n_samples=3,
+        formats=("GT", "DP"),
+    )
+    assert list(tmp_path.glob("*.tmp.vcf")) == []
+    vcf = VCF(str(vcffile))
+    assert vcf.samples == ["S0", "S1", "S2"]
+    variants = list(vcf)
+    assert len(variants) == 50
+    assert variants[0].format("DP").shape == (3, 1)
+    if ext == "vcf.gz":
+        assert len(list(vcf("1"))) == 10
+
+    with pytest.raises(ValueError, match="Expect a .vcf"):
+        write_vcf(tmp_path / "synthetic.txt")
+
+
+def test_bench_startup():
+    results = bench_startup(None, repeat=1)
+    assert list(results) == ["startup/import", "startup/list", "startup/help"]
+    assert all(len(result["runs"]) == 1 for result in results.values())
+
+
+def test_compare():
+    baseline = {
+        "a": {"median": 1.0},
+        "b": {"median": 1.0},
+        "c": {"median": 1.0},
+        "d": {"median": 1.0},
+    }
+    current = {
+        "a": {"median": 1.05},
+        "b": {"median": 1.5},
+        "c": {"median": 0.5},
+        "e": {"median": 1.0},
+    }
+    rows = {row[0]: row[-1] for row in compare(baseline, current, 0.1)}
+    assert rows == {
+        "a": "ok",
+        "b": "regression",
+        "c": "improvement",
+        "d": "removed",
+        "e": "new",
+    }
+
+
+def test_main(tmp_path):
+    output = tmp_path / "results.json"
+    args = ["run", "--variants", "200", "--samples", "3", "--repeat", "1"]
+    args += ["--stages", "parse", "scan", "-o", str(output)]
+    assert main(args) == 0
+    results = json.loads(output.read_text())
+    assert results["meta"]["params"]["variants"] == 200
+    assert "scan/(read)" in results["results"]
+    assert "scan/QUAL" in results["results"]
+    assert "scan/TITV ~ CONTIG" in results["results"]
+    assert not any(name.startswith("plot/") for name in results["results"])
+
+    assert main(["compare", str(output), str(output)]) == 0
+    for result in results["results"].values():
+        result["median"] /= 10
+    faster = tmp_path / "faster.json"
+    faster.write_text(json.dumps(results))
+    assert main(["compare", str(faster), str(output)]) == 1
@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy
+import pytest
+from cyvcf2 import VCF
+
+from vcfstats.block import Block, iter_blocks
+
+HERE = Path(__file__).parent.resolve()
+
+
+@pytest.fixture(scope="module")
+def variants():
+    vcf = VCF(
+        str(HERE.parent.joinpath("examples", "sample.vcf")),
+        gts012=True,
+    )
+    return list(vcf)
+
+
+def test_block_columns(variants):
+    block = Block(variants[:7])
+    assert len(block) == 7
+    assert block.CHROM.tolist() == ["1"] * 7
+    assert block.POS.tolist() == [var.POS for var in variants[:7]]
+    assert block.QUAL.tolist() == [var.QUAL for var in variants[:7]]
+    assert block.passed.tolist() == [not var.FILTER for var in variants[:7]]
+    assert block.nalt.tolist() == [len(var.ALT) for var in variants[:7]]
+    assert block.aaf.tolist() == [var.aaf for var in variants[:7]]
+    assert block.gt_types.shape == (7, 4)
+    numpy.testing.assert_array_equal(block.gt_types[6], variants[6].gt_types)
+    numpy.testing.assert_array_equal(block.gt_quals[0], variants[0].gt_quals)
+
+
+def test_block_empty():
+    block = Block([])
+    assert len(block) == 0
+    assert block.gt_types.shape == (0, 0)
+
+
+def test_iter_blocks(variants):
+    blocks = list(iter_blocks(variants, size=10))
+    assert [len(block) for block in blocks] == [10] * 10 + [6]
+    assert blocks[-1].variants == variants[-6:]
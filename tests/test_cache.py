@@ -0,0 +1,127 @@
+import os
+import time
+from subprocess import run
+
+import pytest
+
+from vcfstats.cache import CACHE_SUFFIX, ResultCache, file_digest
+from vcfstats.columns import Columns
+
+from .test_init import HERE
+
+
+def cache_files(cache_dir):
+    return sorted(
+        fname for fname in os.listdir(cache_dir) if fname.endswith(CACHE_SUFFIX)
+    )
+
+
+def test_file_digest(tmp_path):
+    afile = tmp_path / "a.py"
+    afile.write_text("a")
+    digest = file_digest(afile)
+    assert len(digest) == 64
+    afile.write_text("b")
+    assert file_digest(afile) != digest
+
+
+def test_cache_load_save(tmp_path):
+    cache = ResultCache(tmp_path, 1024 * 1024, 3600)
+    assert cache.load("a") is None
+
+    data = Columns(["X", "Y"], ["continuous", "categorical"])
+    data.extend([(1, "a"), (2, "b")])
+    cache.save("a", data)
+    loaded = cache.load("a")
+    assert loaded.to_frame().equals(data.to_frame())
+
+    # corrupted
+    (tmp_path / f"b{CACHE_SUFFIX}").write_bytes(b"x")
+    assert cache.load("b") is None
+    assert cache_files(tmp_path) == [f"a{CACHE_SUFFIX}"]
+
+
+def test_cache_evict(tmp_path):
+    cache = ResultCache(tmp_path, 1024 * 1024, 3600)
+    for key in "abc":
+        cache.save(key, b"x" * 1000)
+    now = time.time()
+    # a is expired, b is used before c
+    os.utime(tmp_path / f"a{CACHE_SUFFIX}", (now, now - 7200))
+    os.utime(tmp_path / f"b{CACHE_SUFFIX}", (now, now - 100))
+    assert cache.load("a") is None
+    cache.max_size = 1500
+    cache.evict()
+    assert cache_files(tmp_path) == [f"c{CACHE_SUFFIX}"]
+
+    cache.max_size = 2500
+    cache.save("d", b"x" * 1000)
+    os.utime(tmp_path / f"d{CACHE_SUFFIX}", (now, now - 50))
+    cache.load("c")
+    cache.max_size = 1500
+    cache.save("e", b"x" * 10)
+    # d is the least recently used
+    assert cache_files(tmp_path) == [f"c{CACHE_SUFFIX}", f"e{CACHE_SUFFIX}"]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_cache(tmp_path, jobs):
+    vcffile = tmp_path / "sample.vcf.gz"
+    run(
+        ["bgzip", "-c", str(HERE.parent.joinpath("examples", "sample.vcf"))],
+        check=True,
+        stdout=vcffile.open("wb"),
+    )
+    run(["tabix", "-p", "vcf", str(vcffile)], check=True)
+
+    def vcfstats(outdir, formulas, figtypes):
+        outdir = tmp_path / outdir
+        outdir.mkdir()
+        cmd = run(
+            [
+                "python",
+                "-m",
+                "vcfstats",
+                "--vcf",
+                str(vcffile),
+                "--outdir",
+                str(outdir),
+                "--formula",
+                *formulas,
+                "--title",
+                *(f"plot{i}" for i in range(len(formulas))),
+                "--figtype",
+                *figtypes,
+                "--save",
+                "--jobs",
+                jobs,
+                "--cache-dir",
+                str(tmp_path / "cache"),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        assert cmd.returncode == 0, cmd.stderr
+        return cmd.stdout + cmd.stderr, [
+            (outdir / f"plot{i}.csv").read_text()
+            for i in range(len(formulas))
+        ]
+
+    out1, data1 = vcfstats("run1", ["AAF ~ CONTIG"], ["violin"])
+    assert "loaded from cache" not in out1
+    assert len(cache_files(tmp_path / "cache")) == 1
+
+    # only the plotting options are changed
+    out2, data2 = vcfstats(
+        "run2", ["AAF ~ CONTIG", "COUNT(1) ~ CONTIG"], ["boxplot", "col"]
+    )
+    assert "plot0: data loaded from cache" in out2
+    assert "plot1: data loaded from cache" not in out2
+    assert data2[0] == data1[0]
+    assert len(cache_files(tmp_path / "cache")) == 2
+
+    out3, data3 = vcfstats(
+        "run3", ["AAF ~ CONTIG", "COUNT(1) ~ CONTIG"], ["boxplot", "col"]
+    )
+    assert "variants read" not in out3
+    assert data3 == data2
@@ -0,0 +1,213 @@
+from argparse import Namespace
+from subprocess import run
+
+import pytest
+from cyvcf2 import VCF
+
+from vcfstats import cli
+from vcfstats.block import iter_blocks
+from vcfstats.checkpoint import (
+    Checkpoint,
+    fingerprint,
+    resume_regions,
+    skip_variants,
+)
+from vcfstats.cli import get_instances, scan_serial, scan_variants
+from vcfstats.formula import MACRO_CACHE
+
+from .test_init import HERE
+
+FORMULAS = [
+    "COUNT(1, group=VARTYPE) ~ CONTIG",
+    "AAF ~ CONTIG",
+    "MEAN(QUAL, group=CONTIG) ~ SUM(NALT, group=CONTIG)",
+]
+
+
+@pytest.fixture
+def vcffile(tmp_path):
+    ovcf = HERE.parent.joinpath("examples", "sample.vcf")
+    nvcf = tmp_path / "sample.vcf.gz"
+    run(["bgzip", "-c", str(ovcf)], check=True, stdout=nvcf.open("wb"))
+    run(["tabix", "-p", "vcf", str(nvcf)], check=True)
+    return nvcf
+
+
+def get_opts(vcffile, outdir, regions=None):
+    return Namespace(
+        vcf=vcffile,
+        outdir=outdir,
+        formula=FORMULAS,
+        title=[f"title{i}" for i in range(len(FORMULAS))],
+        ggs=[],
+        figtype=[],
+        figfmt=[],
+        passed=False,
+        savedata=False,
+        bins=0,
+        binrange=[],
+        max_points=[],
+        sketch=0,
+        macro=None,
+        devpars=Namespace(),
+        region=regions or [],
+    )
+
+
+def get_frames(ones):
+    frames = []
+    for instance in ones:
+        instance.summarize()
+        frames.append(instance.data.to_frame())
+    return frames
+
+
+def interrupt_blocks(n_blocks):
+    """Scan in blocks of 10 variants, and get killed after n_blocks"""
+
+    def _iter_blocks(variants):
+        for i, block in enumerate(iter_blocks(variants, 10)):
+            if i == n_blocks:
+                raise KeyboardInterrupt
+            yield block
+
+    return _iter_blocks
+
+
+def test_resume_regions():
+    regions = ["1", "2:10-200", "2:300-400", "3", "HLA-A:10-20"]
+    assert resume_regions(regions, "1", 100) == [
+        "1:100-",
+        *regions[1:],
+    ]
+    assert resume_regions(regions, "2", 100) == ["2:100-200", *regions[2:]]
+    assert resume_regions(regions, "2", 250) == regions[2:]
+    assert resume_regions(regions, "2", 500) == regions[3:]
+    assert resume_regions(regions, "HLA-A", 12) == ["HLA-A:12-20"]
+    assert resume_regions(regions, "4", 12) == []
+
+
+def test_skip_variants():
+    variants = [
+        Namespace(CHROM=chrom, POS=pos)
+        for chrom, pos in [
+            ("1", 1),
+            ("1", 2),
+            ("1", 2),
+            ("1", 2),
+            ("1", 3),
+            ("1", 2),
+        ]
+    ]
+    assert [
+        var.POS for var in skip_variants(variants, "1", 2, 2)
+    ] == [2, 3, 2]
+    assert [var.POS for var in skip_variants(variants, "1", 4, 0)] == []
+    variants.append(Namespace(CHROM="2", POS=1))
+    assert [var.POS for var in skip_variants(variants, "1", 4, 0)] == [1]
+
+
+@pytest.mark.parametrize(
+    "regions, indexed",
+    [
+        ([], True),
+        (["1", "2:10000-300000", "3", "X"], True),
+        ([], False),
+    ],
+)
+def test_resume(vcffile, tmp_path, monkeypatch, regions, indexed):
+    if not indexed:
+        vcffile = HERE.parent.joinpath("examples", "sample.vcf")
+    opts = get_opts(vcffile, tmp_path, regions)
+
+    # the expected results from a scan without checkpoints
+    vcf, samples = cli.get_vcf_by_regions(vcffile, regions)
+    expected_ones = get_instances(opts, samples, {})
+    expected_n = scan_variants(vcf, expected_ones)
+    expected = get_frames(expected_ones)
+
+    ckpdir = tmp_path / "checkpoint"
+    key = fingerprint(opts, regions)
+    monkeypatch.setattr(cli, "iter_blocks", interrupt_blocks(3))
+    ones = get_instances(opts, samples, {})
+    with pytest.raises(KeyboardInterrupt):
+        scan_serial(vcffile, regions, ones, Checkpoint(ckpdir, 20, key))
+
+    # saved at 20 variants, the 3rd block is lost
+    checkpoint = Checkpoint(ckpdir, 20, key).load("serial")
+    assert checkpoint["n_variants"] == 20
+    assert not checkpoint["done"]
+
+    monkeypatch.setattr(cli, "iter_blocks", interrupt_blocks(None))
+    MACRO_CACHE.reset()
+    ones = get_instances(opts, samples, {})
+    n_variants = scan_serial(vcffile, regions, ones, Checkpoint(ckpdir, 20, key))
+    assert n_variants == expected_n
+    for frame, expected_frame in zip(get_frames(ones), expected):
+        assert frame.equals(expected_frame)
+
+    # resuming a finished scan reads nothing
+    ones = get_instances(opts, samples, {})
+    checkpoint = Checkpoint(ckpdir, 20, key)
+    assert scan_serial(vcffile, regions, ones, checkpoint) == expected_n
+    for frame, expected_frame in zip(get_frames(ones), expected):
+        assert frame.equals(expected_frame)
+
+
+def test_checkpoint_ignored(vcffile, tmp_path, caplog):
+    opts = get_opts(vcffile, tmp_path)
+    samples = VCF(str(vcffile)).samples
+    ones = get_instances(opts, samples, {})
+    checkpoint = Checkpoint(tmp_path, 20, fingerprint(opts, []))
+    checkpoint.save(ones, "parallel", chunks=1)
+    assert checkpoint.load("parallel")["chunks"] == 1
+    assert checkpoint.load("serial") is None
+    assert "cannot be resumed by a serial scan" in caplog.text
+
+    opts.formula = FORMULAS[:1]
+    checkpoint = Checkpoint(tmp_path, 20, fingerprint(opts, []))
+    assert checkpoint.load("parallel") is None
+    assert "saved by a different run" in caplog.text
+
+
+def test_main_checkpoint(vcffile, tmp_path):
+    outputs = []
+    for jobs in ("1", "2", "2"):
+        outdir = tmp_path / f"jobs{len(outputs)}"
+        outdir.mkdir()
+        cmd = run(
+            [
+                "python",
+                "-m",
+                "vcfstats",
+                "--vcf",
+                str(vcffile),
+                "--outdir",
+                str(outdir),
+                "--formula",
+                *FORMULAS[:2],
+                "--title",
+                "counts",
+                "aafs",
+                "--save",
+                "--jobs",
+                jobs,
+                "--checkpoint",
+                str(tmp_path / f"checkpoint{jobs}"),
+                "--checkpoint-every",
+                "10",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        assert cmd.returncode == 0, cmd.stderr
+        outputs.append(
+            [
+                (outdir / "counts.csv").read_text(),
+                (outdir / "aafs.csv").read_text(),
+            ]
+        )
+
+    # the last run resumed from the checkpoint of the parallel scan
+    assert "Resuming from checkpoint" in cmd.stdout + cmd.stderr
+    assert outputs[0] == outputs[1] == outputs[2]
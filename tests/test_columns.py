@@ -0,0 +1,406 @@
+import pickle
+
+import numpy
+import pandas
+import pytest
+
+from vcfstats import columns as columns_module
+from vcfstats.columns import (
+    Bins,
+    Buffer,
+    CategoricalColumn,
+    Columns,
+    FileStack,
+    NumericColumn,
+    Reservoir,
+    Summaries,
+)
+
+
+def test_buffer():
+    buffer = Buffer(numpy.int64)
+    buffer.extend(numpy.arange(3000))
+    assert len(buffer) == 3000
+    assert buffer.nbytes == 4096 * 8
+    assert buffer.view().tolist() == list(range(3000))
+
+    buffer2 = pickle.loads(pickle.dumps(buffer))
+    assert len(buffer2.array) == 3000
+    buffer2.extend([1])
+    assert buffer2.view()[-2:].tolist() == [2999, 1]
+
+
+def test_numeric_column():
+    column = NumericColumn("x")
+    column.extend((1, 2))
+    assert column.values().dtype == numpy.int64
+    column.extend([numpy.float32(0.5)])
+    assert column.values().dtype == numpy.float64
+    column.extend([None, 3])
+    values = column.values()
+    assert values[:3].tolist() == [1.0, 2.0, 0.5]
+    assert numpy.isnan(values[3])
+    assert values[4] == 3.0
+
+    column2 = NumericColumn("x")
+    column2.extend([True, 4])
+    column2.merge(column)
+    assert column2.values().dtype == numpy.float64
+    assert len(column2) == 7
+
+
+def test_categorical_column():
+    column = CategoricalColumn("x")
+    column.extend(("b", "a", "b", None))
+    assert column.levels == ["b", "a"]
+    assert column.buffer.view().tolist() == [0, 1, 0, -1]
+    column.extend(numpy.array(["c", "a", "c"], dtype=object))
+    assert column.levels == ["b", "a", "c"]
+    assert column.buffer.view().tolist() == [0, 1, 0, -1, 2, 1, 2]
+
+    values = column.values()
+    assert isinstance(values, pandas.Categorical)
+    assert list(values.categories) == ["a", "b", "c"]
+    assert values.tolist()[:3] == ["b", "a", "b"]
+    assert pandas.isna(values[3])
+
+    column2 = CategoricalColumn("x")
+    column2.extend(["d", "a"])
+    column2.merge(column)
+    assert column2.values().tolist()[:4] == ["d", "a", "b", "a"]
+    assert pandas.isna(column2.values()[5])
+
+    # mixed types are not sorted
+    column3 = CategoricalColumn("x")
+    column3.extend([2, "a", 1])
+    assert list(column3.values().categories) == [2, "a", 1]
+
+
+def test_categorical_column_levels():
+    levels = ("HOM_REF", "HET", "HOM_ALT", "UNKNOWN")
+    column = CategoricalColumn("GTTYPEs", levels)
+    assert column.coded
+    # the values are the codes
+    column.extend((1, 0, 1))
+    column.extend(numpy.array([[3, 1]]).ravel())
+    assert column.buffer.view().tolist() == [1, 0, 1, 3, 1]
+
+    values = column.values()
+    # in the declared order, without the unused levels
+    assert list(values.categories) == ["HOM_REF", "HET", "UNKNOWN"]
+    assert values.tolist() == ["HET", "HOM_REF", "HET", "UNKNOWN", "HET"]
+
+    column2 = CategoricalColumn("GTTYPEs", levels)
+    column2.extend([2])
+    column2.merge(pickle.loads(pickle.dumps(column)))
+    assert column2.buffer.view().tolist() == [2, 1, 0, 1, 3, 1]
+
+    # decoded when merged into a column without the levels
+    column3 = CategoricalColumn("GTTYPEs")
+    column3.extend(["HET"])
+    column3.merge(column)
+    assert column3.values().tolist()[:3] == ["HET", "HET", "HOM_REF"]
+
+    columns = Columns(
+        ["GTTYPEs", "CHROM"], ["categorical"] * 2, [levels, None]
+    )
+    columns.extend([(0, "1"), (2, "2")])
+    assert columns.to_frame().values.tolist() == [
+        ["HOM_REF", "1"],
+        ["HOM_ALT", "2"],
+    ]
+
+
+def test_columns():
+    data = Columns(["AAF", "AAF", "Group"], ["continuous", "continuous", "categorical"])
+    data.append((0.1, 1, "x"))
+    data.extend(((0.2, 2, "y"), (0.3, 3, "x")))
+    data.extend(())
+    data.extend_columns(
+        numpy.array([0.4]), numpy.array([4]), numpy.array(["z"], dtype=object)
+    )
+    assert len(data) == 4
+    assert data.names == ["AAF", "AAF", "Group"]
+    assert data.nbytes > 0
+
+    df = data.to_frame()
+    assert df.shape == (4, 3)
+    assert list(df.columns) == ["AAF", "AAF", "Group"]
+    assert df.iloc[:, 1].tolist() == [1, 2, 3, 4]
+    assert df.iloc[:, 2].tolist() == ["x", "y", "x", "z"]
+    # not copied
+    assert numpy.shares_memory(
+        df.iloc[:, 0].values, data.columns[0].values()
+    )
+
+    data2 = pickle.loads(pickle.dumps(data))
+    data2.merge(data)
+    assert len(data2) == 8
+    assert data2.to_frame().iloc[4:, 2].tolist() == ["x", "y", "x", "z"]
+
+
+def test_columns_staged(monkeypatch):
+    monkeypatch.setattr(columns_module, "FLUSH_ROWS", 3)
+    data = Columns(["AAF", "Group"], ["continuous", "categorical"])
+    extends = []
+    monkeypatch.setattr(
+        data.columns[0], "extend", lambda values: extends.append(values)
+    )
+    data.append((0.1, "x"))
+    data.extend(((0.2, "y"),))
+    # the rows are staged, not converted one by one
+    assert extends == []
+    assert len(data) == 2
+    data.append((0.3, "x"))
+    assert extends == [(0.1, 0.2, 0.3)]
+    assert data.staged == []
+    data.extend(((0.4, "z"),))
+    data.flush()
+    data.flush()
+    assert extends == [(0.1, 0.2, 0.3), (0.4,)]
+    assert data.columns[1].values().tolist() == ["x", "y", "x", "z"]
+
+    # staged rows are converted when the data is read or pickled
+    data = Columns(["AAF", "Group"], ["continuous", "categorical"])
+    data.append((0.1, "x"))
+    assert len(pickle.loads(pickle.dumps(data)).columns[0]) == 1
+    data.append((0.2, "y"))
+    assert data.to_frame()["AAF"].tolist() == [0.1, 0.2]
+    data.append((0.3, "x"))
+    data.extend_columns(numpy.array([0.4]), numpy.array(["z"], dtype=object))
+    assert data.to_frame()["AAF"].tolist() == [0.1, 0.2, 0.3, 0.4]
+
+
+def test_columns_empty():
+    data = Columns(["COUNT(_ONE)", "CHROM"], ["continuous", "categorical"])
+    df = data.to_frame()
+    assert df.shape == (0, 2)
+    with pytest.raises(KeyError):
+        Columns(["x"], ["unknown"])
+
+
+def test_bins():
+    bins = Bins(["AAF", "CHROM"], 4, (0, 1))
+    assert bins.binrange == (0.0, 1.0)
+    assert bins.width == 0.25
+    bins.extend([(0.0, "1"), (0.3, "1"), (1.0, "1"), (1.5, "2"), (None, "2")])
+    bins.append((float("nan"), "1"))
+    assert bins.counts == {"1": {0: 1, 1: 1, 3: 1}, "2": {6: 1}}
+    assert len(bins) == 4
+    assert bins.nbytes > 0
+
+    df = bins.to_frame()
+    assert list(df.columns) == ["AAF", "CHROM", "Count"]
+    assert df["CHROM"].tolist() == ["1"] * 4 + ["2"]
+    assert df["AAF"].tolist() == [0.125, 0.375, 0.625, 0.875, 1.625]
+    assert df["Count"].tolist() == [1, 1, 0, 1, 1]
+
+    columns = bins.to_columns()
+    assert columns.names == ["AAF", "CHROM", "Count"]
+    assert [column.type for column in columns.columns] == [
+        "continuous",
+        "categorical",
+        "continuous",
+    ]
+    assert columns.to_frame().equals(df.astype({"CHROM": "category"}))
+
+
+def test_bins_columns():
+    values = numpy.array([0.0, 0.3, 1.0, 1.5, numpy.nan, 0.1])
+    groups = numpy.array(["2", "1", "1", "2", "1", "2"], dtype=object)
+    bins = Bins(["AAF", "CHROM"], 4, (0, 1))
+    bins.extend_columns(values, groups)
+    bins2 = Bins(["AAF", "CHROM"], 4, (0, 1))
+    bins2.extend(zip(values.tolist(), groups.tolist()))
+    assert bins.counts == bins2.counts
+    assert list(bins.counts) == ["2", "1"]
+
+    bins.merge(bins2)
+    assert bins.counts["2"] == {0: 4, 6: 2}
+    bins3 = Bins(["AAF", "CHROM"], 5, (0, 1))
+    bins3.append((0.5, "1"))
+    with pytest.raises(ValueError):
+        bins.merge(bins3)
+
+
+def test_summaries():
+    values = numpy.array([1.0, 5.0, 2.0, numpy.nan, 4.0, 3.0, 10.0])
+    groups = numpy.array(["2", "1", "1", "2", "1", "1", "2"], dtype=object)
+    summaries = Summaries(["QUAL", "CHROM"], 50)
+    summaries.extend_columns(values, groups)
+    assert len(summaries) == 6
+    assert list(summaries.sketches) == ["2", "1"]
+
+    other = Summaries(["QUAL", "CHROM"], 50)
+    other.append((6.0, "3"))
+    other.append((6.0, "1"))
+    summaries.merge(pickle.loads(pickle.dumps(other)))
+    df = summaries.to_frame()
+    assert df.columns.tolist() == [
+        "CHROM", "Min", "Q1", "Median", "Q3", "Max", "Count"
+    ]
+    assert df.CHROM.tolist() == ["2", "1", "3"]
+    assert df.iloc[1, 1:].tolist() == [2.0, 3.0, 4.0, 5.0, 6.0, 5]
+    assert df.Count.tolist() == [2, 5, 1]
+
+    columns = summaries.to_columns()
+    assert columns.names == df.columns.tolist()
+    assert columns.to_frame().values.tolist() == df.values.tolist()
+    assert Summaries(["QUAL", "CHROM"], 50).to_frame().shape == (0, 7)
+
+
+def test_levels_groups():
+    levels = [None, ("snp", "indel")]
+    bins = Bins(["AAF", "VARTYPE"], 2, (0, 1), levels)
+    bins.extend_columns(numpy.array([0.1, 0.2, 0.9]), numpy.array([1, 0, 1]))
+    assert list(bins.counts) == [1, 0]
+    df = bins.to_frame()
+    assert df.VARTYPE.tolist() == ["indel", "indel", "snp"]
+    assert bins.to_columns().to_frame().values.tolist() == df.values.tolist()
+
+    summaries = Summaries(["AAF", "VARTYPE"], 50, levels)
+    summaries.extend([(0.1, 1), (0.2, 0)])
+    assert summaries.to_frame().VARTYPE.tolist() == ["indel", "snp"]
+    assert summaries.to_columns().to_frame().VARTYPE.tolist() == [
+        "indel", "snp"
+    ]
+
+    res = Reservoir(
+        ["X", "Y", "Group"],
+        ["continuous", "continuous", "categorical"],
+        10,
+        levels=[None, None, ("snp", "indel")],
+    )
+    res.extend([(1, 1, 0), (2, 2, 1), (3, 3, 0)])
+    assert res.rates() == {None: (3, 3), "snp": (2, 2), "indel": (1, 1)}
+    assert res.to_frame().Group.tolist() == ["snp", "snp", "indel"]
+
+    stack = FileStack({"a": bins, "b": bins})
+    columns = stack.to_columns()
+    assert columns.columns[1].coded
+    assert columns.to_frame().VARTYPE.tolist() == df.VARTYPE.tolist() * 2
+
+
+def test_bins_auto_range(monkeypatch):
+    monkeypatch.setattr(columns_module, "AUTO_RANGE_SAMPLE", 4)
+    bins = Bins(["QUAL", "ONE"], 2)
+    assert bins.binrange is None
+    bins.extend([(10, 1), (20, 1), (None, 1)])
+    assert bins.binrange is None
+    assert len(bins) == 3
+    bins.extend([(30, 1), (100, 1), (15, 1)])
+    # decided by the first 4 values
+    assert bins.binrange == (10.0, 30.0)
+    assert bins.counts == {1: {0: 2, 1: 2, 9: 1}}
+
+    bins = Bins(["QUAL", "ONE"], 2)
+    bins.extend_columns(numpy.array([5.0]), numpy.array([1]))
+    assert bins.to_frame()["Count"].tolist() == [1]
+    assert bins.binrange == (5.0, 6.0)
+
+    bins = Bins(["QUAL", "ONE"], 2)
+    bins.merge(Bins(["QUAL", "ONE"], 2, (0, 1)))
+    bins.fix_range()
+    assert bins.binrange == (0.0, 1.0)
+
+
+def test_reservoir():
+    res = Reservoir(["X", "Y"], ["continuous", "continuous"], 100)
+    res.extend_columns(numpy.arange(50), numpy.arange(50) * 2)
+    # not full yet, all rows are kept
+    assert len(res) == 50
+    res.extend((i, i * 2) for i in range(50, 1000))
+    res.append((1000, 2000))
+    assert len(res) == 100
+    assert res.rates() == {None: (100, 1001)}
+    df = res.to_frame()
+    assert df.shape == (100, 2)
+    assert df["X"].dtype == numpy.int64
+    assert (df["Y"] == df["X"] * 2).all()
+    assert df["X"].is_unique
+    columns = res.to_columns()
+    assert columns.names == ["X", "Y"]
+    assert len(columns) == 100
+    # not only the first rows
+    assert df["X"].max() >= 100
+
+    # uniform: each row is kept with probability 0.1
+    kept = numpy.zeros(1000)
+    for seed in range(200):
+        res = Reservoir(["X", "Y"], ["continuous", "continuous"], 100, seed)
+        res.extend_columns(numpy.arange(1000), numpy.arange(1000))
+        kept[res.to_frame()["X"].to_numpy()] += 1
+    assert kept[:500].sum() == pytest.approx(kept[500:].sum(), rel=0.1)
+
+
+def test_reservoir_groups():
+    res = Reservoir(
+        ["X", "Y", "Group"], ["continuous", "continuous", "categorical"], 10
+    )
+    res.extend((i, i, "big") for i in range(1000))
+    assert len(res) == 10
+    res.extend_columns(
+        numpy.arange(3), numpy.arange(3), numpy.array(["small"] * 3)
+    )
+    # each group keeps half of the rows
+    assert res.rates() == {
+        None: (8, 1003),
+        "big": (5, 1000),
+        "small": (3, 3),
+    }
+    df = res.to_frame()
+    assert df["Group"].tolist() == ["big"] * 5 + ["small"] * 3
+
+
+def test_reservoir_merge():
+    types = ["continuous", "continuous", "categorical"]
+    res1 = Reservoir(["X", "Y", "Group"], types, 10)
+    res1.extend((i, i, "a") for i in range(100))
+    res2 = Reservoir(["X", "Y", "Group"], types, 10)
+    res2.extend((i, i, "a") for i in range(100, 400))
+    res2.extend((i, i, "b") for i in range(4))
+    res1.merge(pickle.loads(pickle.dumps(res2)))
+    assert res1.rates() == {
+        None: (9, 404),
+        "a": (5, 400),
+        "b": (4, 4),
+    }
+    values = res1.to_frame()["X"]
+    assert len(set(values)) == 9
+
+    res3 = Reservoir(["X", "Y"], types[:2], 10)
+    res3.merge(Reservoir(["X", "Y"], types[:2], 10))
+    assert len(res3) == 0
+    assert res3.to_frame().shape == (0, 2)
+
+
+def test_filestack():
+    bins1 = Bins(["QUAL", "ONE"], 2, (0, 10))
+    bins1.extend([(1, 1), (6, 1), (7, 1)])
+    bins2 = Bins(["QUAL", "ONE"], 2, (0, 10))
+    bins2.extend([(2, 1)])
+    stack = FileStack({"a": bins1, "b": pickle.loads(pickle.dumps(bins2))})
+    assert len(stack) == 4
+    assert stack.width == 5
+    assert stack.nbytes == bins1.nbytes + bins2.nbytes
+    df = stack.to_frame()
+    assert df.columns.tolist() == ["QUAL", "ONE", "Count", "FILE"]
+    assert df.Count.tolist() == [1, 2, 1]
+    assert df.FILE.tolist() == ["a", "a", "b"]
+
+    types = ["continuous", "continuous", "categorical"]
+    res1 = Reservoir(["X", "Y", "Group"], types, 4)
+    res1.extend((i, i, "g") for i in range(10))
+    res2 = Reservoir(["X", "Y", "Group"], types, 4)
+    res2.extend((i, i, "g") for i in range(2))
+    stack = FileStack({"a": res1, "b": res2}, name="VCF")
+    assert stack.rates() == {
+        None: (6, 12),
+        "a": (4, 10),
+        "a/g": (4, 10),
+        "b": (2, 2),
+        "b/g": (2, 2),
+    }
+    columns = stack.to_columns()
+    assert columns.names == ["X", "Y", "Group", "VCF"]
+    assert columns.to_frame().VCF.tolist() == ["a"] * 4 + ["b"] * 2
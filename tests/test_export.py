@@ -0,0 +1,143 @@
+import json
+
+import numpy
+import pytest
+
+from vcfstats.columns import CategoricalColumn, Columns, NumericColumn
+from vcfstats.export import (
+    column_to_arrow,
+    export_instances,
+    to_arrow,
+    unique_names,
+    write_table,
+)
+from vcfstats.instance import Instance
+
+from .test_instance import variants  # noqa: F401
+
+pyarrow = pytest.importorskip("pyarrow")
+
+
+def test_unique_names():
+    assert unique_names(["a", "b"]) == ["a", "b"]
+    assert unique_names(["a", "b", "a"]) == ["a__0", "b", "a__1"]
+
+
+def test_column_to_arrow():
+    column = NumericColumn("X")
+    column.extend([1, 2, 3])
+    assert column_to_arrow(column).type == pyarrow.int64()
+    column.extend([0.5, None])
+    array = column_to_arrow(column)
+    assert array.type == pyarrow.float64()
+    assert array.to_pylist()[:4] == [1.0, 2.0, 3.0, 0.5]
+
+    column = CategoricalColumn("Y")
+    column.extend(["b", "a", None, "b"])
+    array = column_to_arrow(column)
+    assert pyarrow.types.is_dictionary(array.type)
+    assert array.dictionary.to_pylist() == ["b", "a"]
+    assert array.to_pylist() == ["b", "a", None, "b"]
+
+    column = CategoricalColumn("Y")
+    column.extend([1, "a"])
+    assert column_to_arrow(column).to_pylist() == ["1", "a"]
+
+
+@pytest.mark.parametrize("data_format", ["parquet", "feather"])
+def test_write_table(tmp_path, data_format):
+    columns = Columns(["AAF", "CHROM"], ["continuous", "categorical"])
+    columns.extend([(0.1, "1"), (0.2, "2"), (0.3, "1")])
+    table = to_arrow(columns, {"vcfstats.title": "aaf"})
+    outfile = tmp_path / f"data.{data_format}"
+    write_table(table, outfile, data_format)
+
+    if data_format == "parquet":
+        import pyarrow.parquet as pq
+
+        loaded = pq.read_table(outfile)
+    else:
+        import pyarrow.feather as feather
+
+        loaded = feather.read_table(outfile)
+    assert loaded.equals(table)
+    assert loaded.schema.metadata[b"vcfstats.title"] == b"aaf"
+    assert pyarrow.types.is_dictionary(loaded.schema.field("CHROM").type)
+
+    with pytest.raises(ValueError, match="Unknown data format"):
+        write_table(table, outfile, "csv")
+
+
+def test_export_instances(tmp_path, variants):  # noqa: F811
+    formulas = [
+        "AAF ~ CHROM",
+        "AAF ~ 1",
+        "AAF ~ NALT",
+        "AAF ~ AAF",
+        "QUAL ~ CHROM",
+    ]
+    ones = [
+        Instance(
+            formula,
+            f"title{i}",
+            "",
+            {"width": 1000, "height": 1000, "res": 100},
+            tmp_path,
+            ["A", "B", "C", "D"],
+            "boxplot" if i == 4 else None,
+            False,
+            bins=10 if i == 1 else 0,
+            max_points=10 if i == 2 else 0,
+            sketch=50 if i == 4 else 0,
+        )
+        for i, formula in enumerate(formulas)
+    ]
+    for instance in ones:
+        for variant in variants:
+            instance.iterate(variant, None)
+        instance.summarize()
+
+    manifest_file = export_instances(ones, formulas, tmp_path)
+    manifest = json.loads(open(manifest_file).read())
+    assert manifest["format"] == "parquet"
+    entries = manifest["instances"]
+    assert [entry["formula"] for entry in entries] == formulas
+    assert [entry["kind"] for entry in entries] == [
+        "values",
+        "bins",
+        "sample",
+        "values",
+        "summaries",
+    ]
+    assert entries[0]["file"] == "title0.parquet"
+    assert entries[0]["rows"] == 106
+    assert entries[0]["columns"] == [
+        {"name": "AAF", "type": "continuous", "dtype": "double"},
+        {
+            "name": "CHROM",
+            "type": "categorical",
+            "dtype": "dictionary<values=string, indices=int32, ordered=0>",
+        },
+    ]
+    assert entries[1]["bins"]["nbins"] == 10
+    assert entries[2]["rows"] == 10
+    assert entries[2]["sampled"][0] == {"group": None, "kept": 10, "seen": 106}
+    assert [col["name"] for col in entries[3]["columns"]] == [
+        "AAF__0",
+        "AAF__1",
+    ]
+    assert entries[4]["rows"] == 11
+    assert entries[4]["sketch"]["k"] == 50
+    assert [col["name"] for col in entries[4]["columns"]][:3] == [
+        "CHROM",
+        "Min",
+        "Q1",
+    ]
+
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(tmp_path / "title0.parquet")
+    assert table.num_rows == 106
+    assert numpy.allclose(
+        table.column("AAF").to_numpy(), ones[0].data.columns[0].values()
+    )
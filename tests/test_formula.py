@@ -1,11 +1,26 @@
 # from io import StringIO
+from argparse import Namespace
+import pickle
 from pathlib import Path
 
+import numpy
 import pytest
 from cyvcf2 import VCF
 
-from vcfstats.formula import Aggr, Formula, One, Term, parse_subsets
-from vcfstats.macros import cat
+from vcfstats import formula as formula_module
+from vcfstats.block import iter_blocks
+from vcfstats.formula import (
+    MACRO_CACHE,
+    Aggr,
+    Formula,
+    MacroCache,
+    One,
+    Term,
+    WindowStates,
+    parse_subsets,
+    state_nbytes,
+)
+from vcfstats.macros import aggr, cat
 from vcfstats.utils import MACROS
 
 HERE = Path(__file__).parent.resolve()
@@ -119,7 +134,9 @@ def test_term_run(variants):
 
     term = Term("GTTYPEs", None, ["0"])
     term.set_samples(variants[-1])
-    assert term.run(variants[0], None, passed=False) == ["HOM_REF"]
+    # the codes of the levels
+    assert term.levels == ("HOM_REF", "HET", "HOM_ALT", "UNKNOWN")
+    assert term.run(variants[0], None, passed=False) == [0]
 
     term = Term("AAF", [0.126, None])
     # .125
@@ -135,6 +152,32 @@ def test_term_run(variants):
     assert term.run(variants[5], None, passed=False) == ["PASS"]
 
 
+def test_term_compile(variants):
+    term = Term("AAF", [None, None])
+    assert term.subset_check() is None
+    assert term.run(variants[0], None, passed=False) == [0.125]
+
+    term = Term("AAF", ["0.1", "0.2"])
+    check = term.subset_check()
+    assert check([0.1, 0.2])
+    assert not check([0.1, 0.25])
+    # nan is not out of the range
+    assert check([float("nan")])
+
+    term = Term("GTTYPEs", ["HET"], ["B", "D"])
+    # compiled again with the sample indices
+    term.set_samples(["A", "B", "C", "D"])
+    assert term.samples == [1, 3]
+    assert term.run(variants[0], None, passed=False) is False
+    term = Term("GTTYPEs", ["HOM_REF", "HET"], ["B", "D"])
+    term.set_samples(["A", "B", "C", "D"])
+    assert term.subset_codes() == [0, 1]
+    assert term.run(variants[0], None, passed=False) == [0, 1]
+
+    with pytest.raises(ValueError, match="Unknown levels"):
+        Term("GTTYPEs", ["HET", "het"])
+
+
 def test_aggr_init():
     with pytest.raises(ValueError):
         Aggr("COUNT", None)
@@ -165,8 +208,8 @@ def test_aggr_init():
     assert aggr.filter == Term("FILTER", ["PASS"])
     assert aggr.group == Term("VARTYPE", None)
     assert aggr.xgroup is None
-    aggr.setxgroup(Term("GTTYPEs", ["A"]))
-    assert aggr.xgroup == Term("GTTYPEs", ["A"])
+    aggr.setxgroup(Term("GTTYPEs", ["HET"]))
+    assert aggr.xgroup == Term("GTTYPEs", ["HET"])
     assert repr(aggr) == (
         "<Aggr COUNT(<Term _ONE()>, filter=<Term FILTER(subsets=['PASS'])>, "
         "group=<Term VARTYPE()>)>"
@@ -190,6 +233,93 @@ def test_aggr_init():
         Aggr("COUNT", None)
 
 
+def test_aggr_params():
+    aggr = Aggr("QUANTILE", Term("QUAL"), Term("CHROM"), q=0.9)
+    assert aggr.params == {"q": 0.9}
+    assert aggr.name == "QUANTILE(QUAL, q=0.9)"
+    assert Aggr("MEDIAN", Term("QUAL")).name == "MEDIAN(QUAL)"
+
+    formula = Formula(
+        "QUANTILE(QUAL, q=.25, group=CHROM) ~ 1", None, False, "title"
+    )
+    assert formula.Y.params == {"q": 0.25}
+    assert formula.Y.group == Term("CHROM")
+    formula = Formula("QUANTILE(QUAL, q=1) ~ CHROM", None, False, "title")
+    assert formula.Y.params == {"q": 1}
+    # the group as a positional argument before the keyword ones
+    formula = Formula(
+        "QUANTILE(QUAL, VARTYPE, q=0.9) ~ CONTIG", None, False, "title"
+    )
+    assert formula.Y.params == {"q": 0.9}
+    assert formula.Y.group == Term("VARTYPE")
+    assert formula.Y.xgroup == Term("CONTIG")
+    formula = Formula(
+        "QUANTILE(QUAL, q=0.9, filter=FILTER[PASS], CHROM) ~ 1",
+        None,
+        False,
+        "title",
+    )
+    assert formula.Y.params == {"q": 0.9}
+    assert formula.Y.filter == Term("FILTER", ["PASS"])
+    assert formula.Y.group == Term("CHROM")
+
+    with pytest.raises(ValueError, match="Unknown argument"):
+        Aggr("QUANTILE", Term("QUAL"), p=0.9)
+    with pytest.raises(ValueError, match="Unknown argument"):
+        Aggr("COUNT", One(), q=0.9)
+    with pytest.raises(TypeError, match="Expect a number"):
+        Formula("QUANTILE(QUAL, q=CHROM) ~ CHROM", None, False, "t")
+    # the ranges are checked before the scan
+    with pytest.raises(ValueError, match=r"in \[0, 1\], got 1.5"):
+        Formula("QUANTILE(QUAL, VARTYPE, q=1.5) ~ CHROM", None, False, "t")
+    with pytest.raises(ValueError, match=r"in \[2, inf\]"):
+        Aggr("MEDIAN", Term("QUAL"), Term("CHROM"), k=1)
+    # the integer parameters are not truncated
+    with pytest.raises(ValueError, match="to be an integer, got 200.5"):
+        Formula("QUANTILE(QUAL, k=200.5) ~ CHROM", None, False, "t")
+    formula = Formula("MEDIAN(QUAL, k=4e2) ~ CHROM", None, False, "t")
+    assert formula.Y.params == {"k": 400}
+    assert isinstance(formula.Y.params["k"], int)
+    with pytest.raises(TypeError, match="Expect a term"):
+        Formula("COUNT(1, group=2.5) ~ CHROM", None, False, "t")
+
+
+def test_aggr_categorical(variants):
+    with pytest.raises(TypeError, match="categorical"):
+        Aggr("MEAN", Term("SUBST"), Term("CHROM"))
+
+    aggr = Aggr("DISTINCT", Term("SUBST"), Term("CHROM"), p=10)
+    assert aggr.params == {"p": 10}
+    for variant in variants[:-1]:
+        aggr.run(variant, None, passed=False)
+    assert aggr.cache["1"].p == 10
+    substs = {}
+    for variant in variants[:-1]:
+        substs.setdefault(variant.CHROM, set()).add(
+            "{}>{}".format(variant.REF, ",".join(variant.ALT))
+        )
+    assert aggr.dump() == {
+        chrom: len(values) for chrom, values in substs.items()
+    }
+
+    # the documented form with the group as a positional argument
+    formula = Formula("DISTINCT(SUBST, CHROM, p=12) ~ 1", None, False, "t")
+    assert formula.Y.params == {"p": 12}
+    assert formula.Y.group == Term("CHROM")
+    formula.Y.run(variants[0], None, passed=False)
+    # by X (1), then by CHROM
+    assert formula.Y.cache[1]["1"].p == 12
+    # the precision is checked before the scan
+    for p in (20, 3):
+        with pytest.raises(ValueError, match=r"in \[4, 18\]"):
+            Formula(f"DISTINCT(SUBST, CHROM, p={p}) ~ 1", None, False, "t")
+    for param in ("p=10.7", "exact=10.5"):
+        with pytest.raises(ValueError, match="to be an integer"):
+            Formula(f"DISTINCT(SUBST, CHROM, {param}) ~ 1", None, False, "t")
+    formula = Formula("DISTINCT(SUBST, CHROM, p=10.0) ~ 1", None, False, "t")
+    assert formula.Y.params == {"p": 10}
+
+
 def test_aggr_run(variants):
     aggr = Aggr("COUNT", One(), filter=Term("FILTER", ["PASS"]), group=Term("VARTYPE"))
     aggr.run(variants[0], None, passed=True)
@@ -209,30 +339,31 @@ def test_aggr_run(variants):
     with pytest.raises(ValueError):
         aggr4.run(variants[0], None, passed=False)
 
+    # grouped by the codes of snp (0) and indel (1)
     aggr5 = Aggr("COUNT", One(), Term("VARTYPE"))
     aggr5.run(variants[0], None, passed=False)
-    assert aggr5.cache == {"snp": [1]}
+    assert aggr5.cache == {0: 1}
     aggr5.run(variants[1], None, passed=False)
-    assert aggr5.cache == {"snp": [1, 1]}
+    assert aggr5.cache == {0: 2}
     aggr5.run(variants[3], None, passed=False)
-    assert aggr5.cache == {"snp": [1, 1], "indel": [1]}
+    assert aggr5.cache == {0: 2, 1: 1}
 
-    assert aggr5.dump() == {"snp": 2, "indel": 1}
+    assert aggr5.dump() == {0: 2, 1: 1}
 
     aggr5.cache.clear()
     aggr5.setxgroup(Term("FILTER", None))
     aggr5.run(variants[0], None, passed=False)
-    assert aggr5.cache == {"MinMQ": {"snp": [1]}}
+    assert aggr5.cache == {"MinMQ": {0: 1}}
 
     aggr5.cache.clear()
     aggr5.setxgroup(Term("FILTER2", None))
     aggr5.run(variants[0], None, passed=False)
-    assert aggr5.cache == {"MinMQ": {"snp": [1]}}
+    assert aggr5.cache == {"MinMQ": {0: 1}}
     aggr5.run(variants[5], None, passed=False)
-    assert aggr5.cache == {"MinMQ": {"snp": [1]}}
+    assert aggr5.cache == {"MinMQ": {0: 1}}
     aggr5.run(variants[1], None, passed=False)
-    assert aggr5.cache == {"MinMQ": {"snp": [1, 1]}}
-    assert aggr5.dump() == {"MinMQ": [(2, "snp")]}
+    assert aggr5.cache == {"MinMQ": {0: 2}}
+    assert aggr5.dump() == {"MinMQ": [(2, 0)]}
 
     aggr5.setxgroup(Term("GTTYPEs", ["HOM_REF", "HET"]))
     with pytest.raises(ValueError):
@@ -266,6 +397,109 @@ def test_formula_init():
     assert isinstance(fmula.X, Term)
 
 
+@pytest.mark.parametrize(
+    "formula, contigs",
+    [
+        ("AAF ~ CONTIG", None),
+        ("AAF ~ CONTIG[1,2]", {"1", "2"}),
+        ("AAF ~ CHROM[1,2]", {"1", "2"}),
+        ("CONTIG[1,2] ~ CONTIG[2,3]", {"2"}),
+        ("MEAN(AAF, group=CONTIG[1,2]) ~ VARTYPE", {"1", "2"}),
+        ("COUNT(1, CONTIG) ~ MEAN(AAF, filter=CONTIG[1], group=CONTIG)", None),
+        (
+            "COUNT(1, filter=CONTIG[1], group=VARTYPE) ~ "
+            "COUNT(1, filter=CONTIG[2], group=VARTYPE)",
+            {"1", "2"},
+        ),
+    ],
+)
+def test_formula_contigs(variants, formula, contigs):
+    fmula = Formula(formula, None, False, "title")
+    assert fmula.contigs() == contigs
+
+    data = []
+    for variant in variants[:-1]:
+        fmula.run(variant, None, data.append, data.extend)
+    if contigs and isinstance(fmula.Y, Term):
+        assert data
+        assert {row[1] for row in data} <= contigs
+
+
+def test_formula_remap_samples(variants):
+    samples = variants[-1]
+    data = []
+    fmula = Formula("AFs{D,B} ~ GTTYPEs{B,D}", samples, False, "title")
+    fmula.run(variants[0], None, data.append, data.extend)
+
+    subset = []
+    fmula = Formula("AFs{D,B} ~ GTTYPEs{B,D}", samples, False, "title")
+    fmula.remap_samples([1, 3])
+    assert fmula.Y.samples == [1, 0]
+    assert fmula.X.samples == [0, 1]
+    # the values of a reader with only samples B and D
+    variant = Namespace(
+        FILTER=None,
+        gt_alt_freqs=variants[0].gt_alt_freqs[[1, 3]],
+        gt_types=variants[0].gt_types[[1, 3]],
+    )
+    fmula.run(variant, None, subset.append, subset.extend)
+    assert subset == data
+
+    # shared terms are remapped once
+    fmula = Formula(
+        "COUNT(1, group=GTTYPEs{C}) ~ MEAN(AFs{C})", samples, False, "title"
+    )
+    fmula.remap_samples([2])
+    assert fmula.Y.group.samples == [0]
+
+
+def test_formula_parsed(variants, monkeypatch):
+    parser = formula_module.get_parser()
+    parsed = []
+
+    def parse(formula):
+        parsed.append(formula)
+        return parser.parse(formula)
+
+    monkeypatch.setattr(formula_module, "_PARSED", {})
+    monkeypatch.setattr(
+        formula_module, "get_parser", lambda: Namespace(parse=parse)
+    )
+    formula = "MEAN(AFs{C}, group=GTTYPEs{D}) ~ CHROM"
+    fmula1 = Formula(formula, ["A", "B", "C", "D"], False, "title")
+    fmula2 = Formula(formula, ["D", "C", "B", "A"], False, "title")
+    # parsed once, with the samples set for each
+    assert parsed == [formula]
+    assert fmula1.Y.term.samples == [2]
+    assert fmula1.Y.group.samples == [3]
+    assert fmula2.Y.term.samples == [1]
+    assert fmula2.Y.group.samples == [0]
+    assert fmula1.Y.term is not fmula2.Y.term
+    assert fmula1.Y.aggr is fmula2.Y.aggr
+
+    data = []
+    fmula1.run(variants[0], None, data.append, data.extend)
+    assert fmula1.Y.cache
+    assert not fmula2.Y.cache
+
+    # parsed again if a macro is replaced
+    @cat
+    def PARSED_CHROM(variant):
+        return variant.CHROM
+
+    Formula("AAF ~ PARSED_CHROM", None, False, "title")
+    Formula("AAF ~ PARSED_CHROM", None, False, "title")
+    del MACROS["PARSED_CHROM"]
+
+    @cat
+    def PARSED_CHROM(variant):
+        return variant.CHROM
+
+    Formula("AAF ~ PARSED_CHROM", None, False, "title")
+    del MACROS["PARSED_CHROM"]
+    assert parsed == [formula] + ["AAF ~ PARSED_CHROM"] * 2
+
+
 def test_formula_run(variants):
     data = []
     fmula = Formula("AFs{0,1} ~ GTTYPEs{0-2}", variants[-1], False, "title")
@@ -278,22 +512,13 @@ def test_formula_run(variants):
 
     fmula = Formula("GTTYPEs ~ CHROM", variants[-1], False, "title")
     fmula.run(variants[0], None, data.append, data.extend)
-    assert data == [
-        ("HOM_REF", "1"),
-        ("HOM_REF", "1"),
-        ("HOM_REF", "1"),
-        ("HET", "1"),
-    ]
+    assert data == [(0, "1"), (0, "1"), (0, "1"), (1, "1")]
+    assert fmula.levels() == [fmula.Y.levels, None]
 
     data = []
     fmula = Formula("CHROM ~ GTTYPEs", variants[-1], False, "title")
     fmula.run(variants[0], None, data.append, data.extend)
-    assert data == [
-        ("1", "HOM_REF"),
-        ("1", "HOM_REF"),
-        ("1", "HOM_REF"),
-        ("1", "HET"),
-    ]
+    assert data == [("1", 0), ("1", 0), ("1", 0), ("1", 1)]
 
     data = []
     fmula = Formula(
@@ -331,7 +556,7 @@ def test_formula_run(variants):
     fmula.run(variants[0], None, data.append, data.extend)
     fmula.run(variants[1], None, data.append, data.extend)
     assert data == []
-    assert fmula.Y.cache == {"1": [1, 1]}
+    assert fmula.Y.cache == {"1": 2}
     fmula.done(data.append, data.extend)
     assert data == [(2, "1")]
 
@@ -346,4 +571,274 @@ def test_formula_run(variants):
     fmula.run(variants[2], None, data.append, data.extend)
     fmula.run(variants[3], None, data.append, data.extend)
     fmula.done(data.append, data.extend)
-    assert data == [(3, "1", "snp"), (1, "1", "indel")]
+    assert data == [(3, "1", 0), (1, "1", 1)]
+    assert fmula.levels() == [None, None, fmula.Y.group.levels]
+
+
+def test_term_window(variants):
+    term = Term("WINDOW", ["10000"])
+    assert term.window == 10000
+    assert term.subsets is None
+    assert repr(term) == "<Term WINDOW(window=10000)>"
+    assert term == Term("WINDOW", ["1e4"])
+    assert term != Term("WINDOW")
+    assert Term("WINDOW").window == 1_000_000
+    assert term.run(variants[0], None, False) == [
+        (variants[0].POS - 1) // 10000 * 10000
+    ]
+
+    with pytest.raises(KeyError):
+        Term("WINDOW", ["1", "2"])
+    with pytest.raises(ValueError, match="positive integer"):
+        Term("WINDOW", ["0.5"])
+    with pytest.raises(ValueError):
+        Term("WINDOW", ["1Mb"])
+
+
+@pytest.mark.parametrize(
+    "group, xgroup, layout",
+    [
+        ("WINDOW", None, "window"),
+        ("CONTIG", "WINDOW", "contig"),
+        ("WINDOW", "CHROM", "window_x"),
+        ("VARTYPE", "WINDOW", None),
+        ("WINDOW", "VARTYPE", None),
+        ("CONTIG", None, None),
+    ],
+)
+def test_aggr_window_layout(variants, group, xgroup, layout):
+    aggr = Aggr("COUNT", One(), Term(group, ["10000"] * (group == "WINDOW")))
+    if xgroup:
+        aggr.setxgroup(Term(xgroup, ["10000"] * (xgroup == "WINDOW")))
+    assert aggr.window_layout() == layout
+    assert isinstance(aggr.cache, WindowStates) == (layout is not None)
+    for variant in variants[:-1]:
+        aggr.run(variant, None, passed=False)
+    assert sum(
+        sum(count for count, _ in value) if isinstance(value, list) else value
+        for value in aggr.dump().values()
+    ) == len(variants) - 1
+
+
+def test_aggr_nbytes(variants):
+    aggr = Aggr("MEDIAN", Term("QUAL"), Term("CHROM"))
+    assert aggr.nbytes == 0
+    for variant in variants[:-1]:
+        aggr.run(variant, None, passed=False)
+    # the sketches of the groups
+    assert aggr.nbytes == sum(
+        64 + sketch.nbytes for sketch in aggr.cache.values()
+    )
+
+    # the values kept for the aggregations without the streaming hooks
+    assert state_nbytes([1.0] * 100) > state_nbytes([1.0])
+    assert state_nbytes([[1.0] * 100, 2]) > state_nbytes([[1.0], 2])
+
+    aggr = Aggr("COUNT", One(), Term("CONTIG"))
+    aggr.lengths = {"1": 1_000_000}
+    aggr.setxgroup(Term("WINDOW", ["1000"]))
+    aggr.run(variants[0], None, passed=False)
+    # the array of the windows on the contig
+    assert aggr.nbytes >= aggr.cache.arrays["1"].nbytes >= 8000
+
+    fmula = Formula("COUNT(1) ~ MEAN(AAF, group=CHROM)", None, False, "t")
+    fmula.run(variants[0], None, None, None)
+    assert fmula.nbytes == fmula.Y.nbytes + fmula.X.nbytes > 0
+
+
+def test_aggr_window(variants):
+    def get_aggr(lengths=None):
+        aggr = Aggr("COUNT", One(), Term("CONTIG"))
+        aggr.lengths = lengths or {}
+        aggr.setxgroup(Term("WINDOW", ["5000"]))
+        return aggr
+
+    serial = get_aggr({"1": 12000, "2": 5000})
+    for variant in variants[:-1]:
+        serial.run(variant, None, passed=False)
+    # sized from the lengths, grown for the windows beyond
+    assert len(serial.cache.arrays["1"]) == 3
+    assert len(serial.cache.arrays["2"]) >= 2
+    assert serial.cache.arrays["2"][0] is None
+
+    aggr = get_aggr()
+    aggr2 = get_aggr()
+    for variant in variants[:30]:
+        aggr.run(variant, None, passed=False)
+    for variant in variants[30:-1]:
+        aggr2.run(variant, None, passed=False)
+    aggr.merge(pickle.loads(pickle.dumps(aggr2.cache)))
+    assert list(aggr.cache.items()) == list(serial.cache.items())
+
+    expected = {}
+    for variant in variants[:-1]:
+        window = expected.setdefault((variant.POS - 1) // 5000 * 5000, {})
+        window[variant.CHROM] = window.get(variant.CHROM, 0) + 1
+    dumped = serial.dump()
+    # in the order of the positions
+    assert list(dumped) == sorted(expected)
+    assert {
+        start: dict((contig, count) for count, contig in value)
+        for start, value in dumped.items()
+    } == expected
+    assert len(serial.cache) == 0
+
+
+def test_aggr_merge(variants):
+    aggr = Aggr("COUNT", One(), Term("VARTYPE"))
+    aggr.setxgroup(Term("CHROM"))
+    aggr2 = Aggr("COUNT", One(), Term("VARTYPE"))
+    aggr2.setxgroup(Term("CHROM"))
+    serial = Aggr("COUNT", One(), Term("VARTYPE"))
+    serial.setxgroup(Term("CHROM"))
+    for variant in variants[:-1]:
+        serial.run(variant, None, passed=False)
+    for variant in variants[:20]:
+        aggr.run(variant, None, passed=False)
+    for variant in variants[20:-1]:
+        aggr2.run(variant, None, passed=False)
+
+    aggr.merge(aggr2.cache)
+    assert aggr.cache == serial.cache
+    assert list(aggr.cache) == list(serial.cache)
+    assert aggr.dump() == serial.dump()
+
+
+def test_formula_merge(variants):
+    fmula = Formula("COUNT(1) ~ MEAN(AAF, group=CHROM)", None, False, "title")
+    fmula2 = Formula("COUNT(1) ~ MEAN(AAF, group=CHROM)", None, False, "title")
+    for variant in variants[:3]:
+        fmula.run(variant, None, None, None)
+    for variant in variants[3:6]:
+        fmula2.run(variant, None, None, None)
+    state = fmula2.state()
+    assert state["Y"] == {"1": 3}
+    fmula.merge(state)
+
+    data = []
+    fmula.done(data.append, data.extend)
+    assert data == [(6, pytest.approx(1.958333 / 6), "1")]
+
+
+def test_macro_cache(variants):
+    calls = []
+
+    @cat
+    def COUNTED_CHROM(variant):
+        calls.append(variant)
+        return variant.CHROM
+
+    cache = MacroCache()
+    macro = MACROS["COUNTED_CHROM"]
+    assert cache.get(macro, variants[0], None) == "1"
+    assert cache.get(macro, variants[0], None) == "1"
+    assert len(calls) == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.hit_rate() == 0.5
+
+    assert cache.get(macro, variants[13], None) == "2"
+    assert len(calls) == 2
+    cache.reset()
+    assert cache.hits == cache.misses == 0
+    assert cache.hit_rate() == 0.0
+
+    # shared by the terms of different formulas
+    MACRO_CACHE.reset()
+    fmula1 = Formula("AAF ~ COUNTED_CHROM", None, False, "title1")
+    fmula2 = Formula("COUNT(1) ~ COUNTED_CHROM", None, False, "title2")
+    calls.clear()
+    data = []
+    for variant in variants[:3]:
+        fmula1.run(variant, None, data.append, data.extend)
+        fmula2.run(variant, None, data.append, data.extend)
+    assert len(calls) == 3
+    assert MACRO_CACHE.hits == 3
+
+
+def test_aggr_list_fallback(variants):
+    @aggr
+    def MAXIMUM(entries):
+        return max(entries)
+
+    aggr1 = Aggr("MAXIMUM", Term("AAF"), Term("CHROM"))
+    aggr2 = Aggr("MAXIMUM", Term("AAF"), Term("CHROM"))
+    for variant in variants[:3]:
+        aggr1.run(variant, None, passed=False)
+    for variant in variants[3:6]:
+        aggr2.run(variant, None, passed=False)
+    assert aggr1.cache == {"1": [0.125, 0.125, 0.25]}
+    aggr1.merge(aggr2.cache)
+    assert len(aggr1.cache["1"]) == 6
+    assert aggr1.dump() == {"1": variants[4].aaf}
+
+
+def test_aggr_quantile(variants):
+    aggr1 = Aggr("QUANTILE", Term("QUAL"), Term("CHROM"), q=0.75)
+    aggr2 = Aggr("QUANTILE", Term("QUAL"), Term("CHROM"), q=0.75)
+    for variant in variants[:30]:
+        aggr1.run(variant, None, passed=False)
+    for variant in variants[30:-1]:
+        aggr2.run(variant, None, passed=False)
+    aggr1.merge(aggr2.cache)
+    quals = {}
+    for variant in variants[:-1]:
+        quals.setdefault(variant.CHROM, []).append(variant.QUAL)
+    assert aggr1.dump() == {
+        chrom: numpy.quantile(values, 0.75, method="inverted_cdf")
+        for chrom, values in quals.items()
+    }
+
+
+def test_aggr_streaming(variants):
+    aggr1 = Aggr("MEAN", Term("AAF"), Term("CHROM"))
+    aggr2 = Aggr("MEAN", Term("AAF"), Term("CHROM"))
+    for variant in variants[:3]:
+        aggr1.run(variant, None, passed=False)
+    for variant in variants[3:6]:
+        aggr2.run(variant, None, passed=False)
+    assert aggr1.cache == {"1": [[0.5], 3]}
+    aggr1.merge(aggr2.cache)
+    assert aggr1.dump() == {
+        "1": pytest.approx(sum(var.aaf for var in variants[:6]) / 6)
+    }
+
+
+@pytest.mark.parametrize(
+    "formula, passed",
+    [
+        ("AAF ~ CONTIG", False),
+        ("AAF[0.2, 0.8] ~ CHROM[1-3]", True),
+        ("QUAL ~ NALT", False),
+        ("GQs{0,1} ~ AFs{2,3}", False),
+        ("GQs ~ 1", False),
+        ("GTTYPEs[HET,HOM_ALT]{0} ~ CONTIG", False),
+        ("COUNT(1, group=VARTYPE) ~ CONTIG", True),
+        ("COUNT(1, group=GTTYPEs[HET]{1}) ~ CONTIG", False),
+        ("MEAN(GQs{0}) ~ MEAN(AAF, filter=FILTER[PASS], group=CHROM)", False),
+        ("SUM(QUAL, filter=NALT[2, 9]) ~ 1", False),
+        ("COUNT(1, group=CONTIG) ~ WINDOW[10000]", False),
+        ("MEAN(QUAL) ~ WINDOW[1e4]", True),
+        ("MEDIAN(AAF, group=WINDOW[20000]) ~ CONTIG[1-5]", False),
+        ("AAF ~ WINDOW", False),
+        # no batch versions
+        ("COUNT(1) ~ SUBST", False),
+    ],
+)
+def test_formula_run_block(variants, formula, passed):
+    samples = variants[-1]
+    fmula = Formula(formula, samples, passed, "title")
+    data = []
+    for variant in variants[:-1]:
+        fmula.run(variant, None, data.append, data.extend)
+    fmula.done(data.append, data.extend)
+
+    fmula2 = Formula(formula, samples, passed, "title")
+    assert fmula2.batch == ("SUBST" not in formula)
+    data2 = []
+    for block in iter_blocks(variants[:-1], size=7):
+        fmula2.run_block(block, None, data2.append, data2.extend)
+    fmula2.done(data2.append, data2.extend)
+
+    assert len(data) > 0
+    assert data2 == data
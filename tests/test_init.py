@@ -1,3 +1,4 @@
+import json
 import pytest
 from pathlib import Path
 from subprocess import run, PIPE
@@ -6,11 +7,20 @@ from argparse import Namespace
 from vcfstats.cli import (
     MACROS,
     Instance,
+    check_fields,
     combine_regions,
+    file_labels,
+    get_chunks,
+    get_contig_lengths,
     get_instances,
+    get_reader_options,
     get_vcf_by_regions,
+    get_vcf_files,
     list_macros,
     load_macrofile,
+    plot_instances,
+    pushdown_contigs,
+    restrict_samples,
     # main,
 )
 
@@ -82,6 +92,10 @@ def test_get_ones(tmp_path):
                 "outdir": tmp_path,
                 "savedata": False,
                 "figfmt": [],
+                "bins": 0,
+                "binrange": [],
+                "max_points": [],
+                "sketch": 0,
             }
         ),
         ["A", "B", "C", "D"],
@@ -161,3 +175,602 @@ def DEMO(variant):
     )
     print(cmd.stderr, cmd.stdout)
     assert cmd.returncode == 0
+
+
+def test_get_chunks(vcffile):
+    assert get_chunks(vcffile, ["1:10176-10251", "2"]) == [
+        ["1:10176-10251"],
+        ["2"],
+    ]
+    chunks = get_chunks(vcffile, [])
+    assert chunks[0] == ["1"]
+    assert chunks[-1] == ["X"]
+    # not indexed
+    assert get_chunks(HERE.parent.joinpath("examples", "sample.vcf"), []) is None
+
+
+def test_pushdown_contigs(vcffile, tmp_path):
+    def instances(*formulas):
+        return [
+            Instance(
+                formula,
+                "title",
+                "",
+                {"width": 300, "height": 300, "res": 100},
+                tmp_path,
+                ["A", "B", "C", "D"],
+                None,
+                False,
+            )
+            for formula in formulas
+        ]
+
+    ones = instances("AAF ~ CONTIG[2,1]", "COUNT(1, group=VARTYPE) ~ CHROM[X]")
+    assert pushdown_contigs(vcffile, [], ones) == ["1", "2", "X"]
+    assert pushdown_contigs(
+        vcffile, ["1:10000-20000", "3", "X:1-100"], ones
+    ) == ["1:10000-20000", "X:1-100"]
+    # not indexed
+    sample_vcf = HERE.parent.joinpath("examples", "sample.vcf")
+    assert pushdown_contigs(sample_vcf, [], ones) == []
+    # no such contigs
+    assert pushdown_contigs(vcffile, [], instances("AAF ~ CONTIG[chr1]")) == []
+    # one of the formulas uses all contigs
+    ones = instances("AAF ~ CONTIG[1]", "AAF ~ CONTIG")
+    assert pushdown_contigs(vcffile, ["1", "2"], ones) == ["1", "2"]
+
+
+@pytest.mark.parametrize(
+    "formulas, expected",
+    [
+        (["GTTYPEs{C} ~ CHROM", "AFs{A} ~ GQs{1}"], ["A", "B", "C"]),
+        (["COUNT(1, group=GTTYPEs{D}) ~ MEAN(AFs{D})"], ["D"]),
+        # all samples used
+        (["AFs{A,B} ~ GQs{C,D}"], None),
+        # AAF is calculated from all samples
+        (["GTTYPEs{C} ~ CHROM", "AAF ~ 1"], None),
+        # GQs of all samples
+        (["GTTYPEs{C} ~ CHROM", "GQs ~ 1"], None),
+        # no samples used
+        (["QUAL ~ CHROM"], None),
+    ],
+)
+def test_restrict_samples(tmp_path, formulas, expected):
+    ones = [
+        Instance(
+            formula,
+            "title",
+            "",
+            {"width": 300, "height": 300, "res": 100},
+            tmp_path,
+            ["A", "B", "C", "D"],
+            None,
+            False,
+        )
+        for formula in formulas
+    ]
+    assert restrict_samples(ones, ["A", "B", "C", "D"]) == expected
+
+
+def test_check_fields(vcffile):
+    check_fields(vcffile, {"GT", "INFO/DP", "FORMAT/DP"})
+    with pytest.raises(ValueError, match="FORMAT/AD, INFO/XX"):
+        check_fields(vcffile, {"GT", "INFO/XX", "FORMAT/AD", "INFO/DP"})
+
+
+@pytest.mark.parametrize(
+    "formulas, expected",
+    [
+        # no sample data
+        (["QUAL ~ CHROM", "COUNT(1, group=VARTYPE) ~ CONTIG"],
+         {"lazy": True, "samples": []}),
+        (["GTTYPEs{C} ~ CHROM"], {"lazy": True, "samples": ["C"]}),
+        (["AAF ~ CHROM"], {"lazy": True}),
+        # AFs doesn't declare the fields
+        (["AFs{C} ~ CHROM"], {"samples": ["C"]}),
+    ],
+)
+def test_get_reader_options(vcffile, tmp_path, formulas, expected):
+    ones = [
+        Instance(
+            formula,
+            "title",
+            "",
+            {"width": 300, "height": 300, "res": 100},
+            tmp_path,
+            ["A", "B", "C", "D"],
+            None,
+            False,
+        )
+        for formula in formulas
+    ]
+    assert get_reader_options(vcffile, ones, ["A", "B", "C", "D"]) == expected
+
+
+def test_main_sites_only(tmp_path):
+    # GT is not defined in the header of a sites-only vcf file
+    lines = HERE.parent.joinpath("examples", "sample.vcf").read_text()
+    sitesvcf = tmp_path / "sites.vcf"
+    sitesvcf.write_text(
+        "".join(
+            "\t".join(line.rstrip("\n").split("\t")[:8]) + "\n"
+            for line in lines.splitlines(keepends=True)
+            if not line.startswith("##FORMAT")
+        )
+    )
+    check_fields(sitesvcf, {"GT", "INFO/DP"})
+    with pytest.raises(ValueError, match="FORMAT/DP$"):
+        check_fields(sitesvcf, {"GT", "FORMAT/DP"})
+
+    cmd = run(
+        [
+            "python", "-m",
+            "vcfstats",
+            "--vcf",
+            str(sitesvcf),
+            "--outdir",
+            str(tmp_path),
+            "--formula",
+            "AAF ~ CONTIG",
+            "--title",
+            "aaf",
+            "--save",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+    )
+    assert cmd.returncode == 0, cmd.stdout + cmd.stderr
+    assert "has no samples" in cmd.stdout + cmd.stderr
+    assert (tmp_path / "aaf.csv").read_text().count("\n") == 1 + 106
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--bins", "5"]])
+def test_main_jobs(vcffile, tmp_path, extra_args):
+    outputs = {}
+    for jobs in ("1", "2"):
+        outdir = tmp_path / f"jobs{jobs}"
+        outdir.mkdir()
+        cmd = run(
+            [
+                "python", "-m",
+                "vcfstats",
+                "--vcf",
+                str(vcffile),
+                "--outdir",
+                str(outdir),
+                "--formula",
+                "COUNT(1, group=VARTYPE) ~ CONTIG",
+                "AAF ~ CONTIG",
+                "QUAL ~ 1",
+                "AAF ~ CONTIG[2,3]",
+                "--title",
+                "counts",
+                "aafs",
+                "quals",
+                "aafs23",
+                "--save",
+                "--jobs",
+                jobs,
+                *extra_args,
+            ],
+            stdout=PIPE,
+            stderr=PIPE,
+            text=True,
+        )
+        assert cmd.returncode == 0, cmd.stderr
+        outputs[jobs] = [
+            (outdir / "counts.csv").read_text(),
+            (outdir / "aafs.csv").read_text(),
+            (outdir / "quals.csv").read_text(),
+            (outdir / "aafs23.csv").read_text(),
+        ]
+
+    assert outputs["1"] == outputs["2"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_plot_instances(tmp_path, jobs):
+    ones = [
+        Instance(
+            "COUNT(1, group=VARTYPE) ~ CHROM",
+            f"plot{i}",
+            "theme(invalid=)" if i == 1 else "",
+            {"width": 300, "height": 300, "res": 100},
+            tmp_path,
+            ["A", "B", "C", "D"],
+            None,
+            False,
+        )
+        for i in range(3)
+    ]
+    for instance in ones:
+        # the codes of snp and indel
+        instance.data.extend([(1, "1", 0), (2, "2", 1)])
+
+    # the failure of plot1 doesn't stop plot2
+    assert plot_instances(ones, jobs) == ["plot1"]
+    assert (tmp_path / "plot0.col.png").is_file()
+    assert not (tmp_path / "plot1.col.png").exists()
+    assert (tmp_path / "plot2.col.png").is_file()
+
+
+def test_main_plot_jobs(vcffile, tmp_path):
+    cmd = run(
+        [
+            "python", "-m",
+            "vcfstats",
+            "--vcf",
+            str(vcffile),
+            "--outdir",
+            str(tmp_path),
+            "--formula",
+            "COUNT(1) ~ CONTIG",
+            "AAF ~ CONTIG",
+            "--title",
+            "counts",
+            "aafs",
+            "--ggs",
+            "theme(invalid=)",
+            "",
+            "--plot-jobs",
+            "2",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+    )
+    assert cmd.returncode == 1
+    assert "counts: Failed to plot" in cmd.stdout + cmd.stderr
+    assert "Failed to plot 1 of 2 figures: 'counts'" in cmd.stdout + cmd.stderr
+    assert (tmp_path / "aafs.violin.png").is_file()
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_pushdown(vcffile, tmp_path, jobs):
+    outputs = []
+    logs = []
+    for formula in ("AAF ~ CONTIG[2,3]", "AAF ~ CONTIG"):
+        cmd = run(
+            [
+                "python", "-m",
+                "vcfstats",
+                "--vcf",
+                str(vcffile),
+                "--outdir",
+                str(tmp_path),
+                "--formula",
+                formula,
+                "--title",
+                "aafs",
+                "--save",
+                "--jobs",
+                jobs,
+            ],
+            stdout=PIPE,
+            stderr=PIPE,
+            text=True,
+        )
+        assert cmd.returncode == 0, cmd.stderr
+        outputs.append((tmp_path / "aafs.csv").read_text().splitlines())
+        logs.append(cmd.stdout + cmd.stderr)
+
+    assert "Only reading the contigs used by the formulas: 2, 3" in logs[0]
+    assert "Only reading" not in logs[1]
+    assert outputs[0] == [outputs[1][0]] + [
+        line for line in outputs[1][1:] if line.endswith((",2", ",3"))
+    ]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_samples(vcffile, tmp_path, jobs):
+    formulas = ["AFs{D} ~ GQs{D}", "COUNT(1, group=GTTYPEs{B}) ~ CONTIG"]
+    outputs = []
+    logs = []
+    # the 2nd run reads all samples for AAF
+    for extra in ([], ["AAF ~ 1"]):
+        outdir = tmp_path / f"out{len(extra)}"
+        outdir.mkdir()
+        cmd = run(
+            [
+                "python", "-m",
+                "vcfstats",
+                "--vcf",
+                str(vcffile),
+                "--outdir",
+                str(outdir),
+                "--formula",
+                *formulas,
+                *extra,
+                "--title",
+                "gts",
+                "counts",
+                *(["aafs"] if extra else []),
+                "--save",
+                "--jobs",
+                jobs,
+            ],
+            stdout=PIPE,
+            stderr=PIPE,
+            text=True,
+        )
+        assert cmd.returncode == 0, cmd.stdout + cmd.stderr
+        outputs.append(
+            [(outdir / f"{name}.csv").read_text() for name in ("gts", "counts")]
+        )
+        logs.append(cmd.stdout + cmd.stderr)
+
+    assert "Only reading the samples used by the formulas: 2" in logs[0]
+    assert "Only reading the samples" not in logs[1]
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_profile(vcffile, tmp_path, jobs):
+    cmd = run(
+        [
+            "python", "-m",
+            "vcfstats",
+            "--vcf",
+            str(vcffile),
+            "--outdir",
+            str(tmp_path),
+            "--formula",
+            "AAF ~ CONTIG",
+            "MEAN(QUAL) ~ TITV",
+            "--title",
+            "aafs",
+            "titv",
+            "--figtype",
+            "boxplot",
+            "--jobs",
+            jobs,
+            "--profile",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+    )
+    assert cmd.returncode == 0, cmd.stdout + cmd.stderr
+    assert "Profile: macro" in cmd.stdout
+    report = json.loads((tmp_path / "profile.json").read_text())
+    assert set(report["phase"]) == {
+        "open",
+        "parse",
+        "scan",
+        "summarize",
+        "plot",
+    }
+    assert {"AAF", "CONTIG", "QUAL", "TITV"} <= set(report["macro"])
+    assert report["aggregation"]["MEAN(QUAL).dump"]["calls"] == 1
+    assert report["instance"]["aafs"]["peak_bytes"] > 0
+    assert report["instance"]["titv"]["calls"] > 0
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_progress(vcffile, tmp_path, jobs):
+    status_file = tmp_path / "status.jsonl"
+    cmd = run(
+        [
+            "python", "-m",
+            "vcfstats",
+            "--vcf",
+            str(vcffile),
+            "--outdir",
+            str(tmp_path),
+            "--formula",
+            "AAF ~ CONTIG",
+            "--title",
+            "aafs",
+            "--figtype",
+            "boxplot",
+            "--jobs",
+            jobs,
+            "--progress",
+            "1e-9",
+            "--status-json",
+            str(status_file),
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+    )
+    assert cmd.returncode == 0, cmd.stdout + cmd.stderr
+    assert "Progress:" in cmd.stdout
+    lines = [json.loads(line) for line in status_file.read_text().splitlines()]
+    assert lines[-1]["state"] == "done"
+    assert lines[-1]["variants"] == 106
+    assert all(line["state"] == "scanning" for line in lines[:-1])
+    assert len(lines) > 1
+    fractions = [line["fraction"] for line in lines[:-1]]
+    assert fractions == sorted(fractions)
+    if jobs == "2":
+        # from the variants merged from the workers, not the offset of the
+        # file, which is not read by the main process
+        assert len(set(fractions)) > 1
+        assert fractions == [line["variants"] / 106 for line in lines[:-1]]
+        assert all(line["bytes"] is None for line in lines)
+
+
+def test_lazy_imports():
+    # the plotting libraries and the parser are not loaded at startup
+    cmd = run(
+        [
+            "python",
+            "-c",
+            "import sys, vcfstats.cli, vcfstats.formula; "
+            "print(sorted({'plotnine', 'plotnine_prism', 'pandas', 'datar', "
+            "'matplotlib'} & set(sys.modules))); "
+            "print(vcfstats.formula._PARSER)",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+        cwd=HERE.parent,
+    )
+    assert cmd.returncode == 0, cmd.stderr
+    assert cmd.stdout.splitlines() == ["[]", "None"]
+
+
+@pytest.mark.parametrize("data_format", ["parquet", "feather"])
+def test_main_no_plot(vcffile, tmp_path, data_format):
+    pytest.importorskip("pyarrow")
+    argv = [
+        "vcfstats",
+        "--vcf",
+        str(vcffile),
+        "--outdir",
+        str(tmp_path),
+        "--formula",
+        "AAF ~ CONTIG",
+        "COUNT(1, group=VARTYPE) ~ CONTIG",
+        "--title",
+        "aafs",
+        "counts",
+        "--no-plot",
+        "--data-format",
+        data_format,
+    ]
+    # plotnine is never imported
+    cmd = run(
+        [
+            "python",
+            "-c",
+            f"import sys; sys.argv = {argv!r}; "
+            "from vcfstats.cli import main; main(); "
+            "print('plotnine' in sys.modules)",
+        ],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+        cwd=HERE.parent,
+    )
+    assert cmd.returncode == 0, cmd.stdout + cmd.stderr
+    assert cmd.stdout.splitlines()[-1] == "False"
+    assert list(tmp_path.glob("*.png")) == []
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert [entry["file"] for entry in manifest["instances"]] == [
+        f"aafs.{data_format}",
+        f"counts.{data_format}",
+    ]
+    assert (tmp_path / f"aafs.{data_format}").is_file()
+
+
+def test_get_vcf_files(tmp_path):
+    listfile = tmp_path / "vcfs.list"
+    listfile.write_text("# comment\na.vcf.gz\n\n  /data/b.bcf  \n")
+    assert get_vcf_files(str(tmp_path / "x.vcf")) == [
+        str(tmp_path / "x.vcf")
+    ]
+    assert get_vcf_files([listfile, "c.vcf"]) == [
+        str(tmp_path / "a.vcf.gz"),
+        "/data/b.bcf",
+        "c.vcf",
+    ]
+    listfile.write_text("# no files\n")
+    with pytest.raises(ValueError, match="No VCF files"):
+        get_vcf_files(listfile)
+
+
+def test_file_labels():
+    assert file_labels(
+        ["a/x.vcf.gz", "b/x.vcf", "y.bcf", "z.vcf.bgz", "w.txt.gz"]
+    ) == ["x__0", "x__1", "y", "z", "w.txt"]
+
+
+def _run_main(*args):
+    return run(
+        ["python", "-m", "vcfstats", *map(str, args)],
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+    )
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_files(vcffile, tmp_path, jobs):
+    other = tmp_path / "other.vcf.gz"
+    other.write_bytes(vcffile.read_bytes())
+    listfile = tmp_path / "vcfs.list"
+    listfile.write_text(f"{vcffile}\nother.vcf.gz\n")
+    formulas = ["COUNT(1, group=VARTYPE) ~ CONTIG", "QUAL ~ 1"]
+    single = tmp_path / "single"
+    single.mkdir()
+    cmd = _run_main(
+        "--vcf", vcffile, "--outdir", single, "--formula", *formulas,
+        "--title", "counts", "quals", "--bins", "5", "--save",
+    )
+    assert cmd.returncode == 0, cmd.stderr
+
+    outdir = tmp_path / f"jobs{jobs}"
+    outdir.mkdir()
+    cmd = _run_main(
+        "--vcf", listfile, "--outdir", outdir, "--formula", *formulas,
+        "--title", "counts", "quals", "--bins", "5", "--save",
+        "--jobs", jobs,
+    )
+    assert cmd.returncode == 0, cmd.stderr
+    label = vcffile.name[: -len(".vcf.gz")]
+    for subdir in (label, "other"):
+        for name in ("counts", "quals"):
+            assert (outdir / subdir / f"{name}.csv").read_text() == (
+                single / f"{name}.csv"
+            ).read_text()
+        assert (outdir / subdir / "quals.histogram.png").is_file()
+
+    cmd = _run_main(
+        "--vcf", vcffile, other, "--outdir", outdir, "--formula", "QUAL ~ 1",
+        "--title", "quals", "--checkpoint", tmp_path / "ckpt",
+    )
+    assert cmd.returncode != 0
+    assert "--checkpoint is not supported" in cmd.stderr
+
+
+def test_main_files_combine(vcffile, tmp_path):
+    pytest.importorskip("pyarrow")
+    import pandas
+
+    other = tmp_path / "other.vcf.gz"
+    other.write_bytes(vcffile.read_bytes())
+    args = [
+        "--vcf", vcffile, other, "--outdir", tmp_path, "--formula",
+        "COUNT(1) ~ CONTIG", "QUAL ~ 1", "--title", "counts", "quals",
+        "--bins", "5", "--combine", "--jobs", "2",
+    ]
+    cmd = _run_main(*args, "--save")
+    assert cmd.returncode == 0, cmd.stderr
+    assert (tmp_path / "quals.histogram.png").is_file()
+    label = vcffile.name[: -len(".vcf.gz")]
+    df = pandas.read_csv(tmp_path / "counts.csv")
+    assert df.columns.tolist() == ["COUNT_ONE", "CONTIG", "FILE"]
+    assert df.FILE.unique().tolist() == [label, "other"]
+    assert df[df.FILE == label].COUNT_ONE.tolist() == (
+        df[df.FILE == "other"].COUNT_ONE.tolist()
+    )
+    # the bins are the same for all the files
+    df = pandas.read_csv(tmp_path / "quals.csv")
+    assert df.QUAL[df.FILE == label].tolist() == (
+        df.QUAL[df.FILE == "other"].tolist()
+    )
+
+    cmd = _run_main(*args, "--no-plot")
+    assert cmd.returncode == 0, cmd.stderr
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["vcf"] == [str(vcffile), str(other)]
+    assert [entry["files"] for entry in manifest["instances"]] == [
+        [label, "other"],
+        [label, "other"],
+    ]
+    assert manifest["instances"][1]["kind"] == "bins"
+
+
+def test_get_contig_lengths(vcffile, tmp_path):
+    assert get_contig_lengths(vcffile) == {}
+    header = tmp_path / "header.vcf"
+    header.write_text(
+        "##fileformat=VCFv4.2\n"
+        "##contig=<ID=1,length=1000>\n"
+        "##contig=<ID=X,length=200>\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    )
+    assert get_contig_lengths(header) == {"1": 1000, "X": 200}
@@ -1,12 +1,26 @@
 from pathlib import Path
 
+import pandas
 import pytest
+from cyvcf2 import VCF
 from slugify import slugify
 
 from vcfstats.formula import Formula
 from vcfstats.instance import Instance, get_plot_type
 
 
+HERE = Path(__file__).parent.resolve()
+
+
+@pytest.fixture(scope="module")
+def variants():
+    vcf = VCF(
+        str(HERE.parent.joinpath("examples", "sample.vcf")),
+        gts012=True,
+    )
+    return list(vcf)
+
+
 @pytest.fixture
 def instance(tmp_path):
     outdir = tmp_path.with_suffix(".vcfstats")
@@ -52,6 +66,10 @@ def instance(tmp_path):
         ("QUAL ~ AAF", "boxplot", TypeError),
         ("QUAL ~ 1", None, "histogram"),
         ("QUAL ~ 1", "scatter", TypeError),
+        ("COUNT(1, group=CONTIG) ~ WINDOW[1000]", None, "line"),
+        ("MEAN(QUAL) ~ WINDOW", "col", "col"),
+        ("COUNT(1) ~ CHROM", "line", "line"),
+        ("COUNT(1) ~ CHROM", "violin", TypeError),
     ],
 )
 def test_get_plot_type(formula, figtype, expected):
@@ -119,3 +137,226 @@ def test_one_iterate(tmp_path):
 #     with caplog.at_level(logging.INFO):
 #         instance.plot("Rscript")
 #     assert "no lines available in input" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "formula, figtype, binrange, expected_range",
+    [
+        ("AAF ~ 1", None, None, (0.0, 1.0)),
+        ("AAF[0.05, 0.95] ~ CHROM", "density", None, (0.05, 0.95)),
+        ("QUAL ~ CHROM", "freqpoly", [0, 100], (0.0, 100.0)),
+        ("QUAL ~ 1", None, None, None),
+    ],
+)
+def test_instance_bins(
+    tmp_path, variants, formula, figtype, binrange, expected_range
+):
+    instance = Instance(
+        formula,
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        figtype,
+        False,
+        savedata=True,
+        bins=10,
+        binrange=binrange,
+    )
+    assert instance.bins == 10
+    assert instance.data.binrange == expected_range
+    for variant in variants:
+        instance.iterate(variant, None)
+    instance.summarize()
+    instance.plot()
+    df = pandas.read_csv(instance.outprefix + ".csv")
+    assert df.iloc[:, 2].sum() == len(instance.data)
+    assert Path(f"{instance.outprefix}.{instance.figtype}.png").is_file()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_instance_sketch(tmp_path, variants, jobs):
+    def get_instance():
+        return Instance(
+            "QUAL ~ CHROM",
+            "title",
+            "",
+            {"width": 1000, "height": 1000, "res": 100},
+            tmp_path,
+            ["A", "B", "C", "D"],
+            "boxplot",
+            False,
+            savedata=True,
+            sketch=50,
+        )
+
+    instance = get_instance()
+    assert instance.sketch == 50
+    # split the variants as parallel jobs do
+    size = len(variants) // jobs + 1
+    for i in range(jobs):
+        part = instance if i == 0 else get_instance()
+        for variant in variants[i * size : (i + 1) * size]:
+            part.iterate(variant, None)
+        if part is not instance:
+            instance.merge(part.state())
+    instance.summarize()
+    instance.plot()
+    df = pandas.read_csv(instance.outprefix + ".csv")
+    assert df.columns.tolist() == [
+        "CHROM", "Min", "Q1", "Median", "Q3", "Max", "Count"
+    ]
+    assert df.Count.sum() == len(variants)
+    quals = pandas.DataFrame(
+        {
+            "CHROM": [var.CHROM for var in variants],
+            "QUAL": [var.QUAL for var in variants],
+        }
+    ).groupby("CHROM", sort=False)["QUAL"]
+    assert df.Min.tolist() == quals.min().tolist()
+    assert df.Max.tolist() == quals.max().tolist()
+    assert Path(f"{instance.outprefix}.boxplot.png").is_file()
+
+    # only boxplots are summarized
+    instance = Instance(
+        "QUAL ~ CHROM",
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        "violin",
+        False,
+        sketch=50,
+    )
+    assert instance.sketch == 0
+
+
+@pytest.mark.parametrize(
+    "formula",
+    ["COUNT(1, group=CONTIG) ~ WINDOW[10000]", "MEAN(AAF) ~ WINDOW[20000]"],
+)
+def test_instance_line(tmp_path, variants, formula):
+    instance = Instance(
+        formula,
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        None,
+        False,
+        savedata=True,
+        lengths={"1": 30000},
+    )
+    assert instance.figtype == "line"
+    assert len(instance.formula.Y.cache.lengths) == 1
+    for variant in variants:
+        instance.iterate(variant, None)
+    instance.summarize()
+    instance.plot()
+    df = pandas.read_csv(instance.outprefix + ".csv")
+    assert df.columns[1] == "WINDOW"
+    # in the order of the windows
+    assert df.WINDOW.is_monotonic_increasing
+    assert (df.WINDOW % 10000 == 0).all()
+    assert Path(f"{instance.outprefix}.line.png").is_file()
+
+
+@pytest.mark.parametrize(
+    "formula, column",
+    [
+        ("COUNT(1) ~ GTTYPEs{1}", "GTTYPEs"),
+        ("COUNT(1, group=VARTYPE) ~ CHROM", "Group"),
+        ("AAF ~ GTTYPEs{0}", "GTTYPEs"),
+    ],
+)
+def test_instance_levels(tmp_path, variants, formula, column):
+    instance = Instance(
+        formula,
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        None,
+        False,
+        savedata=True,
+    )
+    for variant in variants:
+        instance.iterate(variant, None)
+    instance.summarize()
+    index = instance.datacols.index(column)
+    # stored as the codes
+    assert instance.data.to_columns().columns[index].coded
+    instance.plot()
+    df = pandas.read_csv(instance.outprefix + ".csv")
+    # the levels in the saved data
+    levels = instance.formula.levels()[index]
+    assert set(df[column]) <= set(levels)
+
+
+def test_instance_bins_ignored(tmp_path):
+    instance = Instance(
+        "AAF ~ CHROM",
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        None,
+        False,
+        bins=10,
+    )
+    # violin plots are not binned
+    assert instance.bins == 0
+
+
+@pytest.mark.parametrize(
+    "formula, max_points, expected_len",
+    [
+        ("AAF ~ NALT", 10, 10),
+        # each group keeps at least one point
+        ("MEAN(AAF, group=CHROM) ~ COUNT(1, group=CHROM)", 1, 11),
+        ("AAF ~ NALT", 0, 106),
+    ],
+)
+def test_instance_max_points(
+    tmp_path, variants, formula, max_points, expected_len
+):
+    instance = Instance(
+        formula,
+        "title",
+        "",
+        {"width": 1000, "height": 1000, "res": 100},
+        tmp_path,
+        ["A", "B", "C", "D"],
+        None,
+        False,
+        savedata=True,
+        max_points=max_points,
+    )
+    assert instance.figtype == "scatter"
+    for variant in variants:
+        instance.iterate(variant, None)
+    instance.summarize()
+    instance.plot()
+    assert len(instance.data) == expected_len
+    lines = Path(instance.outprefix + ".csv").read_text().splitlines()
+    if max_points:
+        assert lines[0].startswith(f"# sampled {expected_len} of ")
+    else:
+        assert not lines[0].startswith("#")
+    df = pandas.read_csv(instance.outprefix + ".csv", comment="#")
+    assert df.shape[0] == expected_len
+
+
+def test_ggs_env():
+    from vcfstats import instance
+
+    env = instance.get_ggs_env()
+    assert instance.GGS_ENV is env
+    assert "ggplot" in env and "theme_prism" in env
+    with pytest.raises(AttributeError):
+        instance.NO_SUCH_THING
@@ -1,9 +1,15 @@
+import math
 from pathlib import Path
 
 import pytest
 from cyvcf2 import VCF
 
+from vcfstats.block import Block
+from vcfstats.formula import Term
+from vcfstats.utils import MACROS
+
 from vcfstats.macros import (
+    aggregation,
     cat,
     _ONE,
     TITV,
@@ -17,11 +23,18 @@ from vcfstats.macros import (
     GTTYPEs,
     GQs,
     NALT,
+    POS,
     QUAL,
     SUBST,
     SAMPLES,
+    WINDOW,
+    DISTINCT,
     MEAN,
+    MEDIAN,
+    QUANTILE,
     SUM,
+    GTTYPES,
+    VARTYPES,
 )
 
 HERE = Path(__file__).parent.resolve()
@@ -56,9 +69,29 @@ def test_variant_vcf(variants_vcf):
 
 
 def test_vartype(variants):
-    assert VARTYPE(variants[0]) == "snp"
-    assert VARTYPE(variants[1]) == "snp"
-    assert VARTYPE(variants[3]) == "indel"
+    # the codes of the levels
+    assert MACROS["VARTYPE"]["levels"] == VARTYPES
+    assert VARTYPES[VARTYPE(variants[0])] == "snp"
+    assert VARTYPES[VARTYPE(variants[1])] == "snp"
+    assert VARTYPES[VARTYPE(variants[3])] == "indel"
+
+
+def test_vartype_mnp(tmp_path):
+    vcffile = tmp_path / "mnp.vcf"
+    vcffile.write_text(
+        "##fileformat=VCFv4.2\n"
+        "##contig=<ID=1,length=1000>\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+        "1\t10\t.\tAC\tGT\t50\tPASS\t.\n"
+        "1\t20\t.\tA\tG\t50\tPASS\t.\n"
+    )
+    mnp, snp = VCF(str(vcffile))
+    assert VARTYPES[VARTYPE(mnp)] == "mnp"
+    batch = MACROS["VARTYPE"]["batch"](Block([mnp, snp]))
+    assert [VARTYPES[code] for code in batch] == ["mnp", "snp"]
+    assert Term("VARTYPE", ["mnp"]).run(mnp, None, passed=False) == [
+        VARTYPES.index("mnp")
+    ]
 
 
 def test_titv(variants):
@@ -74,7 +107,26 @@ def test_contig(variants):
 
 
 def test_gttypes(variants):
-    assert GTTYPEs(variants[6]) == ["HET", "HOM_ALT", "HOM_REF", "HOM_REF"]
+    assert MACROS["GTTYPEs"]["levels"] == GTTYPES
+    assert [GTTYPES[code] for code in GTTYPEs(variants[6])] == [
+        "HET", "HOM_ALT", "HOM_REF", "HOM_REF"
+    ]
+
+
+def test_levels():
+    @cat(levels=["no", "yes"])
+    def IS_SNP(variant):
+        return int(variant.is_snp)
+
+    assert MACROS["IS_SNP"]["levels"] == ("no", "yes")
+    assert "levels" not in MACROS["CONTIG"]
+
+    for levels in ([], ["a", "a"]):
+        with pytest.raises(ValueError):
+
+            @cat(levels=levels)
+            def BAD_LEVELS(variant):
+                return 0
 
 
 def test_filter(variants):
@@ -93,6 +145,29 @@ def test_nalt(variants):
     assert NALT(variants[6]) == 2
 
 
+def test_pos(variants):
+    assert POS(variants[0]) == variants[0].POS
+
+
+def test_window(variants):
+    assert WINDOW(variants[0]) == variants[0].POS - 1
+    assert MACROS["WINDOW"]["window"] == 1_000_000
+    assert MACROS["WINDOW"]["type"] == "categorical"
+
+    @cat(window=100)
+    def WINDOW100(variant):
+        return variant.POS - 1
+
+    assert MACROS["WINDOW100"]["window"] == 100
+    assert "window" not in MACROS["CONTIG"]
+
+    with pytest.raises(ValueError, match="positive integer"):
+
+        @cat(window=0)
+        def BAD_WINDOW(variant):
+            return variant.POS - 1
+
+
 def test_gqs(variants):
     assert list(GQs(variants[0])) == [5, 40, 83, 36]
 
@@ -138,3 +213,114 @@ def test_sum(entries):
 )
 def test_mean(entries, expected):
     assert MEAN(entries) == expected
+
+
+@pytest.mark.parametrize(
+    "entries, q, expected",
+    [([], 0.5, math.nan), ([3, 1, 2], 0.5, 2), ([1, 2, 3, 4], 0.9, 4)],
+)
+def test_quantile(entries, q, expected):
+    if entries:
+        assert QUANTILE(entries, q) == expected
+    else:
+        assert math.isnan(QUANTILE(entries, q))
+    assert MEDIAN([4, 1, 3, 2]) == 2
+
+
+def _stream(name, entries, **params):
+    """Aggregate the entries with the streaming hooks of an aggregation"""
+    macro = MACROS[name]
+    half = len(entries) // 2
+    state1 = macro["init"]()
+    for entry in entries[:half]:
+        state1 = macro["update"](state1, entry)
+    state2 = macro["init"]()
+    for entry in entries[half:]:
+        state2 = macro["update"](state2, entry)
+    state = macro["merge"](state1, state2)
+    if not macro["finalize"]:
+        return state
+    return macro["finalize"](state, **params)
+
+
+@pytest.mark.parametrize(
+    "name, entries",
+    [
+        ("COUNT", []),
+        ("COUNT", [1, 2, 3]),
+        ("SUM", []),
+        ("SUM", [1, 2, 3]),
+        ("SUM", [0.1] * 10),
+        ("SUM", [1e100, 1.0, -1e100, 1.0]),
+        ("MEAN", []),
+        ("MEAN", [1, 2]),
+        ("MEAN", [0.1, 0.2, 0.3]),
+        ("MEDIAN", [5, 1, 4, 2, 3]),
+        ("MEDIAN", [0.1, 0.2, 0.3, 0.4]),
+        ("DISTINCT", []),
+        ("DISTINCT", ["A>G", "C>T", "A>G", None]),
+        ("DISTINCT", [1, 2, 2, 3, math.nan]),
+    ],
+)
+def test_streaming_hooks(name, entries):
+    expected = MACROS[name]["func"](entries)
+    if name == "SUM" and entries and isinstance(entries[0], float):
+        expected = math.fsum(entries)
+    assert _stream(name, entries) == pytest.approx(expected)
+    assert _stream(name, entries) == _stream(name, entries[::-1])
+
+
+def test_distinct():
+    assert DISTINCT(["A>G", "C>T", "A>G", None]) == 2
+    assert MACROS["DISTINCT"]["categorical"]
+    assert not MACROS["COUNT"]["categorical"]
+    assert _stream("DISTINCT", list(range(5000))) == pytest.approx(
+        5000, rel=0.05
+    )
+
+
+def test_quantile_streaming():
+    entries = list(range(100))
+    assert _stream("QUANTILE", entries, q=0.9) == QUANTILE(entries, 0.9)
+    assert _stream("QUANTILE", entries) == MEDIAN(entries)
+    with pytest.raises(ValueError):
+        _stream("QUANTILE", entries, q=2)
+
+
+def test_aggregation_hooks_required():
+    with pytest.raises(ValueError):
+
+        @aggregation(init=int)
+        def BAD_AGGR(entries):
+            return len(entries)
+
+
+def test_scope():
+    assert MACROS["QUAL"]["scope"] == "site"
+    assert MACROS["GTTYPEs"]["scope"] == "sample"
+    assert MACROS["AAF"]["scope"] is None
+    assert MACROS["mixedinfo"]["scope"] is None
+
+    with pytest.raises(ValueError):
+
+        @cat(scope="samples")
+        def BAD_SCOPE(variant):
+            return variant.CHROM
+
+
+def test_fields():
+    assert MACROS["QUAL"]["fields"] == ()
+    assert MACROS["GQs"]["fields"] == ("FORMAT/GQ",)
+    assert MACROS["AFs"]["fields"] is None
+
+    @cat(fields="INFO/DP")
+    def INFO_DP_CAT(variant):
+        return str(variant.INFO["DP"])
+
+    assert MACROS["INFO_DP_CAT"]["fields"] == ("INFO/DP",)
+
+    with pytest.raises(ValueError):
+
+        @cat(fields=("DP",))
+        def BAD_FIELDS(variant):
+            return variant.CHROM
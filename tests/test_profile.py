@@ -0,0 +1,131 @@
+import json
+from argparse import Namespace
+
+import pytest
+from cyvcf2 import VCF
+
+from vcfstats import profile as profile_module
+from vcfstats.cli import scan_variants
+from vcfstats.instance import Instance
+from vcfstats.profile import PROFILER, Profiler
+
+from .test_init import vcffile  # noqa: F401
+
+
+@pytest.fixture
+def profiler():
+    PROFILER.reset()
+    PROFILER.enable()
+    yield PROFILER
+    PROFILER.enabled = False
+    PROFILER.reset()
+
+
+def test_disabled():
+    prof = Profiler()
+
+    def func(x):
+        return x + 1
+
+    assert prof.wrap("macro", "X", func) is func
+    with prof.timer("phase", "scan"):
+        pass
+    assert prof.timers == {}
+
+
+def test_timers():
+    prof = Profiler()
+    prof.enable()
+    func = prof.wrap("macro", "X", lambda x: x + 1)
+    assert func(1) == 2
+    assert func(2) == 3
+    with prof.timer("phase", "scan"):
+        pass
+    with pytest.raises(ZeroDivisionError):
+        with prof.timer("phase", "scan"):
+            1 / 0
+    assert prof.timers[("macro", "X")][1] == 2
+    assert prof.timers[("phase", "scan")][1] == 2
+    assert prof.timers[("phase", "scan")][0] > 0
+
+    other = Profiler()
+    other.timers[("macro", "X")] = [1.0, 3]
+    other.memory["plot1"] = 100
+    prof.merge(other.stats())
+    assert prof.timers[("macro", "X")][1] == 5
+    assert prof.timers[("macro", "X")][0] > 1.0
+
+    prof.track_memory([Namespace(title="plot1", nbytes=50)])
+    prof.track_memory([Namespace(title="plot2", nbytes=50)])
+    report = prof.report()
+    assert report["instance"]["plot1"] == {
+        "time": 0.0,
+        "calls": 0,
+        "peak_bytes": 100,
+    }
+    assert report["instance"]["plot2"]["peak_bytes"] == 50
+    assert report["macro"]["X"]["calls"] == 5
+    assert report["peak_rss"] > 0
+    assert set(report) == {
+        "phase",
+        "macro",
+        "aggregation",
+        "instance",
+        "peak_rss",
+    }
+
+
+def test_sample_memory(monkeypatch):
+    prof = Profiler()
+    prof.sample_memory([Namespace(title="plot1", nbytes=50)])
+    # not sampled within the interval
+    assert prof.memory == {}
+    monkeypatch.setattr(profile_module, "MEMORY_INTERVAL", 0)
+    prof.sample_memory([Namespace(title="plot1", nbytes=50)])
+    assert prof.memory == {"plot1": 50}
+
+
+def test_save_print(tmp_path, capsys):
+    prof = Profiler()
+    prof.enable()
+    prof.wrap("macro", "QUAL", lambda: None)()
+    prof.timer_of("aggregation", "MEAN(QUAL)")
+    prof.save(tmp_path / "profile.json")
+    report = json.loads((tmp_path / "profile.json").read_text())
+    assert report["macro"]["QUAL"]["calls"] == 1
+    prof.print()
+    out = capsys.readouterr().out
+    assert "Profile: macro" in out
+    assert "QUAL" in out
+    assert "Profile: instance" not in out
+
+
+def test_profile_scan(vcffile, profiler, tmp_path):  # noqa: F811
+    vcf = VCF(str(vcffile), gts012=True)
+    n_variants = len(list(VCF(str(vcffile))))
+    ones = [
+        # no batch version for TITV
+        Instance(
+            "MEAN(QUAL) ~ TITV",
+            "titv",
+            "",
+            {"width": 1000, "height": 1000, "res": 100},
+            tmp_path,
+            vcf.samples,
+            None,
+            False,
+        ),
+    ]
+    assert not ones[0].formula.batch
+    assert scan_variants(vcf, ones) == n_variants
+    # the states of the aggregations are counted
+    nbytes = ones[0].nbytes
+    assert ones[0].formula.nbytes > 0
+    assert nbytes == ones[0].data.nbytes + ones[0].formula.nbytes
+    assert ones[0].formula.Y.dump()
+    report = profiler.report()
+    assert report["instance"]["titv"]["calls"] == n_variants
+    assert report["instance"]["titv"]["peak_bytes"] == nbytes
+    assert report["macro"]["TITV"]["calls"] == n_variants
+    assert report["aggregation"]["MEAN(QUAL)"]["calls"] == n_variants
+    assert report["aggregation"]["MEAN(QUAL).dump"]["calls"] == 1
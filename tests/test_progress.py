@@ -0,0 +1,84 @@
+import json
+from collections import Counter
+
+from cyvcf2 import VCF
+
+from vcfstats.progress import (
+    Progress,
+    expected_records,
+    file_offsets,
+    format_seconds,
+    read_index_counts,
+)
+
+from .test_init import HERE, vcffile  # noqa: F401
+
+
+def test_read_index_counts(vcffile):  # noqa: F811
+    counts = read_index_counts(vcffile)
+    expected = Counter(var.CHROM for var in VCF(str(vcffile)))
+    assert counts == {
+        contig: expected[contig] for contig in VCF(str(vcffile)).seqnames
+    }
+    assert read_index_counts(HERE.parent / "examples" / "sample.vcf") is None
+
+
+def test_expected_records():
+    counts = {"1": 10, "2": 20, "3": 30}
+    assert expected_records(counts, None) == 60
+    assert expected_records(counts, ["1:1-100", "1:200-300", "3"]) == 40
+    assert expected_records(counts, ["X"]) == 0
+
+
+def test_format_seconds():
+    assert format_seconds(0) == "0:00:00"
+    assert format_seconds(61.5) == "0:01:01"
+    assert format_seconds(3600 * 25 + 59) == "25:00:59"
+
+
+def test_file_offsets(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("a" * 100)
+    assert file_offsets(path) == {}
+    with open(path) as fin:
+        fin.read(10)
+        offsets = file_offsets(path)
+    assert list(offsets.values()) == [100]
+
+
+def test_progress(vcffile, tmp_path, caplog):  # noqa: F811
+    status_file = tmp_path / "status.jsonl"
+    status_file.write_text("from a previous run\n")
+    progress = Progress(vcffile, interval=3600, status_file=status_file)
+    assert status_file.read_text() == ""
+    assert progress.total_records == 106
+    progress.start()
+    vcf = VCF(str(vcffile))
+    variants = list(vcf)
+    progress.update(len(variants))
+    assert status_file.read_text() == ""
+
+    progress.update(len(variants), force=True)
+    progress.finish(len(variants))
+    vcf.close()
+    lines = [json.loads(line) for line in status_file.read_text().splitlines()]
+    assert [line["state"] for line in lines] == ["scanning", "done"]
+    assert lines[0]["variants"] == 106
+    assert lines[0]["bytes"] > 0
+    assert lines[0]["fraction"] == 1.0
+    assert lines[0]["eta"] == 0
+    assert lines[1]["fraction"] == 1.0
+    assert "Progress: 106 variants read" in caplog.text
+
+
+def test_progress_regions(vcffile):  # noqa: F811
+    progress = Progress(vcffile, ["1", "2:1-100000"], log=False)
+    assert progress.total_bytes is None
+    progress.start()
+    expected = progress.total_records
+    assert expected == len(list(VCF(str(vcffile))("1"))) + len(
+        list(VCF(str(vcffile))("2"))
+    )
+    status = progress.status(expected // 2)
+    assert status["fraction"] == (expected // 2) / expected
+    assert status["eta"] > 0
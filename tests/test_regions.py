@@ -0,0 +1,144 @@
+from argparse import Namespace
+
+import pytest
+from cyvcf2 import VCF
+
+from vcfstats.regions import (
+    batch_regions,
+    format_region,
+    iter_regions,
+    merge_regions,
+    parse_region,
+)
+
+from .test_init import vcffile  # noqa: F401
+
+
+@pytest.mark.parametrize(
+    "region, expected",
+    [
+        ("1", ("1", 1, None)),
+        ("chr1:100", ("chr1", 100, None)),
+        ("chr1:100-", ("chr1", 100, None)),
+        ("chr1:1,000-2,000", ("chr1", 1000, 2000)),
+        ("chr1:0-10", ("chr1", 1, 10)),
+        ("HLA-A*01:01:01:01", ("HLA-A*01:01:01", 1, None)),
+        ("HLA-A*01:01:01:01:5-10", ("HLA-A*01:01:01:01", 5, 10)),
+    ],
+)
+def test_parse_region(region, expected):
+    assert parse_region(region) == expected
+
+
+def test_format_region():
+    assert format_region("1", 1, None) == "1"
+    assert format_region("1", 10, None) == "1:10-"
+    assert format_region("1", 10, 20) == "1:10-20"
+
+
+def test_merge_regions():
+    regions = [
+        "2:100-200",
+        "1:500-600",
+        "2:150-300",
+        "1:100-200",
+        "2:301-400",
+        "2:500-600",
+        "X:1-10",
+        "3",
+        "3:10-20",
+        "1:550-560",
+    ]
+    assert merge_regions(regions, ["1", "2", "3", "X"]) == [
+        "1:100-200",
+        "1:500-600",
+        "2:100-400",
+        "2:500-600",
+        "3",
+        "X:1-10",
+    ]
+    # without contigs, in the order they first appear
+    assert merge_regions(regions)[:2] == ["2:100-400", "2:500-600"]
+    assert merge_regions(["1:10-", "1:5-8"]) == ["1:5-8", "1:10-"]
+    assert merge_regions(["1:10-", "1:5-9"]) == ["1:5-"]
+    assert merge_regions([]) == []
+
+
+def test_batch_regions():
+    regions = ["1:100-200", "1:300-400", "1:20000-20100", "1:20200-", "2"]
+    assert batch_regions(regions, gap=1000) == [
+        ("1", [(100, 200), (300, 400)]),
+        ("1", [(20000, 20100), (20200, None)]),
+        ("2", [(1, None)]),
+    ]
+
+
+class FakeVCF:
+    """Fetch the variants overlapping a region, like an index query"""
+
+    def __init__(self, variants):
+        self.variants = [
+            Namespace(CHROM=chrom, POS=pos, end=end, id=i)
+            for i, (chrom, pos, end) in enumerate(variants)
+        ]
+        self.queries = []
+
+    def __call__(self, region):
+        self.queries.append(region)
+        chrom, start, end = parse_region(region)
+        end = end or float("inf")
+        return (
+            var
+            for var in self.variants
+            if var.CHROM == chrom and var.POS <= end and var.end >= start
+        )
+
+
+def test_iter_regions():
+    vcf = FakeVCF(
+        [
+            ("1", 50, 50),
+            ("1", 90, 150),  # overlaps the 1st region from the left
+            ("1", 120, 120),
+            ("1", 250, 250),  # in the gap
+            ("1", 280, 5000),  # a long deletion over 3 regions
+            ("1", 350, 350),
+            ("1", 4000, 4000),
+            ("1", 6000, 6000),
+            ("2", 10, 10),
+        ]
+    )
+    regions = ["1:100-200", "1:300-400", "1:3000-4500", "1:4900-", "2"]
+    variants = list(iter_regions(vcf, regions, gap=1000))
+    assert [var.id for var in variants] == [1, 2, 4, 5, 6, 7, 8]
+    assert vcf.queries == ["1:100-400", "1:3000-", "2"]
+
+
+def test_iter_regions_vcf(vcffile):  # noqa: F811
+    regions = [
+        "1:10176-10251",
+        "1:10200-10300",
+        "1:10400-15000",
+        "2",
+        "3:16000-17000",
+    ]
+    vcf = VCF(str(vcffile))
+    expected = []
+    seen = set()
+    for region in regions:
+        for var in vcf(region):
+            if (var.CHROM, var.POS, var.REF) not in seen:
+                seen.add((var.CHROM, var.POS, var.REF))
+                expected.append((var.CHROM, var.POS, var.REF))
+
+    merged = merge_regions(regions, vcf.seqnames)
+    assert merged == [
+        "1:10176-10300",
+        "1:10400-15000",
+        "2",
+        "3:16000-17000",
+    ]
+    variants = [
+        (var.CHROM, var.POS, var.REF) for var in iter_regions(vcf, merged)
+    ]
+    assert variants == expected
@@ -0,0 +1,144 @@
+import math
+import pickle
+
+import numpy
+import pytest
+
+from vcfstats.sketch import HyperLogLog, KLLSketch, rank_error
+
+
+def _rank(values, value):
+    """The normalized rank of a value in the sorted values"""
+    return numpy.searchsorted(values, value, side="right") / len(values)
+
+
+def test_rank_error():
+    assert rank_error() == pytest.approx(0.0133, abs=1e-4)
+    assert rank_error(400) < rank_error() < rank_error(100)
+
+
+def test_sketch_exact():
+    sketch = KLLSketch()
+    assert math.isnan(sketch.quantile(0.5))
+    for value in [3, 1, None, 2, math.nan, 4]:
+        sketch.update(value)
+    assert len(sketch) == 4
+    assert sketch.summary() == [1, 1, 2, 3, 4]
+    assert sketch.quantile(0.51) == 3
+
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
+    with pytest.raises(ValueError):
+        KLLSketch(1)
+
+
+def test_sketch_bounded():
+    rng = numpy.random.default_rng(1)
+    values = rng.normal(size=200_000)
+    sketch = KLLSketch()
+    for value in values.tolist():
+        sketch.update(value)
+    assert len(sketch) == len(values)
+    # O(k) values kept, no matter how many are added
+    assert sketch.size < 4 * sketch.k
+    assert sketch.nbytes < 50_000
+
+    values.sort()
+    assert sketch.quantile(0) == values[0]
+    assert sketch.quantile(1) == values[-1]
+    for q in numpy.linspace(0.01, 0.99, 25).tolist():
+        assert abs(_rank(values, sketch.quantile(q)) - q) <= rank_error()
+
+
+def test_sketch_merge():
+    rng = numpy.random.default_rng(2)
+    values = rng.exponential(size=50_000)
+    parts = [KLLSketch() for _ in range(4)]
+    for i, value in enumerate(values.tolist()):
+        parts[i % 4].update(value)
+    parts = [pickle.loads(pickle.dumps(part)) for part in parts]
+
+    sketch = KLLSketch()
+    sketch.merge(KLLSketch())
+    for part in parts:
+        sketch.merge(part)
+    assert len(sketch) == len(values)
+    assert sketch.size < 4 * sketch.k
+    values.sort()
+    assert sketch.quantile(0) == values[0]
+    for q in (0.1, 0.25, 0.5, 0.75, 0.9):
+        assert abs(_rank(values, sketch.quantile(q)) - q) <= rank_error()
+
+    with pytest.raises(ValueError, match="different sizes"):
+        sketch.merge(KLLSketch(100))
+
+
+def test_sketch_reproducible():
+    values = numpy.random.default_rng(3).uniform(size=10_000).tolist()
+    sketch1 = KLLSketch()
+    sketch2 = KLLSketch()
+    for value in values:
+        sketch1.update(value)
+        sketch2.update(value)
+    assert sketch1.levels == sketch2.levels
+
+
+def test_hll_exact():
+    hll = HyperLogLog(p=10)
+    assert hll.exact == 64
+    for value in ["A>G", "C>T", None, math.nan, "A>G", 1, "1"]:
+        hll.update(value)
+    # values are hashed by their string form
+    assert hll.count() == 3
+    assert hll.relative_error() == 0
+    assert hll.registers is None
+
+    for i in range(100):
+        hll.update(i)
+    assert hll.registers is not None
+    assert hll.hashes is None
+    assert hll.nbytes == 1024
+    assert hll.relative_error() == pytest.approx(1.04 / 32)
+    assert abs(hll.count() - 102) <= 4 * hll.relative_error() * 102
+
+    with pytest.raises(ValueError):
+        HyperLogLog(p=3)
+
+
+@pytest.mark.parametrize("n", [5_000, 100_000])
+def test_hll_estimate(n):
+    hll = HyperLogLog()
+    for i in range(n):
+        hll.update(f"chr1:{i}")
+        hll.update(f"chr1:{i // 2}")
+    assert abs(hll.count() - n) <= 4 * hll.relative_error() * n
+
+
+def test_hll_merge():
+    parts = [HyperLogLog(p=12) for _ in range(3)]
+    for i in range(20_000):
+        parts[i % 3].update(i)
+    # a part in the exact mode
+    small = HyperLogLog(p=12)
+    for i in range(100):
+        small.update(i)
+    parts = [pickle.loads(pickle.dumps(part)) for part in parts]
+
+    hll = HyperLogLog(p=12)
+    hll.merge(small)
+    assert hll.count() == 100
+    for part in parts + [small]:
+        hll.merge(part)
+    assert abs(hll.count() - 20_000) <= 4 * hll.relative_error() * 20_000
+
+    exact = HyperLogLog(p=12, exact=150)
+    other = HyperLogLog(p=12)
+    for i in range(100):
+        exact.update(i)
+        other.update(i + 100)
+    exact.merge(other)
+    assert exact.registers is not None
+    assert abs(exact.count() - 200) <= 4
+
+    with pytest.raises(ValueError, match="different precisions"):
+        hll.merge(HyperLogLog(p=10))
@@ -0,0 +1,101 @@
+"""Blocks of variants for the batch macros"""
+from functools import cached_property
+
+import numpy
+
+# number of variants in a block
+BLOCK_SIZE = 1000
+
+
+class Block:
+    """A block of variants, with their fields as column arrays.
+
+    The columns are built on first access and shared by all the batch
+    macros. Columns with sample data are matrices of
+    (number of variants) x (number of samples).
+    """
+
+    def __init__(self, variants):
+        self.variants = variants
+
+    def __len__(self):
+        return len(self.variants)
+
+    @cached_property
+    def CHROM(self):
+        """The chromosomes"""
+        return numpy.array([var.CHROM for var in self.variants], dtype=object)
+
+    @cached_property
+    def POS(self):
+        """The 1-based positions"""
+        return numpy.array([var.POS for var in self.variants], dtype=numpy.int64)
+
+    @cached_property
+    def QUAL(self):
+        """The qualities, masked where missing"""
+        return numpy.ma.masked_invalid(
+            numpy.array([var.QUAL for var in self.variants], dtype=float)
+        )
+
+    @cached_property
+    def FILTER(self):
+        """The filters, None for PASS"""
+        return numpy.array([var.FILTER for var in self.variants], dtype=object)
+
+    @cached_property
+    def passed(self):
+        """Whether the variants pass all filters"""
+        return numpy.array([not var.FILTER for var in self.variants], dtype=bool)
+
+    @cached_property
+    def var_type(self):
+        """The variant types"""
+        return numpy.array([var.var_type for var in self.variants], dtype=object)
+
+    @cached_property
+    def aaf(self):
+        """The alternate allele frequencies"""
+        return numpy.array([var.aaf for var in self.variants], dtype=float)
+
+    @cached_property
+    def nalt(self):
+        """The number of alternate alleles"""
+        return numpy.array(
+            [len(var.ALT) for var in self.variants], dtype=numpy.int64
+        )
+
+    def _matrix(self, attr, dtype):
+        """Stack the sample data of the variants into a matrix"""
+        if not self.variants:
+            return numpy.empty((0, 0), dtype=dtype)
+        return numpy.vstack(
+            [getattr(var, attr) for var in self.variants]
+        ).astype(dtype, copy=False)
+
+    @cached_property
+    def gt_types(self):
+        """The genotype types (gts012) of each sample"""
+        return self._matrix("gt_types", numpy.int64)
+
+    @cached_property
+    def gt_quals(self):
+        """The genotype qualities of each sample"""
+        return self._matrix("gt_quals", float)
+
+    @cached_property
+    def gt_alt_freqs(self):
+        """The alternate allele frequencies of each sample"""
+        return self._matrix("gt_alt_freqs", float)
+
+
+def iter_blocks(variants, size=BLOCK_SIZE):
+    """Group the variants into blocks"""
+    buffer = []
+    for variant in variants:
+        buffer.append(variant)
+        if len(buffer) == size:
+            yield Block(buffer)
+            buffer = []
+    if buffer:
+        yield Block(buffer)
@@ -0,0 +1,123 @@
+"""On-disk cache of the summarized data of the instances, so that
+re-plotting the same formulas doesn't need to scan the VCF file again"""
+import hashlib
+import json
+import os
+import pickle
+import time
+from os import path
+
+from .utils import logger
+
+CACHE_SUFFIX = ".vcfstats-cache"
+
+
+def file_digest(filepath):
+    """Get the sha256 digest of the content of a file"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """The cache of the summarized data of the instances.
+
+    Each entry is a pickled data object (`Columns`, `Bins` or `Reservoir`)
+    in the cache directory, named by the key of the instance. Entries
+    that have not been used for `max_age` seconds are removed, then the
+    least recently used ones are removed until the total size is no more
+    than `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size, max_age):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @staticmethod
+    def key(opts, regions, formula, samples, instance):
+        """Get the key of an instance, from the vcf file and everything
+        that affects the data of the instance, but not the plotting
+        options (ggs, figfmt, devpars, etc)"""
+        from . import __version__
+
+        vcfstat = os.stat(opts.vcf)
+        macrofile = opts.macro and str(opts.macro)
+        if macrofile and not macrofile.endswith(".py"):
+            macrofile = macrofile + ".py"
+        key = {
+            "version": __version__,
+            "vcf": [path.realpath(opts.vcf), vcfstat.st_size, vcfstat.st_mtime],
+            "macro": macrofile and file_digest(macrofile),
+            "formula": "".join(formula.split()),
+            "samples": samples,
+            "regions": regions,
+            "passed": opts.passed,
+            "bins": instance.bins,
+            "binrange": instance.data.binrange if instance.bins else None,
+            "max_points": instance.max_points,
+            "sketch": instance.sketch,
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _file(self, key):
+        """Get the path of the cache file of a key"""
+        return path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """Load the data of a key, None if it's not cached or expired"""
+        cfile = self._file(key)
+        try:
+            mtime = os.stat(cfile).st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - mtime > self.max_age:
+            os.remove(cfile)
+            return None
+        try:
+            with open(cfile, "rb") as fcache:
+                data = pickle.load(fcache)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.warning("Corrupted cache file %r, ignored.", cfile)
+            os.remove(cfile)
+            return None
+        # mark it as recently used
+        os.utime(cfile)
+        return data
+
+    def save(self, key, data):
+        """Save the data of a key, then evict the old entries"""
+        cfile = self._file(key)
+        tmpfile = f"{cfile}.tmp"
+        with open(tmpfile, "wb") as fcache:
+            pickle.dump(data, fcache, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cfile)
+        self.evict()
+
+    def evict(self):
+        """Remove the expired entries, then the least recently used ones
+        until the cache is no larger than the max size"""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                os.remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        # least recently used first
+        for _, size, cfile in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(cfile)
+            total -= size
+            logger.debug("- cache evicted: %s", cfile)
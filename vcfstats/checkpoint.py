@@ -0,0 +1,235 @@
+"""Checkpoints of the scan, so that a killed run can be resumed"""
+import hashlib
+import json
+import os
+import pickle
+from itertools import islice
+from os import path
+
+from .regions import format_region, iter_regions, parse_region
+from .utils import logger
+
+CHECKPOINT_FILE = "vcfstats.checkpoint"
+
+
+def fingerprint(opts, regions, indices=None):
+    """Identify a run by the vcf file and the options that affect the
+    scan, so that a checkpoint is only resumed by the same run.
+    `indices` are the indices of the formulas that are scanned, if not all.
+    """
+    vcfstat = os.stat(opts.vcf)
+    macrofile = opts.macro and str(opts.macro)
+    if macrofile and not macrofile.endswith(".py"):
+        macrofile = macrofile + ".py"
+    key = {
+        "vcf": [path.realpath(opts.vcf), vcfstat.st_size, vcfstat.st_mtime],
+        "macro": macrofile and [
+            path.realpath(macrofile),
+            os.stat(macrofile).st_mtime,
+        ],
+        "formula": opts.formula,
+        "figtype": opts.figtype,
+        "regions": regions,
+        "passed": opts.passed,
+        "bins": opts.bins,
+        "binrange": opts.binrange,
+        "max_points": opts.max_points,
+        "sketch": opts.sketch,
+        "indices": indices,
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def resume_regions(regions, chrom, pos):
+    """Get the part of the sorted, merged regions from chrom:pos on"""
+    rest = None
+    for i, region in enumerate(regions):
+        rchrom, start, end = parse_region(region)
+        if rchrom != chrom:
+            if rest is not None:
+                # past the regions on chrom
+                break
+            continue
+        rest = i + 1
+        if end is None or end >= pos:
+            narrowed = format_region(chrom, max(start, pos), end)
+            return [narrowed] + list(regions[rest:])
+    return list(regions[rest:]) if rest is not None else []
+
+
+def skip_variants(variants, chrom, pos, n_at_pos):
+    """Skip the variants on chrom before pos, and the first n_at_pos
+    variants at pos, which have been scanned before the checkpoint was
+    saved"""
+    skipping = True
+    for variant in variants:
+        if skipping and variant.CHROM == chrom:
+            if variant.POS < pos:
+                continue
+            if variant.POS == pos and n_at_pos > 0:
+                n_at_pos -= 1
+                continue
+        skipping = False
+        yield variant
+
+
+class Checkpoint:
+    """Save the states of the instances periodically while scanning,
+    together with the position of the last variant scanned.
+
+    In a serial scan, the position is the CHROM/POS of the last variant
+    and the number of variants at that position that have been scanned.
+    In a parallel scan, it is the number of chunks that have been merged.
+    """
+
+    def __init__(self, directory, every, key):
+        os.makedirs(directory, exist_ok=True)
+        self.file = path.join(directory, CHECKPOINT_FILE)
+        self.every = every
+        self.key = key
+        self.n_variants = 0
+        self.n_saved = 0
+        self.chrom = None
+        self.pos = None
+        self.n_at_pos = 0
+
+    def load(self, mode):
+        """Load the checkpoint saved by the same run in the same mode
+        (serial or parallel). Returns None if there is no such checkpoint.
+        """
+        if not path.isfile(self.file):
+            return None
+        with open(self.file, "rb") as fckp:
+            checkpoint = pickle.load(fckp)
+        if checkpoint["key"] != self.key:
+            logger.warning(
+                "Checkpoint %r was saved by a different run, ignored.",
+                self.file,
+            )
+            return None
+        if checkpoint["mode"] != mode:
+            logger.warning(
+                "Checkpoint %r was saved by a %s scan, "
+                "cannot be resumed by a %s scan, ignored.",
+                self.file,
+                checkpoint["mode"],
+                mode,
+            )
+            return None
+        return checkpoint
+
+    def restore(self, ones, mode):
+        """Restore the states of the instances from the checkpoint.
+        Returns the checkpoint, or None if there is nothing to restore."""
+        checkpoint = self.load(mode)
+        if checkpoint is None:
+            return None
+        for instance, state in zip(ones, checkpoint["states"]):
+            instance.merge(state)
+        self.n_variants = self.n_saved = checkpoint["n_variants"]
+        self.chrom = checkpoint.get("chrom")
+        self.pos = checkpoint.get("pos")
+        self.n_at_pos = checkpoint.get("n_at_pos", 0)
+        logger.info(
+            "Resuming from checkpoint %r, %s variants have been read.",
+            self.file,
+            self.n_variants,
+        )
+        return checkpoint
+
+    def save(self, ones, mode, **position):
+        """Save the states of the instances and the position"""
+        checkpoint = {
+            "key": self.key,
+            "mode": mode,
+            "n_variants": self.n_variants,
+            "states": [instance.state() for instance in ones],
+            **position,
+        }
+        # write to a temporary file then rename it, so that a run killed
+        # while saving doesn't corrupt the last checkpoint
+        tmpfile = f"{self.file}.tmp"
+        with open(tmpfile, "wb") as fckp:
+            pickle.dump(checkpoint, fckp, protocol=pickle.HIGHEST_PROTOCOL)
+            fckp.flush()
+            os.fsync(fckp.fileno())
+        os.replace(tmpfile, self.file)
+        self.n_saved = self.n_variants
+        logger.debug(
+            "- checkpoint saved at %s variants.", self.n_variants
+        )
+
+    def save_serial(self, ones, done=False):
+        """Save the checkpoint of a serial scan"""
+        self.save(
+            ones,
+            "serial",
+            chrom=self.chrom,
+            pos=self.pos,
+            n_at_pos=self.n_at_pos,
+            done=done,
+        )
+
+    def update(self, block, ones):
+        """Track the position after a block of variants is scanned,
+        and save the checkpoint if it is time to"""
+        variants = block.variants
+        chrom = variants[-1].CHROM
+        pos = variants[-1].POS
+        n_at_pos = 0
+        for variant in reversed(variants):
+            if variant.POS != pos or variant.CHROM != chrom:
+                break
+            n_at_pos += 1
+        else:
+            # the whole block is at the same position
+            if (chrom, pos) == (self.chrom, self.pos):
+                n_at_pos += self.n_at_pos
+        self.chrom = chrom
+        self.pos = pos
+        self.n_at_pos = n_at_pos
+        self.n_variants += len(block)
+        if self.n_variants - self.n_saved >= self.every:
+            self.save_serial(ones)
+
+    def iter_variants(self, vcf, regions, checkpoint=None):
+        """Iterate over the variants in the regions (or the whole file),
+        resuming from the checkpoint if given.
+
+        The variants are visited in the order of the regions, which are
+        sorted and merged (see `vcfstats.regions`), or in the order of the
+        contigs in the index without regions. So the scan resumes from the
+        position of the checkpoint through an index query. If the vcf file
+        is not indexed, the variants that have been read are skipped.
+        """
+        if checkpoint and checkpoint["done"]:
+            return
+        if not checkpoint:
+            yield from iter_regions(vcf, regions) if regions else vcf
+            return
+
+        if not regions:
+            try:
+                vcf.num_records
+            except ValueError:
+                indexed = False
+            else:
+                indexed = self.chrom in vcf.seqnames
+            if not indexed:
+                logger.warning(
+                    "VCF file is not indexed, "
+                    "skipping the %s variants that have been read ...",
+                    self.n_variants,
+                )
+                yield from islice(vcf, self.n_variants, None)
+                return
+            regions = vcf.seqnames
+
+        yield from skip_variants(
+            iter_regions(vcf, resume_regions(regions, self.chrom, self.pos)),
+            self.chrom,
+            self.pos,
+            self.n_at_pos,
+        )
@@ -1,16 +1,30 @@
 """Powerful VCF statistics"""
 import logging
+import multiprocessing as mp
+import os
 import sys
-from itertools import chain
-from os import path
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import PathLike, path
 
 from argx import ArgumentParser
 from cyvcf2 import VCF
 from rich.console import Console
+from rich.markup import escape
 from rich.table import Table
 from simpleconf import Config
 
-from .instance import Instance
+from .block import iter_blocks
+from .cache import ResultCache
+from .checkpoint import Checkpoint, fingerprint
+from .columns import Bins, FileStack
+from .export import export_instances, require_pyarrow, unique_names
+from .formula import MACRO_CACHE
+from .instance import Instance, get_ggs_env
+from .profile import PROFILER
+from .progress import Progress
+from .regions import iter_regions, merge_regions, parse_region
 from .utils import HERE, MACROS, DEVPARS_DEFAULTS, capture_c_msg, logger
 
 
@@ -32,47 +46,277 @@ def get_params():
     return params
 
 
-def get_vcf_by_regions(vcffile, regions):
-    """Compile all the regions provided by use together,
-    and return a chained iterator."""
+# the extensions of the files listing VCF files
+VCF_LIST_EXTS = (".list", ".txt")
+# the extensions stripped from the VCF files to label them
+VCF_EXTS = (".vcf.gz", ".vcf.bgz", ".vcf", ".bcf", ".gz")
+
+
+def get_vcf_files(vcfs):
+    """Get the VCF files from `--vcf`, with the lists of VCF files
+    (ending with `.list` or `.txt`) expanded: one VCF file per line, blank
+    lines and lines starting with `#` are skipped, and relative paths are
+    relative to the list"""
+    if isinstance(vcfs, (str, PathLike)):
+        vcfs = [vcfs]
+    ret = []
+    for vcf in vcfs:
+        vcf = str(vcf)
+        if not vcf.endswith(VCF_LIST_EXTS):
+            ret.append(vcf)
+            continue
+        with open(vcf) as fin:
+            for line in fin:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    ret.append(path.join(path.dirname(vcf), line))
+    if not ret:
+        raise ValueError("No VCF files given.")
+    return ret
+
+
+def file_labels(vcffiles):
+    """Label the VCF files with their names without the extensions,
+    duplicated names get suffixes __0, __1, ..."""
+    labels = []
+    for vcffile in vcffiles:
+        label = path.basename(vcffile)
+        for ext in VCF_EXTS:
+            if label.endswith(ext):
+                label = label[: -len(ext)]
+                break
+        labels.append(label)
+    return unique_names(labels)
+
+
+def get_vcf_by_regions(vcffile, regions, reader=None):
+    """Get the variants in the regions (sorted and merged, see
+    `combine_regions`) as one flat iterator, or all the variants if no
+    regions given.
+    `reader` are the options to open the vcf file with, see
+    `get_reader_options`."""
     logger.info("Getting vcf handler by given regions ...")
     with capture_c_msg("cyvcf2"):
-        vcf = VCF(str(vcffile), gts012=True)
+        vcf = VCF(str(vcffile), gts012=True, **(reader or {}))
         samples = vcf.samples
         if regions:
-            if len(regions) == 1:
-                vcf = vcf(regions[0])
-            else:
-                vcf2 = chain(vcf(regions[0]), vcf(regions[1]))
-                for region in regions[2:]:
-                    vcf2 = chain(vcf2, vcf(region))
-                vcf = vcf2
+            vcf = iter_regions(vcf, regions)
 
     return vcf, samples
 
 
-def combine_regions(regions, regfile):
-    """Combine all the regions.
-    Users have to make sure there is no overlapping between regions"""
+def restrict_samples(ones, samples):
+    """Restrict the samples to read to the ones that the formulas use.
+
+    This is possible if all the terms are site macros (scope="site"), or
+    per-sample macros (scope="sample") with the samples selected by
+    `{...}`. The sample indices of the formulas are remapped for a reader
+    opened with only those samples.
+
+    Returns the names of the samples to read, or None if all the samples
+    are needed.
+    """
+    indices = set()
+    for instance in ones:
+        for term in instance.formula.terms():
+            scope = term.term.get("scope")
+            if scope == "site":
+                continue
+            if scope != "sample" or not term.samples:
+                return None
+            indices.update(term.samples)
+
+    indices = sorted(indices)
+    if (
+        not indices
+        or len(indices) == len(samples)
+        or indices[-1] >= len(samples)
+    ):
+        return None
+
+    for instance in ones:
+        instance.formula.remap_samples(indices)
     logger.info(
-        "Combining regions, be reminded that regions should "
-        "NOT be overlapping ..."
+        "Only reading the samples used by the formulas: %s of %s",
+        len(indices),
+        len(samples),
     )
-    # make sure regions have no overlaps
+    return [samples[sidx] for sidx in indices]
+
+
+def required_fields(ones):
+    """Get the fields that the formulas read (see `vcfstats.macros`),
+    or None if any of the macros doesn't declare its fields"""
+    fields = set()
+    for instance in ones:
+        for term in instance.formula.terms():
+            if term.term.get("fields") is None:
+                return None
+            fields.update(term.term["fields"])
+    return fields
+
+
+def check_fields(vcffile, fields):
+    """Check if the INFO/FORMAT fields are defined in the header of the
+    vcf file, so that a run doesn't fail or plot nothing after a scan.
+
+    The genotypes (GT) are not checked, as the sites-only files don't
+    define them, but the macros reading them still work (AAF, for example).
+    """
+    with capture_c_msg("cyvcf2"):
+        defined = {
+            f"{header.type}/{header.info().get('ID')}"
+            for header in VCF(str(vcffile)).header_iter()
+        }
+    missing = [
+        field
+        for field in sorted(fields)
+        if field.startswith(("INFO/", "FORMAT/")) and field not in defined
+    ]
+    if missing:
+        raise ValueError(
+            "Fields used by the formulas are not defined in the header of "
+            f"{vcffile}: {', '.join(missing)}"
+        )
+
+
+def get_reader_options(vcffile, ones, samples):
+    """Get the options to open the vcf file with, so that as little as
+    possible is decoded for the formulas:
+
+    - `samples`: the samples used by the formulas (see `restrict_samples`),
+        or none if the formulas don't read any sample data
+    - `lazy`: unpack the records only when the fields are read, if all the
+        macros declare their fields
+
+    The fields declared by the macros are checked against the header.
+    """
+    options = {}
+    reader_samples = restrict_samples(ones, samples)
+    fields = required_fields(ones)
+    if fields is not None:
+        check_fields(vcffile, fields)
+        if "GT" in fields and not samples:
+            logger.warning(
+                "The formulas read the genotypes, but %s has no samples.",
+                vcffile,
+            )
+        options["lazy"] = True
+        if not any(
+            field == "GT" or field.startswith("FORMAT/") for field in fields
+        ):
+            reader_samples = []
+            logger.info("No sample data used by the formulas, skipping them.")
+    if reader_samples is not None:
+        options["samples"] = reader_samples
+    return options
+
+
+def get_contigs(vcffile):
+    """Get the contigs of the vcf file in the index order"""
+    with capture_c_msg("cyvcf2"):
+        return VCF(str(vcffile)).seqnames
+
+
+def get_contig_lengths(vcffile):
+    """Get the lengths of the contigs from the header of the vcf file,
+    an empty dict if the header doesn't have them"""
+    with capture_c_msg("cyvcf2"):
+        vcf = VCF(str(vcffile))
+        try:
+            return dict(zip(vcf.seqnames, vcf.seqlens))
+        except AttributeError:
+            return {}
+
+
+def get_chunks(vcffile, regions):
+    """Split the work into chunks that can be scanned independently.
+
+    Each chunk is a list of regions. With regions given, the regions on
+    each contig are a chunk, otherwise each contig is. Chunks are returned
+    in the order they would be visited by a serial scan, so that merging
+    the partial results in this order gives the same results as the
+    serial scan.
+
+    Returns None if the vcf file is not indexed, which means it can only be
+    scanned serially.
+    """
+    if regions:
+        chunks = {}
+        for region in regions:
+            chunks.setdefault(parse_region(region)[0], []).append(region)
+        return list(chunks.values())
+
+    contigs = get_indexed_contigs(vcffile)
+    if contigs is None:
+        return None
+    return [[contig] for contig in contigs]
+
+
+def get_indexed_contigs(vcffile):
+    """Get the contigs in the index of the vcf file,
+    None if the vcf file is not indexed"""
+    with capture_c_msg("cyvcf2"):
+        vcf = VCF(str(vcffile))
+        try:
+            vcf.num_records
+        except ValueError:
+            return None
+        return vcf.seqnames
+
+
+def pushdown_contigs(vcffile, regions, ones):
+    """Restrict the regions to the contigs that the formulas are
+    restricted to (i.e. `AAF ~ CONTIG[12]`), so that only those contigs
+    are fetched from the index.
+
+    Returns the regions unchanged if any formula uses all contigs or the
+    vcf file is not indexed.
+    """
+    contigs = set()
+    for instance in ones:
+        formula_contigs = instance.formula.contigs()
+        if formula_contigs is None:
+            return regions
+        contigs |= formula_contigs
+
+    indexed = get_indexed_contigs(vcffile)
+    if indexed is None:
+        return regions
+    if regions:
+        pushed = [
+            region for region in regions if parse_region(region)[0] in contigs
+        ]
+    else:
+        pushed = [contig for contig in indexed if contig in contigs]
+    # no regions means all the variants, the formulas skip them anyway
+    return pushed or regions
+
+
+def combine_regions(regions, regfile, contigs=None):
+    """Combine all the regions, from the command line and the BED file(s).
+
+    The regions are sorted in the order of the contigs (the index order),
+    and the overlapping or adjacent ones are merged, so that no variants
+    are counted twice."""
+    logger.info("Combining regions ...")
     ret = regions[:] if regions else []
-    if regfile:
-        with open(regfile, "r") as freg:
+    if isinstance(regfile, (str, PathLike)):
+        regfile = [regfile]
+    for bedfile in regfile or []:
+        with open(bedfile, "r") as freg:
             for line in freg:
                 if line.startswith("#"):
                     continue
                 parts = line.strip().split("\t")[:3]
                 ret.append("{}:{}-{}".format(*parts))
-    return ret
+    return merge_regions(ret, contigs)
 
 
-def get_instances(opts, samples, default_devpars):
+def get_instances(opts, samples, default_devpars, lengths=None):
     """Get instances/formulas. This will determine h
-    ow many figures we are plotting"""
+    ow many figures we are plotting.
+    `lengths` are the lengths of the contigs, see `get_contig_lengths`"""
     logger.info("Getting instances ...")
     ret = []
 
@@ -90,6 +334,14 @@ def get_instances(opts, samples, default_devpars):
         ggs = opts.ggs[i] if i < len(opts.ggs) else None
         figtype = opts.figtype[i] if i < len(opts.figtype) else None
         figfmt = opts.figfmt[i] if i < len(opts.figfmt) else None
+        # a single value applies to all formulas
+        max_points = (
+            opts.max_points[0]
+            if len(opts.max_points) == 1
+            else opts.max_points[i]
+            if i < len(opts.max_points)
+            else 0
+        )
         devpars = {
             k: v[i] if i < len(v) else ddevpars[k]
             for k, v in vars(opts.devpars).items()
@@ -110,6 +362,11 @@ def get_instances(opts, samples, default_devpars):
                 opts.passed,
                 opts.savedata,
                 figfmt or "png",
+                opts.bins,
+                opts.binrange,
+                max_points,
+                opts.sketch,
+                lengths,
             )
         )
     return ret
@@ -140,6 +397,610 @@ def load_macrofile(macrofile):
     spec.loader.exec_module(importlib.util.module_from_spec(spec))
 
 
+def scan_variants(vcf, ones, variants=None, checkpoint=None, progress=None):
+    """Feed all the variants to the instances,
+    returns the number of variants read.
+
+    The variants are read from `variants` if given, otherwise from `vcf`.
+    With a checkpoint, the position is tracked and the states of the
+    instances are saved periodically.
+    With a progress (see `vcfstats.progress.Progress`), the progress is
+    reported periodically.
+    """
+    iterate_blocks = [
+        PROFILER.wrap("instance", instance.title, instance.iterate_block)
+        for instance in ones
+        if instance.formula.batch
+    ]
+    # the compiled formulas with the data bound, one call for each variant
+    other_runs = [
+        (
+            PROFILER.wrap("instance", instance.title, instance.formula.run),
+            instance.data.append,
+            instance.data.extend,
+        )
+        for instance in ones
+        if not instance.formula.batch
+    ]
+    track_memory = PROFILER.enabled
+    n_variants = 0
+    with capture_c_msg("cyvcf2"):
+        for block in iter_blocks(vcf if variants is None else variants):
+            # save entries, cache aggr
+            for iterate_block in iterate_blocks:
+                iterate_block(block, vcf)
+            # variant by variant, so that the macro values are shared
+            for variant in block.variants:
+                for run, data_append, data_extend in other_runs:
+                    run(variant, vcf, data_append, data_extend)
+            if (n_variants + len(block)) // 10000 > n_variants // 10000:
+                logger.debug(  # pragma: no cover
+                    "- %s variants read.", n_variants + len(block)
+                )
+            n_variants += len(block)
+            if checkpoint:
+                checkpoint.update(block, ones)
+            if track_memory:
+                PROFILER.sample_memory(ones)
+            if progress is not None:
+                progress.update(n_variants)
+    if track_memory:
+        PROFILER.track_memory(ones)
+    return n_variants
+
+
+def scan_serial(
+    vcffile, regions, ones, checkpoint, reader=None, progress=None
+):
+    """Scan the variants serially with a checkpoint, resuming from it
+    if it was saved by the same run.
+    `reader` are the options to open the vcf file with.
+    Returns the number of variants read, including the resumed ones"""
+    resumed = checkpoint.restore(ones, "serial")
+    with capture_c_msg("cyvcf2"):
+        vcf = VCF(str(vcffile), gts012=True, **(reader or {}))
+    scan_variants(
+        vcf,
+        ones,
+        checkpoint.iter_variants(vcf, regions, resumed),
+        checkpoint,
+        progress,
+    )
+    checkpoint.save_serial(ones, done=True)
+    return checkpoint.n_variants
+
+
+def _init_worker(macrofile):
+    """Initialize a worker process for parallel scanning"""
+    # instances are created in each worker, don't repeat the logs
+    logger.setLevel(max(logger.level, logging.WARNING))
+    if macrofile:
+        load_macrofile(macrofile)
+
+
+def get_binranges(vcf, ones):
+    """Decide the ranges of the bins that are not given, from the first
+    values, the same way as a serial scan does, so that the partial bins
+    from parallel jobs can be merged."""
+    ranges = [
+        instance.data.binrange if instance.bins else None
+        for instance in ones
+    ]
+    pending = {
+        i: Bins(instance.datacols, instance.bins)
+        for i, instance in enumerate(ones)
+        if instance.bins and ranges[i] is None
+    }
+    if not pending:
+        return ranges
+
+    logger.info("Deciding the ranges of the bins ...")
+    with capture_c_msg("cyvcf2"):
+        for variant in vcf:
+            for i, bins in list(pending.items()):
+                ones[i].formula.run(variant, vcf, bins.append, bins.extend)
+                if bins.binrange is not None:
+                    ranges[i] = bins.binrange
+                    del pending[i]
+            if not pending:
+                break
+
+    for i, bins in pending.items():
+        bins.fix_range()
+        ranges[i] = bins.binrange
+    return ranges
+
+
+def _scan_chunk(opts, default_devpars, regions, binranges, indices=None):
+    """Scan a chunk of regions in a worker process.
+    Only the instances of the formulas at `indices` are scanned, if given.
+    Returns the number of variants read, the partial states of
+    the instances, the counters of the macro cache and the stats of the
+    profiler if enabled"""
+    MACRO_CACHE.reset()
+    PROFILER.reset()
+    if opts.profile:
+        PROFILER.enable()
+    vcf, samples = get_vcf_by_regions(opts.vcf, regions)
+    ones = get_instances(
+        opts, samples, default_devpars, get_contig_lengths(opts.vcf)
+    )
+    if indices is not None:
+        ones = [ones[i] for i in indices]
+    reader = get_reader_options(opts.vcf, ones, samples)
+    if reader:
+        vcf = get_vcf_by_regions(opts.vcf, regions, reader)[0]
+    for instance, binrange in zip(ones, binranges):
+        if binrange is not None:
+            instance.data.set_range(*binrange)
+    n_variants = scan_variants(vcf, ones)
+    return (
+        n_variants,
+        [instance.state() for instance in ones],
+        (MACRO_CACHE.hits, MACRO_CACHE.misses),
+        PROFILER.stats() if opts.profile else None,
+    )
+
+
+def scan_parallel(
+    opts,
+    default_devpars,
+    regions,
+    ones,
+    checkpoint=None,
+    indices=None,
+    reader=None,
+    progress=None,
+):
+    """Scan the variants by chunks in a process pool,
+    and merge the partial results into the instances.
+    `ones` are the instances of the formulas at `indices`, if not all.
+    `reader` are the options to open the vcf file with (see
+    `get_reader_options`), which the workers get the same way.
+    With a checkpoint, it is saved after each chunk is merged, and the
+    chunks that have been merged are skipped when resuming.
+    With a progress, it is updated after each chunk is merged.
+    Returns the number of variants read, or None if the vcf file
+    cannot be split into chunks."""
+    chunks = get_chunks(opts.vcf, regions)
+    if chunks is None:
+        logger.warning(
+            "VCF file is not indexed, cannot scan it in parallel, "
+            "falling back to a serial scan."
+        )
+        return None
+
+    n_variants = 0
+    n_chunks = 0
+    if checkpoint:
+        resumed = checkpoint.restore(ones, "parallel")
+        if resumed:
+            n_variants = resumed["n_variants"]
+            n_chunks = resumed["chunks"]
+            chunks = chunks[n_chunks:]
+
+    binranges = get_binranges(
+        get_vcf_by_regions(opts.vcf, regions, reader)[0], ones
+    )
+    for instance, binrange in zip(ones, binranges):
+        if binrange is not None:
+            instance.data.set_range(*binrange)
+
+    logger.info(
+        "Scanning %s chunks with %s jobs ...", len(chunks), opts.jobs
+    )
+    with ProcessPoolExecutor(
+        max_workers=opts.jobs,
+        initializer=_init_worker,
+        initargs=(opts.macro,),
+    ) as executor:
+        results = executor.map(
+            _scan_chunk,
+            [opts] * len(chunks),
+            [default_devpars] * len(chunks),
+            chunks,
+            [binranges] * len(chunks),
+            [indices] * len(chunks),
+        )
+        # executor.map keeps the order of the chunks
+        for n_chunk, states, (hits, misses), profile in results:
+            n_variants += n_chunk
+            MACRO_CACHE.hits += hits
+            MACRO_CACHE.misses += misses
+            for instance, state in zip(ones, states):
+                instance.merge(state)
+            if profile:
+                PROFILER.merge(profile)
+                PROFILER.sample_memory(ones)
+            n_chunks += 1
+            if checkpoint:
+                checkpoint.n_variants = n_variants
+                checkpoint.save(ones, "parallel", chunks=n_chunks)
+            if progress is not None:
+                progress.update(n_variants)
+    if PROFILER.enabled:
+        PROFILER.track_memory(ones)
+    return n_variants
+
+
+def _scan_file(opts, default_devpars, vcffile, binranges):
+    """Scan a VCF file in a worker process, with multiple VCF files.
+    Returns the number of variants read, the summarized data of the
+    instances, the counters of the macro cache and the stats of the
+    profiler if enabled.
+
+    The formulas are not parsed again for each file, the parsed ones are
+    copied (see `vcfstats.formula.parse_formula`), with the samples of the
+    file set and compiled."""
+    MACRO_CACHE.reset()
+    PROFILER.reset()
+    if opts.profile:
+        PROFILER.enable()
+    opts = copy(opts)
+    opts.vcf = vcffile
+    regions = combine_regions(opts.region, opts.Region, get_contigs(vcffile))
+    vcf, samples = get_vcf_by_regions(vcffile, regions)
+    ones = get_instances(
+        opts, samples, default_devpars, get_contig_lengths(vcffile)
+    )
+    for instance, binrange in zip(ones, binranges):
+        if binrange is not None:
+            instance.data.set_range(*binrange)
+    pushed = pushdown_contigs(vcffile, regions, ones)
+    reader = get_reader_options(vcffile, ones, samples)
+    if pushed != regions or reader:
+        vcf = get_vcf_by_regions(vcffile, pushed, reader)[0]
+    n_variants = scan_variants(vcf, ones)
+    for instance in ones:
+        instance.summarize()
+    return (
+        n_variants,
+        [instance.data for instance in ones],
+        (MACRO_CACHE.hits, MACRO_CACHE.misses),
+        PROFILER.stats() if opts.profile else None,
+    )
+
+
+def scan_files(opts, default_devpars, vcffiles, labels, ones):
+    """Scan multiple VCF files in a process pool of `--jobs` workers, each
+    file serially by a worker.
+
+    `ones` are the instances parsed from the first file. With `--combine`,
+    the ranges of the bins are decided from it for all the files, so that
+    the bins of the files can be plotted together.
+    Returns the summarized data of the instances for each file, as
+    {label: [data of each instance]}, in the order of the files.
+    """
+    binranges = [None] * len(ones)
+    if opts.combine:
+        regions = combine_regions(
+            opts.region, opts.Region, get_contigs(vcffiles[0])
+        )
+        binranges = get_binranges(
+            get_vcf_by_regions(vcffiles[0], regions)[0], ones
+        )
+
+    jobs = max(1, min(opts.jobs, len(vcffiles)))
+    logger.info("Scanning %s VCF files with %s jobs ...", len(vcffiles), jobs)
+    ret = {}
+    n_variants = 0
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(opts.macro,),
+    ) as executor:
+        results = executor.map(
+            _scan_file,
+            [opts] * len(vcffiles),
+            [default_devpars] * len(vcffiles),
+            vcffiles,
+            [binranges] * len(vcffiles),
+        )
+        for i, (label, result) in enumerate(zip(labels, results)):
+            n_file, data, (hits, misses), profile = result
+            n_variants += n_file
+            MACRO_CACHE.hits += hits
+            MACRO_CACHE.misses += misses
+            if profile:
+                PROFILER.merge(profile)
+            ret[label] = data
+            logger.info(
+                "[r]%s[/r]: %s variants read (%s/%s files).",
+                label,
+                n_file,
+                i + 1,
+                len(vcffiles),
+                extra={"markup": True},
+            )
+    logger.info("%s variants read from %s files.", n_variants, len(vcffiles))
+    return ret
+
+
+def batch_instances(opts, ones, vcffiles, file_data):
+    """Get the instances to plot from the data of the files (see
+    `scan_files`): the instances of each file, saved in a subdirectory
+    named by the label of the file, or with `--combine`, the instances
+    with the data of all the files stacked, to be plotted in facets.
+
+    Returns a list of (instances, output directory, VCF file(s))
+    """
+    if opts.combine:
+        for i, instance in enumerate(ones):
+            instance.data = FileStack(
+                {label: data[i] for label, data in file_data.items()}
+            )
+            instance.facet = instance.data.name
+        return [(ones, opts.outdir, vcffiles)]
+
+    ret = []
+    for vcffile, (label, datas) in zip(vcffiles, file_data.items()):
+        outdir = path.join(opts.outdir, label)
+        os.makedirs(outdir, exist_ok=True)
+        file_ones = []
+        for instance, data in zip(ones, datas):
+            file_instance = copy(instance)
+            file_instance.title = f"{label}: {instance.title}"
+            file_instance.outprefix = path.join(
+                outdir, path.basename(instance.outprefix)
+            )
+            file_instance.data = data
+            file_ones.append(file_instance)
+        ret.append((file_ones, outdir, vcffile))
+    return ret
+
+
+# the instances to plot in the forked workers, see plot_instances()
+_PLOT_INSTANCES = []
+
+
+def _plot_instance(index):
+    """Plot the instance at index of _PLOT_INSTANCES.
+    Returns whether it is plotted successfully"""
+    instance = _PLOT_INSTANCES[index]
+    try:
+        instance.plot()
+    except Exception as exc:
+        logger.exception(
+            "[r]%s[/r]: Failed to plot: %s",
+            instance.title,
+            escape(str(exc)),
+            extra={"markup": True},
+        )
+        return False
+    return True
+
+
+def plot_instances(ones, jobs=1):
+    """Plot the instances, in a process pool if jobs > 1.
+
+    The instances are plotted independently, a failure in one doesn't
+    stop the others. Returns the titles of the instances that failed.
+    """
+    _PLOT_INSTANCES[:] = ones
+    try:
+        if jobs > 1 and "fork" not in mp.get_all_start_methods():
+            logger.warning(  # pragma: no cover
+                "Cannot plot in parallel without fork, plotting serially."
+            )
+            jobs = 1  # pragma: no cover
+
+        if jobs <= 1:
+            success = [_plot_instance(i) for i in range(len(ones))]
+        else:
+            logger.info(
+                "Plotting %s figures with %s jobs ...", len(ones), jobs
+            )
+            # import the plotting libraries once for all the workers
+            get_ggs_env()
+            # forked workers share the instances without pickling them
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=mp.get_context("fork"),
+            ) as executor:
+                futures = [
+                    executor.submit(_plot_instance, i)
+                    for i in range(len(ones))
+                ]
+                success = []
+                for instance, future in zip(ones, futures):
+                    try:
+                        success.append(future.result())
+                    except BrokenProcessPool:
+                        # the worker was killed, i.e. out of memory
+                        logger.error(
+                            "[r]%s[/r]: Plotting process died.",
+                            instance.title,
+                            extra={"markup": True},
+                        )
+                        success.append(False)
+    finally:
+        _PLOT_INSTANCES.clear()
+
+    return [
+        instance.title for instance, ok in zip(ones, success) if not ok
+    ]
+
+
+def scan(opts, default_devpars, regions, vcf, samples, ones, indices):
+    """Scan the variants for the instances at indices"""
+    all_scanned = len(indices) == len(ones)
+    ones = [ones[i] for i in indices]
+    indices = None if all_scanned else indices
+    pushed = pushdown_contigs(opts.vcf, regions, ones)
+    if pushed != regions:
+        logger.info(
+            "Only reading the contigs used by the formulas: %s",
+            ", ".join(
+                dict.fromkeys(parse_region(region)[0] for region in pushed)
+            ),
+        )
+    reader = get_reader_options(opts.vcf, ones, samples)
+    if pushed != regions or reader:
+        regions = pushed
+        vcf = get_vcf_by_regions(opts.vcf, regions, reader)[0]
+    checkpoint = None
+    if opts.checkpoint:
+        checkpoint = Checkpoint(
+            opts.checkpoint,
+            opts.checkpoint_every,
+            fingerprint(opts, regions, indices),
+        )
+    progress = None
+    if opts.progress or opts.status_json:
+        progress = Progress(
+            opts.vcf,
+            regions,
+            opts.progress or 10.0,
+            log=opts.progress > 0,
+            status_file=opts.status_json,
+            contigs=get_contigs(opts.vcf),
+            # the workers read the file in a parallel scan
+            use_offset=opts.jobs <= 1,
+        )
+    logger.info("Start reading variants ...")
+    if progress is not None:
+        progress.start()
+    n_variants = None
+    if opts.jobs > 1:
+        n_variants = scan_parallel(
+            opts,
+            default_devpars,
+            regions,
+            ones,
+            checkpoint,
+            indices,
+            reader,
+            progress,
+        )
+        if n_variants is None and progress is not None:
+            # falling back to a serial scan
+            progress.use_offset = True
+    if n_variants is None and checkpoint:
+        n_variants = scan_serial(
+            opts.vcf, regions, ones, checkpoint, reader, progress
+        )
+    if n_variants is None:
+        n_variants = scan_variants(vcf, ones, progress=progress)
+    if progress is not None:
+        progress.finish(n_variants)
+    logger.info("%s variants read.", n_variants)
+    logger.info(
+        "Macro cache: %s hits, %s misses (hit rate: %.1f%%).",
+        MACRO_CACHE.hits,
+        MACRO_CACHE.misses,
+        MACRO_CACHE.hit_rate() * 100,
+    )
+
+
+def run_file(opts, default_devpars):
+    """Scan a VCF file and plot (or export) the instances.
+    Returns the instances and the titles of those failed to plot"""
+    with PROFILER.timer("phase", "open"):
+        # TODO: should write to a different file instead of appending to
+        # opts.Region
+        regions = combine_regions(
+            opts.region, opts.Region, get_contigs(opts.vcf)
+        )
+        vcf, samples = get_vcf_by_regions(opts.vcf, regions)
+    with PROFILER.timer("phase", "parse"):
+        ones = get_instances(
+            opts, samples, default_devpars, get_contig_lengths(opts.vcf)
+        )
+
+    # the instances that need to be scanned, the others are loaded
+    # from the result cache
+    cache = cache_keys = None
+    indices = list(range(len(ones)))
+    if opts.cache_dir:
+        cache = ResultCache(
+            opts.cache_dir,
+            opts.cache_max_size * 1024 * 1024,
+            opts.cache_max_age * 24 * 3600,
+        )
+        cache_keys = [
+            cache.key(opts, regions, formula, samples, instance)
+            for formula, instance in zip(opts.formula, ones)
+        ]
+        indices = []
+        for i, instance in enumerate(ones):
+            data = cache.load(cache_keys[i])
+            if data is None:
+                indices.append(i)
+                continue
+            logger.info(
+                "[r]%s[/r]: data loaded from cache.",
+                instance.title,
+                extra={"markup": True},
+            )
+            instance.data = data
+    if indices:
+        with PROFILER.timer("phase", "scan"):
+            scan(opts, default_devpars, regions, vcf, samples, ones, indices)
+
+    with PROFILER.timer("phase", "summarize"):
+        for i in indices:
+            # save aggr
+            ones[i].summarize()
+            if cache:
+                cache.save(cache_keys[i], ones[i].data)
+
+    failed = []
+    if opts.no_plot:
+        with PROFILER.timer("phase", "export"):
+            manifest = export_instances(
+                ones, opts.formula, opts.outdir, opts.data_format, opts.vcf
+            )
+        logger.info("Manifest saved to %s", manifest)
+    else:
+        with PROFILER.timer("phase", "plot"):
+            failed = plot_instances(ones, opts.plot_jobs)
+
+    return ones, failed
+
+
+def run_files(opts, default_devpars, vcffiles):
+    """Scan multiple VCF files with the formulas parsed once, and plot (or
+    export) the instances of each file, or combined with `--combine`.
+    Returns the instances and the titles of those failed to plot"""
+    for name in ("checkpoint", "cache_dir", "progress", "status_json"):
+        if getattr(opts, name):
+            raise ValueError(
+                f"--{name.replace('_', '-')} is not supported with "
+                "multiple VCF files."
+            )
+
+    labels = file_labels(vcffiles)
+    with PROFILER.timer("phase", "parse"):
+        # the instances parsed once as the templates of the files
+        samples = get_vcf_by_regions(opts.vcf, [])[1]
+        ones = get_instances(
+            opts, samples, default_devpars, get_contig_lengths(opts.vcf)
+        )
+    with PROFILER.timer("phase", "scan"):
+        file_data = scan_files(opts, default_devpars, vcffiles, labels, ones)
+        logger.info(
+            "Macro cache: %s hits, %s misses (hit rate: %.1f%%).",
+            MACRO_CACHE.hits,
+            MACRO_CACHE.misses,
+            MACRO_CACHE.hit_rate() * 100,
+        )
+
+    batches = batch_instances(opts, ones, vcffiles, file_data)
+    ones = [instance for batch in batches for instance in batch[0]]
+    failed = []
+    if opts.no_plot:
+        with PROFILER.timer("phase", "export"):
+            for batch, outdir, vcf in batches:
+                manifest = export_instances(
+                    batch, opts.formula, outdir, opts.data_format, vcf
+                )
+                logger.info("Manifest saved to %s", manifest)
+    else:
+        with PROFILER.timer("phase", "plot"):
+            failed = plot_instances(ones, opts.plot_jobs)
+    return ones, failed
+
+
 def main():
     """Main entrance of the program"""
     # modify sys.argv to see if we have --list or -l option
@@ -174,28 +1035,35 @@ def main():
     _check_len_callback(opts.title, opts, name="title")
     _check_len_callback(opts.ggs, opts, name="ggs")
     logger.setLevel(getattr(logging, opts.loglevel.upper()))
+    if opts.profile:
+        PROFILER.enable()
 
     if opts.macro:
         load_macrofile(opts.macro)
+    if opts.no_plot:
+        # fail before scanning
+        require_pyarrow()
+
+    vcffiles = get_vcf_files(opts.vcf)
+    opts.vcf = vcffiles[0]
+    if len(vcffiles) > 1:
+        ones, failed = run_files(opts, default_devpars, vcffiles)
+    else:
+        ones, failed = run_file(opts, default_devpars)
+
+    if opts.profile:
+        PROFILER.track_memory(ones)
+        profile_file = path.join(opts.outdir, "profile.json")
+        PROFILER.save(profile_file)
+        PROFILER.print()
+        logger.info("Profile saved to %s", profile_file)
+
+    if failed:
+        logger.error(
+            "Failed to plot %s of %s figures: %s",
+            len(failed),
+            len(ones),
+            ", ".join(repr(title) for title in failed),
+        )
+        sys.exit(1)
 
-    vcf, samples = get_vcf_by_regions(
-        # TODO: should write to a different file instead of appending to
-        # opts.Region
-        opts.vcf, combine_regions(opts.region, opts.Region)
-    )
-    ones = get_instances(opts, samples, default_devpars)
-    logger.info("Start reading variants ...")
-    with capture_c_msg("cyvcf2"):
-        for i, variant in enumerate(vcf):
-            for instance in ones:
-                # save entries, cache aggr
-                instance.iterate(variant, vcf)
-            if i % 10000 == 0:  # pragma: no cover
-                logger.debug("- %s variants read.", i)
-    logger.info(
-        "%s variants read.", i
-    )
-    for i, instance in enumerate(ones):
-        # save aggr
-        instance.summarize()
-        instance.plot()
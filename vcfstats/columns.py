@@ -0,0 +1,894 @@
+"""Columnar storage of the plotting data"""
+import math
+
+import numpy
+
+from .sketch import KLLSketch
+
+# initial capacity of the column buffers
+INITIAL_CAPACITY = 1024
+
+# number of rows staged by `Columns` before they are converted into columns
+FLUSH_ROWS = 4096
+
+
+class Buffer:
+    """A growable numpy array"""
+
+    def __init__(self, dtype):
+        self.array = numpy.empty(INITIAL_CAPACITY, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getstate__(self):
+        # don't pickle the unused capacity
+        return {"array": self.view(), "size": self.size}
+
+    def __setstate__(self, state):
+        self.array = state["array"]
+        self.size = state["size"]
+
+    @property
+    def dtype(self):
+        """The dtype of the buffer"""
+        return self.array.dtype
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the buffer, including the capacity"""
+        return self.array.nbytes
+
+    def astype(self, dtype):
+        """Convert the buffer to another dtype"""
+        self.array = self.array.astype(dtype)
+
+    def extend(self, values):
+        """Append the values (an array) to the buffer"""
+        size = self.size + len(values)
+        if size > len(self.array):
+            capacity = max(len(self.array), INITIAL_CAPACITY)
+            while capacity < size:
+                capacity *= 2
+            array = numpy.empty(capacity, dtype=self.array.dtype)
+            array[: self.size] = self.array[: self.size]
+            self.array = array
+        self.array[self.size : size] = values
+        self.size = size
+
+    def view(self):
+        """The used part of the buffer, without copying"""
+        return self.array[: self.size]
+
+
+class NumericColumn:
+    """A column of continuous values.
+
+    The values are stored as int64 until a non-integer value comes,
+    then the column is promoted to float64.
+    """
+
+    type = "continuous"
+    coded = False
+
+    def __init__(self, name):
+        self.name = name
+        self.buffer = Buffer(numpy.int64)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the column"""
+        return self.buffer.nbytes
+
+    def extend(self, values):
+        """Append the values (a list or an array) to the column"""
+        values = numpy.asarray(values)
+        if values.dtype.kind not in "iub":
+            try:
+                values = values.astype(numpy.float64)
+            except (TypeError, ValueError):
+                # None in the values
+                values = numpy.array(
+                    [numpy.nan if val is None else val for val in values],
+                    dtype=numpy.float64,
+                )
+            if self.buffer.dtype.kind != "f":
+                self.buffer.astype(numpy.float64)
+        self.buffer.extend(values)
+
+    def merge(self, other):
+        """Append the values of the same column from other variants"""
+        self.extend(other.buffer.view())
+
+    def values(self):
+        """The values as a numpy array, without copying"""
+        return self.buffer.view()
+
+
+class CategoricalColumn:
+    """A column of categorical values, stored as integer codes
+    into a table of levels in the order they are first seen.
+
+    If the `levels` are declared (see `vcfstats.macros.categorical`),
+    the values are the codes already, and they are stored as they are.
+    """
+
+    type = "categorical"
+
+    def __init__(self, name, levels=None):
+        self.name = name
+        self.buffer = Buffer(numpy.int32)
+        self.coded = levels is not None
+        self.levels = list(levels or ())
+        self.index = {level: code for code, level in enumerate(self.levels)}
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the column"""
+        return self.buffer.nbytes
+
+    def encode(self, value):
+        """Get the code of a value, adding it to the levels if new"""
+        if value is None or value != value:  # None or NaN
+            return -1
+        try:
+            return self.index[value]
+        except KeyError:
+            code = self.index[value] = len(self.levels)
+            self.levels.append(value)
+            return code
+
+    def extend(self, values):
+        """Append the values (a list or an array) to the column"""
+        if self.coded:
+            self.buffer.extend(numpy.asarray(values, dtype=numpy.int32))
+            return
+        if isinstance(values, numpy.ndarray):
+            try:
+                uniques, inverse = numpy.unique(values, return_inverse=True)
+            except TypeError:  # not sortable
+                pass
+            else:
+                codes = numpy.array(
+                    [self.encode(val) for val in uniques.tolist()],
+                    dtype=numpy.int32,
+                )
+                self.buffer.extend(codes[inverse.ravel()])
+                return
+
+        encode = self.encode
+        self.buffer.extend(
+            numpy.array([encode(val) for val in values], dtype=numpy.int32)
+        )
+
+    def merge(self, other):
+        """Append the values of the same column from other variants"""
+        if self.coded and other.levels == self.levels:
+            self.buffer.extend(other.buffer.view())
+            return
+        codes = numpy.array(
+            [self.encode(val) for val in other.levels] + [-1],
+            dtype=numpy.int32,
+        )
+        # -1 (missing) is mapped to the last element, which is -1
+        self.buffer.extend(codes[other.buffer.view()])
+
+    def values(self):
+        """The values as a pandas.Categorical"""
+        import pandas
+
+        codes = self.buffer.view()
+        levels = self.levels
+        if self.coded:
+            # keep the declared order of the levels
+            return pandas.Categorical.from_codes(
+                codes, categories=levels
+            ).remove_unused_categories()
+        try:
+            order = sorted(range(len(levels)), key=levels.__getitem__)
+        except TypeError:  # levels with mixed types
+            order = None
+        if order is not None and order != list(range(len(levels))):
+            # sort the levels, as plotnine does for non-categorical data
+            recode = numpy.empty(len(levels) + 1, dtype=numpy.int32)
+            recode[order] = numpy.arange(len(levels), dtype=numpy.int32)
+            recode[-1] = -1
+            codes = recode[codes]
+            levels = [levels[i] for i in order]
+        return pandas.Categorical.from_codes(codes, categories=levels)
+
+
+COLUMN_CLASSES = {
+    "continuous": NumericColumn,
+    "categorical": CategoricalColumn,
+}
+
+
+def decode(values, levels):
+    """Turn the codes of categorical values into the levels, the values
+    are returned as they are if the levels are not declared (None)"""
+    if levels is None:
+        return values
+    return [levels[code] for code in values]
+
+
+class Columns:
+    """The plotting data of an instance, stored by columns.
+
+    It can be filled by rows with `append` and `extend`,
+    like a list of tuples, or by columns with `extend_columns`.
+    The rows are staged in a list and converted into the columns every
+    `FLUSH_ROWS` rows, or when the data is read (see `flush`).
+    `levels` are the declared levels of the columns (None for the columns
+    without), whose values are the codes of the levels.
+    """
+
+    def __init__(self, names, types, levels=None):
+        levels = levels or [None] * len(names)
+        self._columns = [
+            CategoricalColumn(name, lvls)
+            if lvls is not None
+            else COLUMN_CLASSES[type_](name)
+            for name, type_, lvls in zip(names, types, levels)
+        ]
+        self.staged = []
+
+    def __len__(self):
+        return len(self._columns[0]) + len(self.staged)
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
+
+    @property
+    def columns(self):
+        """The columns (`NumericColumn` or `CategoricalColumn`),
+        with the staged rows converted"""
+        self.flush()
+        return self._columns
+
+    @property
+    def names(self):
+        """The names of the columns"""
+        return [column.name for column in self._columns]
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the columns"""
+        return sum(column.nbytes for column in self.columns)
+
+    def append(self, row):
+        """Append a row"""
+        staged = self.staged
+        staged.append(row)
+        if len(staged) >= FLUSH_ROWS:
+            self.flush()
+
+    def extend(self, rows):
+        """Append the rows"""
+        staged = self.staged
+        staged.extend(rows)
+        if len(staged) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Convert the staged rows into the columns"""
+        if not self.staged:
+            return
+        for column, values in zip(self._columns, zip(*self.staged)):
+            column.extend(values)
+        self.staged = []
+
+    def extend_columns(self, *values):
+        """Append the values (arrays with the same length) by columns"""
+        for column, vals in zip(self.columns, values):
+            column.extend(vals)
+
+    def merge(self, other):
+        """Append the data from other variants with the same columns"""
+        for column, other_column in zip(self.columns, other.columns):
+            column.merge(other_column)
+
+    def to_frame(self):
+        """Build a pandas.DataFrame from the columns.
+
+        Continuous columns are not copied. The column names are kept as
+        they are, even if they are duplicated.
+        """
+        import pandas
+
+        df = pandas.DataFrame(
+            {i: column.values() for i, column in enumerate(self.columns)},
+            copy=False,
+        )
+        df.columns = self.names
+        return df
+
+    def to_columns(self):
+        """The data as `Columns`, which is itself"""
+        return self
+
+
+# the names of the columns of the five-number summaries
+SUMMARY_NAMES = ("Min", "Q1", "Median", "Q3", "Max")
+
+# number of values to decide the range of the bins automatically
+AUTO_RANGE_SAMPLE = 10000
+
+
+class Bins:
+    """Streaming fixed-width bins of continuous values, by group.
+
+    This replaces `Columns` for distribution plots of TERM ~ TERM, keeping
+    only the counts of the bins for each group, instead of all the values.
+    The bins start at `start` with width `width`, covering `nbins` bins
+    up to `stop`. Values out of the range are counted in extra bins of the
+    same width, so no values are lost.
+
+    If the range is not given, the first `AUTO_RANGE_SAMPLE` values are kept
+    and used to decide it. The groups are the codes of the levels if the
+    `levels` of the columns are declared, see `Columns`.
+    """
+
+    def __init__(self, names, nbins, binrange=None, levels=None):
+        self.names = names
+        self.nbins = nbins
+        self.levels = levels or [None] * len(names)
+        self.start = self.stop = self.width = None
+        # group => {bin index => count}
+        self.counts = {}
+        # values before the range is decided
+        self.pending = []
+        if binrange:
+            self.set_range(*binrange)
+
+    def __len__(self):
+        return sum(
+            sum(counts.values()) for counts in self.counts.values()
+        ) + len(self.pending)
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the bins"""
+        # key, value and the hash table slot for each bin
+        return 64 * (
+            sum(len(counts) for counts in self.counts.values())
+            + len(self.pending)
+        )
+
+    @property
+    def binrange(self):
+        """The range of the bins, None if not decided yet"""
+        if self.start is None:
+            return None
+        return self.start, self.stop
+
+    def set_range(self, low, high):
+        """Set the range of the bins, and count the pending values"""
+        low = float(low)
+        high = float(high)
+        if high <= low:
+            high = low + 1.0
+        self.start = low
+        self.stop = high
+        self.width = (high - low) / self.nbins
+        pending = self.pending
+        self.pending = []
+        self.extend(pending)
+
+    def fix_range(self):
+        """Decide the range from the pending values"""
+        if self.start is not None:
+            return
+        values = [
+            val
+            for val, _ in self.pending[:AUTO_RANGE_SAMPLE]
+            if val is not None and math.isfinite(val)
+        ]
+        if values:
+            self.set_range(min(values), max(values))
+        else:
+            self.set_range(0.0, 1.0)
+
+    def _index(self, value):
+        """Get the index of the bin for a value"""
+        index = math.floor((value - self.start) / self.width)
+        # the upper bound of the range is included in the last bin
+        if index == self.nbins and value <= self.stop:
+            return index - 1
+        return index
+
+    def append(self, row):
+        """Count a row of (value, group)"""
+        self.extend((row,))
+
+    def extend(self, rows):
+        """Count the rows of (value, group)"""
+        if self.start is None:
+            self.pending.extend(rows)
+            if len(self.pending) >= AUTO_RANGE_SAMPLE:
+                self.fix_range()
+            return
+
+        index = self._index
+        for value, group in rows:
+            # missing or infinite values
+            if value is None or not math.isfinite(value):
+                continue
+            counts = self.counts.setdefault(group, {})
+            idx = index(value)
+            counts[idx] = counts.get(idx, 0) + 1
+
+    def extend_columns(self, values, groups):
+        """Count the values by columns"""
+        if self.start is None or len(values) < 2:
+            self.extend(zip(values.tolist(), groups.tolist()))
+            return
+
+        values = values.astype(numpy.float64)
+        kept = numpy.isfinite(values)
+        values = values[kept]
+        groups = groups[kept]
+        index = numpy.floor((values - self.start) / self.width)
+        index[(index == self.nbins) & (values <= self.stop)] -= 1
+        index = index.astype(numpy.int64)
+        try:
+            group_levels, group_codes = numpy.unique(
+                groups, return_inverse=True
+            )
+        except TypeError:  # not sortable
+            self.extend(zip(values.tolist(), groups.tolist()))
+            return
+
+        # count the values by group then by bin, keeping the groups in
+        # the order they first appear
+        group_codes = group_codes.ravel()
+        group_levels = group_levels.tolist()
+        first_seen = numpy.unique(group_codes, return_index=True)[1]
+        for code in numpy.argsort(first_seen, kind="stable").tolist():
+            bins, counts = numpy.unique(
+                index[group_codes == code], return_counts=True
+            )
+            gcounts = self.counts.setdefault(group_levels[code], {})
+            for idx, count in zip(bins.tolist(), counts.tolist()):
+                gcounts[idx] = gcounts.get(idx, 0) + count
+
+    def merge(self, other):
+        """Add the counts of the bins from other variants.
+        The bins have to have the same range."""
+        if other.pending:
+            self.extend(other.pending)
+        if not other.counts:
+            return
+        if self.start is None:
+            self.set_range(other.start, other.stop)
+        if (self.start, self.stop, self.nbins) != (
+            other.start,
+            other.stop,
+            other.nbins,
+        ):
+            raise ValueError("Cannot merge bins with different ranges.")
+        for group, counts in other.counts.items():
+            gcounts = self.counts.setdefault(group, {})
+            for idx, count in counts.items():
+                gcounts[idx] = gcounts.get(idx, 0) + count
+
+    def _rows(self):
+        """The centers of the bins, the groups and the counts. Empty bins
+        between the first and the last non-empty bins of each group are
+        included."""
+        self.fix_range()
+        centers = []
+        groups = []
+        counts = []
+        for group, gcounts in self.counts.items():
+            if not gcounts:  # pragma: no cover
+                continue
+            first = min(gcounts)
+            last = max(gcounts)
+            for idx in range(first, last + 1):
+                centers.append(self.start + (idx + 0.5) * self.width)
+                groups.append(group)
+                counts.append(gcounts.get(idx, 0))
+        return (
+            numpy.array(centers, dtype=numpy.float64),
+            groups,
+            numpy.array(counts, dtype=numpy.int64),
+        )
+
+    def to_frame(self):
+        """Build a pandas.DataFrame of the bins, with the centers of the bins,
+        the groups and the counts as columns. Empty bins between the first
+        and the last non-empty bins of each group are included."""
+        import pandas
+
+        centers, groups, counts = self._rows()
+        groups = decode(groups, self.levels[1])
+        df = pandas.DataFrame({0: centers, 1: groups, 2: counts})
+        df.columns = self.names + ["Count"]
+        return df
+
+    def to_columns(self):
+        """The bins as `Columns`, with the centers of the bins, the groups
+        and the counts as columns"""
+        columns = Columns(
+            self.names + ["Count"],
+            ["continuous", "categorical", "continuous"],
+            [None, self.levels[1], None],
+        )
+        columns.extend_columns(*self._rows())
+        return columns
+
+
+class Summaries:
+    """Streaming quantile sketches of continuous values, by group.
+
+    This replaces `Columns` for boxplots of TERM ~ TERM, keeping only a
+    KLL sketch (see `vcfstats.sketch.KLLSketch`) of size `k` for each
+    group, instead of all the values. The boxes are drawn from the
+    five-number summaries (minimum, quartiles and maximum) of the groups,
+    with the quartiles within `vcfstats.sketch.rank_error(k)` in rank.
+    The groups are the codes of the levels if the `levels` of the columns
+    are declared, see `Columns`.
+    """
+
+    def __init__(self, names, k, levels=None):
+        self.names = names
+        self.k = k
+        self.levels = levels or [None] * len(names)
+        # group => sketch
+        self.sketches = {}
+
+    def __len__(self):
+        return sum(len(sketch) for sketch in self.sketches.values())
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the sketches"""
+        return sum(sketch.nbytes for sketch in self.sketches.values())
+
+    def _sketch(self, group):
+        """Get the sketch of a group, adding it if new"""
+        try:
+            return self.sketches[group]
+        except KeyError:
+            sketch = self.sketches[group] = KLLSketch(self.k)
+            return sketch
+
+    def append(self, row):
+        """Add a row of (value, group)"""
+        self.extend((row,))
+
+    def extend(self, rows):
+        """Add the rows of (value, group)"""
+        sketches = self.sketches
+        for value, group in rows:
+            try:
+                sketch = sketches[group]
+            except KeyError:
+                sketch = self._sketch(group)
+            sketch.update(value)
+
+    def extend_columns(self, values, groups):
+        """Add the values by columns"""
+        self.extend(zip(values.tolist(), groups.tolist()))
+
+    def merge(self, other):
+        """Merge the sketches from other variants"""
+        for group, sketch in other.sketches.items():
+            self._sketch(group).merge(sketch)
+
+    def _rows(self):
+        """The groups, the five-number summaries and the counts"""
+        groups = []
+        summaries = []
+        counts = []
+        for group, sketch in self.sketches.items():
+            if not sketch.count:
+                continue
+            groups.append(group)
+            summaries.append(sketch.summary())
+            counts.append(sketch.count)
+        summaries = numpy.array(summaries, dtype=numpy.float64).reshape(
+            -1, len(SUMMARY_NAMES)
+        )
+        return (
+            groups,
+            *summaries.T,
+            numpy.array(counts, dtype=numpy.int64),
+        )
+
+    def to_frame(self):
+        """Build a pandas.DataFrame of the summaries, with the groups, the
+        minimums, the quartiles, the maximums and the counts as columns"""
+        import pandas
+
+        groups, *rows = self._rows()
+        groups = decode(groups, self.levels[1])
+        df = pandas.DataFrame(dict(enumerate([groups, *rows])))
+        df.columns = self.columns
+        return df
+
+    @property
+    def columns(self):
+        """The names of the columns of the summaries"""
+        return [self.names[1]] + list(SUMMARY_NAMES) + ["Count"]
+
+    def to_columns(self):
+        """The summaries as `Columns`, see `to_frame`"""
+        columns = Columns(
+            self.columns,
+            ["categorical"] + ["continuous"] * (len(SUMMARY_NAMES) + 1),
+            [self.levels[1]] + [None] * (len(SUMMARY_NAMES) + 1),
+        )
+        columns.extend_columns(*self._rows())
+        return columns
+
+
+class Reservoir:
+    """A uniform random sample of at most `size` rows, kept while scanning.
+
+    This replaces `Columns` for scatter plots, so that the number of points
+    to plot is bounded, no matter how many variants are scanned. The rows
+    are sampled with reservoir sampling (Algorithm R). If there is a
+    Group column (the 3rd one), the sample is stratified by group: each
+    group keeps an equal share of the `size` rows, so that small groups
+    are not drowned by large ones. The `levels` of the columns are the
+    declared ones, see `Columns`.
+    """
+
+    def __init__(self, names, types, size, seed=8525, levels=None):
+        self.names = names
+        self.types = types
+        self.size = size
+        self.levels = levels or [None] * len(names)
+        self.grouped = len(names) > 2
+        self.rng = numpy.random.default_rng(seed)
+        # group => [number of rows seen, [kept values of each column]]
+        self.strata = {}
+
+    def __len__(self):
+        return sum(len(kept[0]) for _, kept in self.strata.values())
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the kept rows"""
+        return sum(
+            arr.nbytes for _, kept in self.strata.values() for arr in kept
+        )
+
+    @property
+    def seen(self):
+        """The number of rows seen"""
+        return sum(seen for seen, _ in self.strata.values())
+
+    @property
+    def quota(self):
+        """The number of rows each group can keep"""
+        return max(1, self.size // max(1, len(self.strata)))
+
+    def rates(self):
+        """The sampling rates, overall and by group, as
+        {group: (number of rows kept, number of rows seen)},
+        with None as the group for the overall rate"""
+        ret = {None: (len(self), self.seen)}
+        if self.grouped:
+            groups = decode(list(self.strata), self.levels[2])
+            for group, (seen, kept) in zip(groups, self.strata.values()):
+                ret[group] = (len(kept[0]), seen)
+        return ret
+
+    def _stratum(self, group):
+        """Get the stratum of a group, adding it if new"""
+        try:
+            return self.strata[group]
+        except KeyError:
+            stratum = self.strata[group] = [
+                0,
+                [numpy.empty(0, dtype=object) for _ in self.names],
+            ]
+            self._shrink()
+            return stratum
+
+    def _shrink(self, quota=None):
+        """Subsample the groups that keep more rows than the quota.
+
+        A uniform sample of a uniform sample is still a uniform sample,
+        so the sampling can go on with the new quota.
+        """
+        quota = quota or self.quota
+        for stratum in self.strata.values():
+            kept = stratum[1]
+            if len(kept[0]) > quota:
+                index = numpy.sort(
+                    self.rng.choice(len(kept[0]), quota, replace=False)
+                )
+                stratum[1] = [arr[index] for arr in kept]
+
+    def _add(self, stratum, values):
+        """Sample the rows (as object arrays by columns) into a stratum"""
+        nrows = len(values[0])
+        seen, kept = stratum
+        quota = self.quota
+        # fill the reservoir first
+        nfill = min(max(quota - seen, 0), nrows)
+        if nfill:
+            kept = stratum[1] = [
+                numpy.concatenate((arr, vals[:nfill]))
+                for arr, vals in zip(kept, values)
+            ]
+        if nfill < nrows:
+            # row i (0-based, counting all rows seen) replaces a random
+            # row in the reservoir with probability quota / (i + 1)
+            slots = self.rng.integers(
+                0, numpy.arange(seen + nfill, seen + nrows) + 1
+            )
+            replaced = slots < quota
+            slots = slots[replaced]
+            for arr, vals in zip(kept, values):
+                # later rows win if they replace the same slot
+                arr[slots] = vals[nfill:][replaced]
+        stratum[0] = seen + nrows
+
+    @staticmethod
+    def _to_objects(values):
+        """Convert the values of a column to an object array"""
+        if isinstance(values, numpy.ndarray):
+            values = values.tolist()
+        arr = numpy.empty(len(values), dtype=object)
+        arr[:] = list(values)
+        return arr
+
+    def append(self, row):
+        """Sample a row"""
+        self.extend((row,))
+
+    def extend(self, rows):
+        """Sample the rows"""
+        rows = list(rows)
+        if not rows:
+            return
+        if not self.grouped:
+            self.extend_columns(*zip(*rows))
+            return
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[2], []).append(row)
+        for group, grows in groups.items():
+            self._add(
+                self._stratum(group),
+                [self._to_objects(vals) for vals in zip(*grows)],
+            )
+
+    def extend_columns(self, *values):
+        """Sample the rows given by columns"""
+        if not len(values[0]):
+            return
+        values = [self._to_objects(vals) for vals in values]
+        if not self.grouped:
+            self._add(self._stratum(None), values)
+            return
+        # split by group, keeping the groups in the order they first appear
+        index = {}
+        for i, group in enumerate(values[2].tolist()):
+            index.setdefault(group, []).append(i)
+        for group, idx in index.items():
+            self._add(self._stratum(group), [vals[idx] for vals in values])
+
+    def merge(self, other):
+        """Merge the sample from other variants.
+
+        For each group, the rows are drawn from both samples in proportion
+        to the number of rows they have seen, so that the merged sample is
+        still uniform.
+        """
+        for group in other.strata:
+            self._stratum(group)
+        other._shrink(self.quota)
+        for group, (oseen, okept) in other.strata.items():
+            stratum = self.strata[group]
+            seen, kept = stratum
+            if not seen:
+                stratum[:] = [oseen, okept]
+                continue
+            total = min(self.quota, seen + oseen)
+            nself = self.rng.hypergeometric(seen, oseen, total)
+            mine = numpy.sort(
+                self.rng.choice(len(kept[0]), nself, replace=False)
+            )
+            theirs = numpy.sort(
+                self.rng.choice(len(okept[0]), total - nself, replace=False)
+            )
+            stratum[:] = [
+                seen + oseen,
+                [
+                    numpy.concatenate((arr[mine], oarr[theirs]))
+                    for arr, oarr in zip(kept, okept)
+                ],
+            ]
+
+    def to_columns(self):
+        """The sampled rows as `Columns`"""
+        columns = Columns(self.names, self.types, self.levels)
+        for _, kept in self.strata.values():
+            columns.extend_columns(*(arr.tolist() for arr in kept))
+        return columns
+
+    def to_frame(self):
+        """Build a pandas.DataFrame from the sampled rows"""
+        return self.to_columns().to_frame()
+
+
+class FileStack:
+    """The data of the same formula from multiple VCF files, stacked with
+    a `FILE` column, for the figures combining the files.
+
+    `parts` are {label of the file: data (i.e. `Columns` or `Bins`)},
+    the data of all the files have to be of the same kind, and bins have
+    to have the same range.
+    """
+
+    def __init__(self, parts, name="FILE"):
+        self.parts = parts
+        self.name = name
+
+    def __len__(self):
+        return sum(len(data) for data in self.parts.values())
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the data of the files"""
+        return sum(data.nbytes for data in self.parts.values())
+
+    @property
+    def width(self):
+        """The width of the bins, the same for all the files"""
+        return next(iter(self.parts.values())).width
+
+    def rates(self):
+        """The sampling rates of the scatter plots, overall and by file
+        (and group), see `Reservoir.rates`"""
+        kept = seen = 0
+        ret = {}
+        for label, data in self.parts.items():
+            for group, (gkept, gseen) in data.rates().items():
+                if group is None:
+                    kept += gkept
+                    seen += gseen
+                    ret[label] = (gkept, gseen)
+                else:
+                    ret[f"{label}/{group}"] = (gkept, gseen)
+        return {None: (kept, seen), **ret}
+
+    def to_columns(self):
+        """The data of the files as `Columns`, with the `FILE` column"""
+        columns = None
+        for label, data in self.parts.items():
+            part = data.to_columns()
+            if columns is None:
+                columns = Columns(
+                    part.names + [self.name],
+                    [column.type for column in part.columns]
+                    + ["categorical"],
+                    [
+                        column.levels if column.coded else None
+                        for column in part.columns
+                    ]
+                    + [None],
+                )
+            for column, other in zip(columns.columns, part.columns):
+                column.merge(other)
+            columns.columns[-1].extend([label] * len(part))
+        return columns
+
+    def to_frame(self):
+        """Build a pandas.DataFrame of the data of the files, with the
+        `FILE` column"""
+        return self.to_columns().to_frame()
@@ -0,0 +1,195 @@
+"""Exporting the data of the instances as columnar files (--no-plot)"""
+import json
+from os import path
+
+import numpy
+
+from .columns import Bins, FileStack, Reservoir, Summaries
+from .sketch import rank_error
+from .utils import logger
+
+# the formats and the extensions of the files
+DATA_FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+MANIFEST_FILE = "manifest.json"
+
+
+def require_pyarrow():
+    """Import pyarrow, which is an optional dependency"""
+    try:
+        import pyarrow
+    except ImportError as exc:  # pragma: no cover
+        raise ImportError(
+            "pyarrow is required to export the data with --no-plot, "
+            "install it with `pip install vcfstats[arrow]`."
+        ) from exc
+    return pyarrow
+
+
+def unique_names(names):
+    """Make the column names unique, the same way as the saved csv files:
+    duplicated names get suffixes __0, __1, ..."""
+    dups = {name for name in names if names.count(name) > 1}
+    counter = {}
+    ret = []
+    for name in names:
+        if name in dups:
+            ret.append(f"{name}__{counter.setdefault(name, 0)}")
+            counter[name] += 1
+        else:
+            ret.append(name)
+    return ret
+
+
+def column_to_arrow(column):
+    """Convert a column (see `vcfstats.columns`) to an arrow array,
+    categorical columns are dictionary-encoded with their codes"""
+    pyarrow = require_pyarrow()
+    values = column.buffer.view()
+    if column.type == "continuous":
+        return pyarrow.array(values)
+
+    try:
+        levels = pyarrow.array(column.levels)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # levels with mixed types
+        levels = pyarrow.array([str(level) for level in column.levels])
+    indices = pyarrow.array(values, mask=values < 0, type=pyarrow.int32())
+    return pyarrow.DictionaryArray.from_arrays(indices, levels)
+
+
+def to_arrow(columns, metadata=None):
+    """Convert the columns (`vcfstats.columns.Columns`) to an arrow table,
+    with the metadata (a dict of strings) in the schema"""
+    pyarrow = require_pyarrow()
+    table = pyarrow.Table.from_arrays(
+        [column_to_arrow(column) for column in columns.columns],
+        names=unique_names(columns.names),
+    )
+    if metadata:
+        table = table.replace_schema_metadata(metadata)
+    return table
+
+
+def write_table(table, outfile, data_format="parquet"):
+    """Write an arrow table to a Parquet or Feather (Arrow IPC) file"""
+    if data_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, outfile)
+    elif data_format == "feather":
+        import pyarrow.feather as feather
+
+        feather.write_feather(table, outfile)
+    else:
+        raise ValueError(
+            f"Unknown data format: {data_format}, "
+            f"expect one of {list(DATA_FORMATS)}."
+        )
+
+
+def describe(instance, formula, columns, table, datafile):
+    """Describe an instance and its data file for the manifest"""
+    data = files = instance.data
+    if isinstance(data, FileStack):
+        # the data of the files are of the same kind
+        data = next(iter(files.parts.values()))
+    if isinstance(data, Bins):
+        kind = "bins"
+    elif isinstance(data, Reservoir):
+        kind = "sample"
+    elif isinstance(data, Summaries):
+        kind = "summaries"
+    else:
+        kind = "values"
+
+    entry = {
+        "title": instance.title,
+        "formula": formula,
+        "figtype": instance.figtype,
+        "file": path.basename(datafile),
+        "kind": kind,
+        "rows": table.num_rows,
+        "columns": [
+            {
+                "name": name,
+                "type": column.type,
+                "dtype": str(field.type),
+            }
+            for name, column, field in zip(
+                table.column_names, columns.columns, table.schema
+            )
+        ],
+    }
+    if isinstance(files, FileStack):
+        entry["files"] = list(files.parts)
+    if kind == "bins":
+        entry["bins"] = {
+            "start": data.start,
+            "width": data.width,
+            "nbins": data.nbins,
+        }
+    elif kind == "summaries":
+        entry["sketch"] = {"k": data.k, "rank_error": rank_error(data.k)}
+    elif kind == "sample":
+        entry["sampled"] = [
+            {"group": group, "kept": kept, "seen": seen}
+            for group, (kept, seen) in files.rates().items()
+        ]
+    return entry
+
+
+def export_instances(
+    ones, formulas, outdir, data_format="parquet", vcf=None
+):
+    """Write the data of the instances to columnar files, and a manifest
+    (`manifest.json` in `outdir`) describing the formula and the columns
+    of each instance. `vcf` is the VCF file scanned, or the list of them
+    for the data combined from multiple VCF files.
+
+    Returns the path of the manifest.
+    """
+    from . import __version__
+
+    require_pyarrow()
+    manifest = {
+        "version": __version__,
+        "vcf": (
+            [str(vcffile) for vcffile in vcf]
+            if isinstance(vcf, (list, tuple))
+            else vcf and str(vcf)
+        ),
+        "format": data_format,
+        "instances": [],
+    }
+    for instance, formula in zip(ones, formulas):
+        datafile = instance.outprefix + DATA_FORMATS[data_format]
+        columns = instance.data.to_columns()
+        table = to_arrow(
+            columns,
+            {
+                "vcfstats.title": instance.title,
+                "vcfstats.formula": formula,
+            },
+        )
+        write_table(table, datafile, data_format)
+        logger.info(
+            "[r]%s[/r]: data saved to: %s",
+            instance.title,
+            datafile,
+            extra={"markup": True},
+        )
+        manifest["instances"].append(
+            describe(instance, formula, columns, table, datafile)
+        )
+
+    manifest_file = path.join(outdir, MANIFEST_FILE)
+    with open(manifest_file, "w") as fout:
+        json.dump(manifest, fout, indent=2, default=_json_default)
+    return manifest_file
+
+
+def _json_default(obj):
+    """Dump numpy scalars (i.e. groups of the bins) in the manifest"""
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    return str(obj)  # pragma: no cover
@@ -1,9 +1,14 @@
 """Handling the formulas"""
+import math
 from collections import OrderedDict
+from copy import deepcopy
+from functools import partial
+from inspect import Parameter, signature
 
 import numpy
 from lark import Lark, Token, Transformer, v_args
 
+from .profile import PROFILER
 from .utils import MACROS, logger, parse_subsets
 
 
@@ -23,12 +28,21 @@ class VcfStatsTransformer(Transformer):
         """The aggr rule"""
         aggr_args = []
         aggr_kwargs = {}
-        if kwargs:
-            if isinstance(kwargs[0], Token):
-                for i in range(0, len(kwargs), 2):
-                    aggr_kwargs[str(kwargs[i])] = kwargs[i + 1]
-            else:
-                aggr_args.extend(kwargs)
+        # the positional terms (i.e. the group) and the NAME=value pairs
+        # can come in any order
+        kwargs = iter(kwargs)
+        for arg in kwargs:
+            if not isinstance(arg, Token):
+                aggr_args.append(arg)
+                continue
+            value = next(kwargs)
+            if isinstance(value, Token):  # NUMBER
+                value = (
+                    float(value)
+                    if any(char in value for char in ".eE")
+                    else int(value)
+                )
+            aggr_kwargs[str(arg)] = value
 
         return Aggr(str(name), term, *aggr_args, **aggr_kwargs)
 
@@ -45,22 +59,142 @@ start: expr ["~" expr | "~"]
 ?expr: aggr | term
 term: NAME [items] [samples]
     | "1" -> one
-aggr: NAME "(" term ("," NAME "=" term | "," term)* ")"
+aggr: NAME "(" term ("," NAME "=" (term | NUMBER) | "," term)* ")"
 items: "[" [ITEM] ("," [ITEM])* "]"
 samples: "{" ITEM ("," ITEM)* "}"
 
-NAME: /[A-Za-z_]\w+/
+NAME: /[A-Za-z_]\w*/
+NUMBER.2: /[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?/
 ITEM: /[^\]},]+/
 %ignore /\s+/
 """
 
-PARSER = Lark(
-    GRAMMAR,
-    parser="lalr",
-    debug=True,
-    maybe_placeholders=True,
-    transformer=VcfStatsTransformer(),
-)
+_PARSER = None
+
+
+def get_parser():
+    """Get the parser of the formulas.
+
+    It is built at the first use, and the parsing tables are cached by
+    lark in the temporary directory, so that a run that doesn't parse any
+    formulas (i.e. `--list`) doesn't build it, and the other runs load it
+    from the cache.
+    """
+    global _PARSER
+    if _PARSER is None:
+        _PARSER = Lark(
+            GRAMMAR,
+            parser="lalr",
+            maybe_placeholders=True,
+            transformer=VcfStatsTransformer(),
+            cache=True,
+        )
+    return _PARSER
+
+
+def _keyword_params(func):
+    """The names of the arguments with defaults of a function, which are
+    the parameters that an aggregation or its hooks accept"""
+    if func is None:
+        return []
+    try:
+        params = signature(func).parameters.values()
+    except ValueError:  # builtins, i.e. int
+        return []
+    return [
+        param.name
+        for param in params
+        if param.default is not Parameter.empty
+        and param.kind
+        in (Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY)
+    ]
+
+
+class MacroCache:
+    """Cache the values of the macros for the current variant.
+
+    All terms of all formulas share the cache, so that each macro is
+    evaluated at most once for each variant.
+    """
+
+    def __init__(self):
+        self.variant = None
+        self.values = {}
+        self.block = None
+        self.block_values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def getter(self, macro):
+        """Get a function `(variant, vcf) -> value` of the macro, with the
+        macro function and its number of arguments resolved once"""
+        func = macro["func"]
+        with_vcf = macro["nargs"] == 2
+
+        def get(variant, vcf):
+            if variant is not self.variant:
+                # keep a reference to the variant, so its id won't be reused
+                self.variant = variant
+                self.values = {}
+
+            key = (func, vcf) if with_vcf else func
+            values = self.values
+            try:
+                value = values[key]
+            except KeyError:
+                self.misses += 1
+                value = func(variant, vcf) if with_vcf else func(variant)
+                values[key] = value
+            else:
+                self.hits += 1
+            return value
+
+        return get
+
+    def get(self, macro, variant, vcf):
+        """Get the value of the macro for the variant"""
+        return self.getter(macro)(variant, vcf)
+
+    def get_batch(self, macro, block, vcf):
+        """Get the values of the batch macro for a block of variants"""
+        if block is not self.block:
+            self.block = block
+            self.block_values = {}
+
+        batch = macro["batch"]
+        key = (batch, vcf) if macro["batch_nargs"] == 2 else batch
+        try:
+            value = self.block_values[key]
+        except KeyError:
+            self.misses += 1
+            if macro["batch_nargs"] == 2:
+                value = batch(block, vcf)
+            else:
+                value = batch(block)
+            self.block_values[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def hit_rate(self):
+        """The rate of the macro calls that are served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def reset(self):
+        """Clear the cache and the counters"""
+        self.variant = None
+        self.values = {}
+        self.block = None
+        self.block_values = {}
+        self.hits = 0
+        self.misses = 0
+
+
+MACRO_CACHE = MacroCache()
+
+# values of the macros that are not wrapped into a list
+SEQUENCE_TYPES = (list, tuple, numpy.ndarray)
 
 
 class Term:
@@ -77,6 +211,17 @@ class Term:
         if not self.term.get("type"):
             raise TypeError("No type specified for Term: {}".format(self.term))
 
+        # the size of the windows, the subset is the size instead
+        self.window = None
+        if self.term.get("window"):
+            self.window = self.window_size(items)
+            self.subsets = None
+
+        # the levels of the values, if the macro returns their codes
+        self.levels = self.term.get("levels")
+        if self.levels and self.subsets:
+            self.subset_codes()  # try to raise
+
         if self.term["type"] == "continuous" and self.subsets:
             if len(self.subsets) != 2:
                 raise KeyError(
@@ -88,6 +233,38 @@ class Term:
             if self.subsets[1]:
                 self.subsets[1] = float(self.subsets[1])
 
+        self.compile()
+
+    def window_size(self, items):
+        """Get the size of the windows from the subset of the term
+        (i.e. `WINDOW[1000000]` or `WINDOW[1e6]`)"""
+        if not items:
+            return self.term["window"]
+        if len(items) != 1:
+            raise KeyError(
+                "Expect the size of the windows as the only subset "
+                f"for Term: {self.name}"
+            )
+        size = float(items[0])  # try to raise
+        if size < 1 or not size.is_integer():
+            raise ValueError(
+                f"Expect a positive integer as the size of the windows "
+                f"for Term {self.name}, got {items[0]!r}."
+            )
+        return int(size)
+
+    def subset_codes(self):
+        """Get the codes of the subsets for a term with levels
+        (i.e. `GTTYPEs[HET]`), which are checked against the codes
+        returned by the macro"""
+        unknown = [sub for sub in self.subsets if sub not in self.levels]
+        if unknown:
+            raise ValueError(
+                f"Unknown levels {unknown} for Term {self.name}, "
+                f"expect any of {list(self.levels)}."
+            )
+        return [self.levels.index(sub) for sub in self.subsets]
+
     def set_samples(self, samples):
         """Set the samples for the term"""
         if self.samples:
@@ -100,8 +277,11 @@ class Term:
                     )
                 else:
                     self.samples[i] = samples.index(sample)
+        self.compile()
 
     def __repr__(self):
+        if self.window:
+            return "<Term {}(window={})>".format(self.name, self.window)
         if self.subsets and self.samples:
             return "<Term {}(subsets={}, samples={})>".format(
                 self.name, self.subsets, self.samples
@@ -119,41 +299,105 @@ class Term:
             self.term == other.term
             and self.subsets == other.subsets
             and self.samples == other.samples
+            and self.window == other.window
         )
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def run(self, variant, vcf, passed):
-        """Run the variant"""
-        if passed and variant.FILTER:
-            return False
-        if self.term["nargs"] == 2:
-            value = self.term["func"](variant, vcf)
-        else:
-            value = self.term["func"](variant)
+    def subset_check(self):
+        """Get a function telling if all the values are in the subsets,
+        None if there are no subsets to check"""
+        if not self.subsets:
+            return None
 
-        if value is False or value is None:
-            return False
-        # numpy.array
-        if not hasattr(value, "T") and not isinstance(value, (tuple, list)):
-            value = [value]
-        if self.samples:
-            value = [value[sidx] for sidx in self.samples]
+        if self.term["type"] == "continuous":
+            lower, upper = self.subsets
+            if lower is None and upper is None:
+                return None
+            if upper is None:
+                return lambda value: not any(val < lower for val in value)
+            if lower is None:
+                return lambda value: not any(val > upper for val in value)
+            return lambda value: not any(
+                val < lower or val > upper for val in value
+            )
 
-        if self.term["type"] == "continuous" and self.subsets:
-            if self.subsets[0] is not None and any(
-                val < self.subsets[0] for val in value
-            ):
+        subsets = self.subset_codes() if self.levels else self.subsets
+        if isinstance(subsets, list):
+            subsets = frozenset(subsets)
+        return lambda value: all(val in subsets for val in value)
+
+    def compile(self):
+        """Compile `run` for the term, with the macro, the samples and the
+        subset checks resolved, so that nothing is looked up per variant.
+
+        It is called again when the samples are set.
+        """
+        get = MACRO_CACHE.getter(self.term)
+        samples = tuple(self.samples or ())
+        check = self.subset_check()
+        size = self.window
+
+        def run(variant, vcf, passed):
+            """Run the variant"""
+            if passed and variant.FILTER:
                 return False
-            if self.subsets[1] is not None and any(
-                val > self.subsets[1] for val in value
-            ):
+            value = get(variant, vcf)
+
+            if value is False or value is None:
                 return False
-        if self.term["type"] == "categorical" and self.subsets:
-            if any(val not in self.subsets for val in value):
+            if not isinstance(value, SEQUENCE_TYPES):
+                value = [value]
+            if samples:
+                value = [value[sidx] for sidx in samples]
+            if size:
+                value = [val // size * size for val in value]
+            if check is not None and not check(value):
                 return False
-        return value
+            return value
+
+        self.run = PROFILER.wrap("macro", self.term["func"].__name__, run)
+
+    def run_block(self, block, vcf, passed):
+        """Run a block of variants with the batch version of the macro.
+
+        Returns the values as a matrix with a row for each variant, and
+        a mask of the variants that are kept, which are the ones
+        that `run` doesn't return False for.
+        """
+        mask = numpy.ones(len(block), dtype=bool)
+        if passed:
+            mask &= block.passed
+
+        with PROFILER.timer("macro", self.term["func"].__name__):
+            value = MACRO_CACHE.get_batch(self.term, block, vcf)
+        if numpy.ma.isMaskedArray(value):
+            missing = numpy.ma.getmaskarray(value)
+            if missing.ndim > 1:
+                missing = missing.any(axis=1)
+            mask &= ~missing
+            value = numpy.ma.getdata(value)
+        if value.ndim == 1:
+            value = value[:, None]
+        if self.samples:
+            value = value[:, self.samples]
+        if self.window:
+            value = value // self.window * self.window
+
+        if self.term["type"] == "continuous" and self.subsets:
+            if self.subsets[0] is not None:
+                mask &= ~(value < self.subsets[0]).any(axis=1)
+            if self.subsets[1] is not None:
+                mask &= ~(value > self.subsets[1]).any(axis=1)
+        if self.term["type"] == "categorical" and self.subsets:
+            subsets = (
+                self.subset_codes()
+                if self.levels
+                else numpy.array(self.subsets, dtype=object)
+            )
+            mask &= numpy.isin(value, subsets).all(axis=1)
+        return value, mask
 
 
 class One(Term):
@@ -163,6 +407,96 @@ class One(Term):
         super().__init__(name, items, samples)
 
 
+def state_nbytes(state):
+    """Approximate number of bytes used by the state of a group of an
+    aggregation: the sketches and the arrays know their sizes, and the
+    lists (i.e. the values of an aggregation without the streaming hooks,
+    or the partial sums of `SUM`) are sized from their lengths"""
+    nbytes = getattr(state, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    if isinstance(state, (list, tuple)):
+        if state and isinstance(state[0], (list, tuple)):
+            return 56 + sum(8 + state_nbytes(item) for item in state)
+        # a slot and a number object for each item
+        return 56 + 40 * len(state)
+    # a number
+    return 32
+
+
+class WindowStates:
+    """The states of an aggregation over the fixed-size windows of a
+    `WINDOW` term, in a dense array for each contig, indexed by the
+    integer codes of the windows (the start of a window // the size),
+    instead of the entries of a dict.
+
+    The arrays are sized from the lengths of the contigs in the header
+    of the VCF file, and grown if a window is beyond (i.e. the header has
+    no lengths).
+    """
+
+    def __init__(self, size, lengths=None):
+        self.size = size
+        self.lengths = lengths or {}
+        self.arrays = OrderedDict()
+
+    def __len__(self):
+        return len(self.arrays)
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the arrays and the states"""
+        return sum(
+            array.nbytes
+            + sum(
+                state_nbytes(state)
+                for state in array.tolist()
+                if state is not None
+            )
+            for array in self.arrays.values()
+        )
+
+    def array(self, contig, code):
+        """Get the array of the states of a contig, with the window at
+        `code` in it"""
+        array = self.arrays.get(contig)
+        if array is None:
+            length = self.lengths.get(contig, 0)
+            # empty object arrays are filled with None
+            array = numpy.empty(
+                max(-(-length // self.size), code + 1), dtype=object
+            )
+            self.arrays[contig] = array
+        elif code >= len(array):
+            grown = numpy.empty(max(code + 1, 2 * len(array)), dtype=object)
+            grown[: len(array)] = array
+            array = self.arrays[contig] = grown
+        return array
+
+    def items(self):
+        """Iterate over the contigs, the starts of the windows and their
+        states, for the windows with states, by contig and window"""
+        for contig, array in self.arrays.items():
+            for code, state in enumerate(array.tolist()):
+                if state is not None:
+                    yield contig, code * self.size, state
+
+    def merge(self, other, merge_state):
+        """Merge the states of the windows from another run, the states of
+        the same window are merged with `merge_state(state, other)`"""
+        for contig, start, state in other.items():
+            code = start // self.size
+            array = self.array(contig, code)
+            if array[code] is None:
+                array[code] = state
+            else:
+                array[code] = merge_state(array[code], state)
+
+    def clear(self):
+        """Clear the states"""
+        self.arrays.clear()
+
+
 class Aggr:
     """The aggregation"""
 
@@ -177,23 +511,90 @@ class Aggr:
             raise ValueError("Aggregation has to work with a term.")
 
         self.term = term
-        self.filter = kwargs.get("filter")
-        self.group = kwargs.get("group", args[0] if args else None)
+        self.filter = kwargs.pop("filter", None)
+        self.group = kwargs.pop("group", args[0] if args else None)
+        for arg in (self.filter, self.group):
+            if arg is not None and not isinstance(arg, Term):
+                raise TypeError(
+                    f"Expect a term for filter and group, got {arg!r}."
+                )
+        self.params = self._check_params(name, kwargs)
 
-        self.name = "{}({})".format(name, self.term.name)
-        if self.term.term["type"] != "continuous":
+        self.name = "{}({})".format(
+            name,
+            ", ".join(
+                [self.term.name]
+                + [f"{key}={val:g}" for key, val in self.params.items()]
+            ),
+        )
+        if self.term.term["type"] != "continuous" and not self.aggr.get(
+            "categorical"
+        ):
             raise TypeError("Cannot aggregate on categorical data.")
 
         if self.group and self.group.term["type"] != "categorical":
             raise TypeError("Cannot aggregate on continuous groups.")
 
         self.xgroup = None
+        # the lengths of the contigs, to size the arrays of the windows
+        self.lengths = {}
+        self.compile()
 
     def __repr__(self):
         return "<Aggr {}({}, filter={}, group={})>".format(
             self.aggr["func"].__name__, self.term, self.filter, self.group
         )
 
+    def _check_params(self, name, params):
+        """Check the parameters of the aggregation (i.e. `q=0.9`), against
+        the keyword arguments of the function (or of `init` and `finalize`),
+        and the ranges and the integer parameters declared by the
+        aggregation. The integer parameters given as floats (i.e. `k=1e3`)
+        are converted.
+        """
+        if self.aggr.get("update") is None:
+            accepted = _keyword_params(self.aggr["func"])
+        else:
+            accepted = _keyword_params(self.aggr["init"]) + _keyword_params(
+                self.aggr["finalize"]
+            )
+        ranges = self.aggr.get("ranges", {})
+        integers = self.aggr.get("integers", ())
+        for key, val in params.items():
+            if key not in accepted:
+                raise ValueError(
+                    f"Unknown argument {key!r} for aggregation {name!r}, "
+                    f"expect filter, group or one of {accepted}."
+                )
+            if not isinstance(val, (int, float)):
+                raise TypeError(
+                    f"Expect a number for argument {key!r} of "
+                    f"aggregation {name!r}, got {val!r}."
+                )
+            if key in integers:
+                if val != int(val):
+                    raise ValueError(
+                        f"Expect argument {key!r} of aggregation {name!r} "
+                        f"to be an integer, got {val!r}."
+                    )
+                val = params[key] = int(val)
+            lower, upper = ranges.get(key, (None, None))
+            lower = -math.inf if lower is None else lower
+            upper = math.inf if upper is None else upper
+            if not lower <= val <= upper:
+                raise ValueError(
+                    f"Expect argument {key!r} of aggregation {name!r} to be "
+                    f"in [{lower}, {upper}], got {val!r}."
+                )
+        return params
+
+    def _params_of(self, func):
+        """The parameters that a hook accepts"""
+        accepted = _keyword_params(func)
+        return {
+            key: val for key, val in self.params.items() if key in accepted
+        }
+
     def has_filter(self):
         """Tell if I have filter"""
         return (
@@ -202,85 +603,424 @@ class Aggr:
             or (self.group and self.group.name == "FILTER")
         )
 
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the states of the groups,
+        with the key and the hash table slot of each group"""
+        if isinstance(self.cache, WindowStates):
+            return self.cache.nbytes
+        return sum(
+            64
+            + (
+                sum(64 + state_nbytes(state) for state in value.values())
+                if isinstance(value, dict)
+                else state_nbytes(value)
+            )
+            for value in self.cache.values()
+        )
+
     def setxgroup(self, xvar):
         """Set the group of X"""
         if not self.group:
             self.group = xvar
         else:
             self.xgroup = xvar
+        self.compile()
+
+    def window_layout(self):
+        """How the groups are laid out over the windows of a `WINDOW` term,
+        if the states are kept in dense arrays (see `WindowStates`):
+
+        - "window": grouped by the windows (across the contigs)
+        - "contig": grouped by the contigs, for each window (`X`)
+        - "window_x": grouped by the windows, for each contig (`X`)
+
+        None if the aggregation is not grouped by windows, or by windows
+        and another term than `CONTIG`.
+        """
+
+        def is_window(term):
+            return term is not None and term.window is not None
+
+        def is_contig(term):
+            return term is not None and term.term is MACROS.get("CONTIG")
+
+        if is_window(self.group):
+            if self.xgroup is None:
+                return "window"
+            if is_contig(self.xgroup):
+                return "window_x"
+        elif is_contig(self.group) and is_window(self.xgroup):
+            return "contig"
+        return None
+
+    def compile(self):
+        """Compile `run` and `_update` for the aggregation, with the
+        terms and the streaming hooks resolved.
+
+        It has to be called again when the terms are changed.
+        """
+        layout = self.window_layout()
+        if layout is None:
+            if isinstance(self.cache, WindowStates):
+                self.cache = OrderedDict()
+        elif not isinstance(self.cache, WindowStates) or not self.cache:
+            window = self.xgroup if layout == "contig" else self.group
+            self.cache = WindowStates(window.window, self.lengths)
+
+        update = self.aggr.get("update")
+        if update is None:
+
+            def _update(cache, grup, val):
+                """Add a value to a group of the cache"""
+                # no streaming hooks, keep all the values
+                cache.setdefault(grup, []).append(val)
+
+        else:
+            init = self.aggr["init"]
+            init_params = self._params_of(init)
+            if init_params:
+                init = partial(init, **init_params)
 
-    def run(self, variant, vcf, passed):
-        """Run each variant"""
-        if self.filter and self.filter.run(variant, vcf, passed) is False:
+            def _update(cache, grup, val):
+                """Add a value to a group of the cache"""
+                if grup in cache:
+                    cache[grup] = update(cache[grup], val)
+                else:
+                    cache[grup] = update(init(), val)
+
+        self._update = _update
+
+        if update is None:
+
+            def _update_state(state, val):
+                """Add a value to the state of a window"""
+                if state is None:
+                    return [val]
+                state.append(val)
+                return state
+
+        else:
+
+            def _update_state(state, val):
+                """Add a value to the state of a window"""
+                return update(init() if state is None else state, val)
+
+        self._update_state = _update_state
+
+        run_filter = self.filter.run if self.filter else None
+        if not self.group:
+
+            def run(variant, vcf, passed):
+                """Run each variant"""
+                if (
+                    run_filter is not None
+                    and run_filter(variant, vcf, passed) is False
+                ):
+                    return
+                raise RuntimeError(
+                    "No group specified, don't know how to aggregate."
+                )
+
+            self.run = run
             return
 
+        run_group = self.group.run
+        run_term = self.term.run
+        run_xgroup = self.xgroup.run if self.xgroup else None
+        cache = self.cache
+        if layout is not None:
+            self.run = PROFILER.wrap(
+                "aggregation",
+                self.name,
+                self._compile_windows(
+                    run_filter, run_group, run_term, run_xgroup, layout
+                ),
+            )
+            return
+
+        def run(variant, vcf, passed):
+            """Run each variant"""
+            if (
+                run_filter is not None
+                and run_filter(variant, vcf, passed) is False
+            ):
+                return
+
+            group = run_group(variant, vcf, passed)
+            if group is False:
+                return
+
+            value = run_term(variant, vcf, passed)
+            if value is False:
+                return
+
+            if len(group) > 1 and len(value) != len(group):
+                raise ValueError(
+                    "Cannot aggregate on more than one group, "
+                    + "make sure you specified sample for sample data."
+                )
+
+            if run_xgroup is None:
+                for grup, val in zip(group, value):
+                    _update(cache, grup, val)
+                return
+
+            xgroup = run_xgroup(variant, vcf, passed)
+            if xgroup is False:
+                return
+            if len(xgroup) > 1 and len(value) != len(xgroup):
+                raise ValueError(
+                    "Cannot aggregate on more than one level of xgroup."
+                )
+            for xgrup, grup, val in zip(xgroup, group, value):
+                _update(cache.setdefault(xgrup, {}), grup, val)
+
+        self.run = PROFILER.wrap("aggregation", self.name, run)
+
+    def _compile_windows(
+        self, run_filter, run_group, run_term, run_xgroup, layout
+    ):
+        """Compile `run` for the aggregation over windows, which adds the
+        values to the dense arrays of the contigs of the variants"""
+        cache = self.cache
+        size = cache.size
+        update_state = self._update_state
+        windows_in_x = layout == "contig"
+
+        def run(variant, vcf, passed):
+            """Run each variant"""
+            if (
+                run_filter is not None
+                and run_filter(variant, vcf, passed) is False
+            ):
+                return
+
+            group = run_group(variant, vcf, passed)
+            if group is False:
+                return
+
+            value = run_term(variant, vcf, passed)
+            if value is False:
+                return
+
+            if run_xgroup is not None:
+                xgroup = run_xgroup(variant, vcf, passed)
+                if xgroup is False:
+                    return
+                if windows_in_x:
+                    group = xgroup
+
+            # the windows are of the site, one value is aggregated
+            code = group[0] // size
+            array = cache.array(variant.CHROM, code)
+            array[code] = update_state(array[code], value[0])
+
+        return run
+
+    def run_block(self, block, vcf, passed):
+        """Run a block of variants with the batch versions of the macros"""
+        with PROFILER.timer("aggregation", self.name):
+            self._run_block(block, vcf, passed)
+
+    def _run_block(self, block, vcf, passed):
+        """Run a block of variants, see `run_block`"""
+        mask = numpy.ones(len(block), dtype=bool)
+        if self.filter:
+            mask &= self.filter.run_block(block, vcf, passed)[1]
+
         if not self.group:
+            if not mask.any():
+                return
             raise RuntimeError(
                 "No group specified, don't know how to aggregate."
             )
 
-        group = self.group.run(variant, vcf, passed)
-        if group is False:
+        group, group_mask = self.group.run_block(block, vcf, passed)
+        value, value_mask = self.term.run_block(block, vcf, passed)
+        mask &= group_mask & value_mask
+        if not mask.any():
             return
 
-        value = self.term.run(variant, vcf, passed)
-        if value is False:
-            return
-
-        if len(group) > 1 and len(value) != len(group):
+        if group.shape[1] > 1 and value.shape[1] != group.shape[1]:
             raise ValueError(
                 "Cannot aggregate on more than one group, "
                 + "make sure you specified sample for sample data."
             )
-        # group = group[0]
 
-        xgroup = None
         if self.xgroup:
-            xgroup = self.xgroup.run(variant, vcf, passed)
-            if xgroup is False:
+            xgroup, xgroup_mask = self.xgroup.run_block(block, vcf, passed)
+            mask &= xgroup_mask
+            if not mask.any():
                 return
-            if len(xgroup) > 1 and len(value) != len(xgroup):
+            if isinstance(self.cache, WindowStates):
+                windows = xgroup if self.window_layout() == "contig" else group
+                self._update_windows(
+                    block.CHROM[mask], windows[mask], value[mask]
+                )
+                return
+            if xgroup.shape[1] > 1 and value.shape[1] != xgroup.shape[1]:
                 raise ValueError(
                     "Cannot aggregate on more than one level of xgroup."
                 )
-            # xgroup = xgroup[0]
+            for xgrups, grups, vals in zip(
+                xgroup[mask].tolist(),
+                group[mask].tolist(),
+                value[mask].tolist(),
+            ):
+                for xgrup, grup, val in zip(xgrups, grups, vals):
+                    self._update(self.cache.setdefault(xgrup, {}), grup, val)
+        elif isinstance(self.cache, WindowStates):
+            self._update_windows(block.CHROM[mask], group[mask], value[mask])
+        else:
+            for grups, vals in zip(group[mask].tolist(), value[mask].tolist()):
+                for grup, val in zip(grups, vals):
+                    self._update(self.cache, grup, val)
 
-        if xgroup is not None:
-            for xgrup, grup, val in zip(xgroup, group, value):
-                self.cache.setdefault(
-                    xgrup, {}
-                ).setdefault(
-                    grup, []
-                ).append(val)
+    def _update_windows(self, contigs, windows, values):
+        """Add the values of a block to the arrays of the windows"""
+        cache = self.cache
+        update_state = self._update_state
+        codes = windows[:, 0] // cache.size
+        for contig, code, val in zip(
+            contigs.tolist(), codes.tolist(), values[:, 0].tolist()
+        ):
+            array = cache.array(contig, code)
+            array[code] = update_state(array[code], val)
+
+    def _merge_state(self, state, other):
+        """Merge the state (or values) of a group from other variants"""
+        if self.aggr.get("merge") is None:
+            state.extend(other)
+            return state
+        return self.aggr["merge"](state, other)
+
+    def _merge(self, cache, grup, val):
+        """Merge the state (or values) of a group into the cache"""
+        if grup not in cache:
+            cache[grup] = val
         else:
-            for grup, val in zip(group, value):
-                self.cache.setdefault(grup, []).append(val)
+            cache[grup] = self._merge_state(cache[grup], val)
+
+    def _finalize(self, val):
+        """Calculate the aggregation from the state (or values) of a group"""
+        if self.aggr.get("update") is None:
+            return self.aggr["func"](val, **self.params)
+        if self.aggr["finalize"] is None:
+            return val
+        finalize = self.aggr["finalize"]
+        return finalize(val, **self._params_of(finalize))
+
+    def merge(self, cache):
+        """Merge the cache from a partial run over other variants.
+
+        The partial runs have to be merged in the order of the variants,
+        so that the groups keep the order they are first seen.
+        """
+        if isinstance(cache, WindowStates):
+            self.cache.merge(cache, self._merge_state)
+            return
+        for key, value in cache.items():
+            if isinstance(value, dict):
+                xcache = self.cache.setdefault(key, {})
+                for grup, val in value.items():
+                    self._merge(xcache, grup, val)
+            else:
+                self._merge(self.cache, key, value)
 
     def dump(self):
         """Dump and calculate the aggregations"""
+        if isinstance(self.cache, WindowStates):
+            with PROFILER.timer("aggregation", f"{self.name}.dump"):
+                ret = self._dump_windows()
+            self.cache.clear()
+            return ret
+
         ret = OrderedDict()
-        for key, value in self.cache.items():
-            if isinstance(value, dict):
-                ret[key] = [
-                    (self.aggr["func"](val), grup)
-                    for grup, val in value.items()
-                ]
-            else:
-                ret[key] = self.aggr["func"](value)
+        with PROFILER.timer("aggregation", f"{self.name}.dump"):
+            for key, value in self.cache.items():
+                if isinstance(value, dict):
+                    ret[key] = [
+                        (self._finalize(val), grup)
+                        for grup, val in value.items()
+                    ]
+                else:
+                    ret[key] = self._finalize(value)
         self.cache.clear()
         return ret
 
+    def _dump_windows(self):
+        """Dump and calculate the aggregations over the windows, the same
+        way as `dump`, with the windows in the order of the positions"""
+        layout = self.window_layout()
+        ret = OrderedDict()
+        if layout == "window_x":
+            for contig, start, state in self.cache.items():
+                ret.setdefault(contig, []).append(
+                    (self._finalize(state), start)
+                )
+            return ret
+
+        by_window = {}
+        for contig, start, state in self.cache.items():
+            if layout == "window":
+                # the same windows of the contigs are aggregated together
+                self._merge(by_window, start, state)
+            else:
+                by_window.setdefault(start, []).append(
+                    (self._finalize(state), contig)
+                )
+        for start in sorted(by_window):
+            value = by_window[start]
+            ret[start] = value if layout == "contig" else self._finalize(value)
+        return ret
+
+
+# the parsed formulas, as the templates to copy, see `parse_formula`
+_PARSED = {}
+
+
+def _macros(parsed):
+    """The macros used by the terms and the aggregations of the parsed
+    formula"""
+    for part in parsed:
+        if isinstance(part, Aggr):
+            yield part.aggr
+            for term in (part.term, part.filter, part.group):
+                if term:
+                    yield term.term
+        else:
+            yield part.term
+
+
+def parse_formula(formula):
+    """Parse the formula into Y and X, with the samples of the terms not set.
+
+    The parsed formulas are kept as templates, so that a formula is parsed
+    only once in a process (i.e. for multiple VCF files or chunks), unless
+    any of its macros is replaced in `MACROS`. A copy of the template is
+    returned, whose samples are to be set and compiled.
+    """
+    parsed = _PARSED.get(formula)
+    registered = {id(macro): macro for macro in MACROS.values()}
+    if parsed is None or any(
+        id(macro) not in registered for macro in _macros(parsed)
+    ):
+        parsed = _PARSED[formula] = get_parser().parse(formula)
+    # the macros are shared, not copied
+    return deepcopy(parsed, registered)
+
 
 class Formula:
     """Handling the formulas"""
 
-    def __init__(self, formula, samples, passed, title):
+    def __init__(self, formula, samples, passed, title, lengths=None):
         logger.info(
             "[r]%s[/r]: Parsing formulas ...",
             title,
             extra={"markup": True},
         )
-        self.Y, self.X = PARSER.parse(formula)
+        self.Y, self.X = parse_formula(formula)
         if isinstance(self.Y, Term):
             self.Y.set_samples(samples)
         if isinstance(self.X, Term):
@@ -293,6 +1033,10 @@ class Formula:
             self.Y.term.set_samples(samples)
         if isinstance(self.X, Aggr) and isinstance(self.X.term, Term):
             self.X.term.set_samples(samples)
+        for part in (self.Y, self.X):
+            if isinstance(part, Aggr) and isinstance(part.filter, Term):
+                # no samples, but compiled again for the copy
+                part.filter.compile()
 
         if isinstance(self.Y, Aggr) and isinstance(self.X, Term):
             self.Y.setxgroup(self.X)
@@ -315,40 +1059,226 @@ class Formula:
         ):
             self.passed = False
 
-    def run(self, variant, vcf, data_append, data_extend):
-        """Run each variant"""
-        if isinstance(self.Y, Term) and isinstance(self.X, Term):
-            yvar, xvar = (
-                self.Y.run(variant, vcf, self.passed),
-                self.X.run(variant, vcf, self.passed),
+        # the lengths of the contigs size the arrays of the windows
+        for part in (self.Y, self.X):
+            if isinstance(part, Aggr):
+                part.lengths = lengths or {}
+
+        # whether all the macros have batch versions
+        self.batch = not (
+            isinstance(self.Y, Term) and isinstance(self.X, Aggr)
+        ) and all("batch" in term.term for term in self.terms())
+        self.compile()
+
+    def terms(self):
+        """Get all the terms used in the formula"""
+        for part in (self.Y, self.X):
+            if isinstance(part, Aggr):
+                for term in (part.term, part.filter, part.group, part.xgroup):
+                    if term:
+                        yield term
+            else:
+                yield part
+
+    def levels(self):
+        """Get the levels of the data columns (the values of Y, the values
+        of X, and the groups if any) for the terms whose macros return
+        the codes of the values, None for the other columns"""
+        if isinstance(self.Y, Term):
+            return [self.Y.levels, self.X.levels]
+        group = self.Y.group.levels if self.Y.group else None
+        if isinstance(self.X, Aggr):
+            return [None, None, group]
+        if self.Y.xgroup:
+            return [None, self.X.levels, group]
+        # grouped by X
+        return [None, self.X.levels]
+
+    def remap_samples(self, indices):
+        """Remap the sample indices of the terms, for a reader that is
+        opened with only the samples at `indices` (in the order of the
+        samples in the vcf file), and compile the formula again."""
+        position = {sidx: i for i, sidx in enumerate(indices)}
+        # terms can be shared by the aggregations
+        terms = {id(term): term for term in self.terms()}
+        for term in terms.values():
+            if term.samples:
+                term.samples = [position[sidx] for sidx in term.samples]
+                term.compile()
+        self.compile()
+
+    def contigs(self):
+        """Get the contigs that the formula is restricted to by the subsets
+        of the CONTIG (CHROM) terms, or None if it is not restricted.
+
+        Variants on the other contigs never make it into the data, so they
+        don't need to be read or run at all.
+        """
+
+        def restricted(terms):
+            # a variant has to pass all the terms
+            contigs = None
+            for term in terms:
+                if term.term is not MACROS.get("CONTIG") or not term.subsets:
+                    continue
+                subsets = frozenset(term.subsets)
+                contigs = subsets if contigs is None else contigs & subsets
+            return contigs
+
+        if isinstance(self.Y, Aggr) and isinstance(self.X, Aggr):
+            # a variant is used if either of the aggregations uses it
+            ycontigs = restricted(
+                term
+                for term in (self.Y.term, self.Y.filter, self.Y.group)
+                if term
             )
-            if yvar is False or xvar is False:
+            xcontigs = restricted(
+                term
+                for term in (self.X.term, self.X.filter, self.X.group)
+                if term
+            )
+            if ycontigs is None or xcontigs is None:
+                return None
+            return ycontigs | xcontigs
+        return restricted(self.terms())
+
+    def compile(self):
+        """Compile `run` into the path of the formula (TERM ~ TERM,
+        AGGREGATION ~ TERM or AGGREGATION ~ AGGREGATION), so that running
+        a variant is a direct call to the compiled terms"""
+        passed = self.passed
+        if isinstance(self.Y, Term) and isinstance(self.X, Term):
+            run_y = self.Y.run
+            run_x = self.X.run
+
+            def run(variant, vcf, data_append, data_extend):
+                """Run each variant"""
+                yvar = run_y(variant, vcf, passed)
+                xvar = run_x(variant, vcf, passed)
+                if yvar is False or xvar is False:
+                    return
+                lenx = len(xvar)
+                leny = len(yvar)
+                if leny != lenx and leny != 1 and lenx != 1:
+                    raise RuntimeError(
+                        "Unmatched length of MACRO results: "
+                        "Y({}), X({})".format(leny, lenx)
+                    )
+                if lenx == 1:
+                    xvar = xvar * leny
+                if leny == 1:
+                    yvar = yvar * lenx
+
+                data_extend(zip(yvar, xvar))
+
+        elif isinstance(self.Y, Aggr) and isinstance(self.X, Aggr):
+            self.Y.compile()
+            self.X.compile()
+            run_y = self.Y.run
+            run_x = self.X.run
+
+            def run(variant, vcf, data_append, data_extend):
+                """Run each variant"""
+                run_y(variant, vcf, passed)
+                run_x(variant, vcf, passed)
+
+        elif isinstance(self.Y, Aggr):
+            self.Y.compile()
+            run_y = self.Y.run
+
+            def run(variant, vcf, data_append, data_extend):
+                """Run each variant"""
+                run_y(variant, vcf, passed)
+
+        else:
+
+            def run(variant, vcf, data_append, data_extend):
+                """Run each variant"""
+                raise TypeError(
+                    "Cannot do 'TERM ~ AGGREGATION'. "
+                    "If you want to do that, transpose it to "
+                    "'AGGREGATION ~ TERM'"
+                )
+
+        contigs = self.contigs()
+        if contigs is not None:
+            run_all = run
+
+            def run(variant, vcf, data_append, data_extend):
+                """Run each variant on the contigs of the formula"""
+                if variant.CHROM in contigs:
+                    run_all(variant, vcf, data_append, data_extend)
+
+        self.run = run
+
+    def run_block(
+        self, block, vcf, data_append, data_extend, data_extend_columns=None
+    ):
+        """Run a block of variants.
+
+        The batch versions of the macros are used if all the macros have
+        them, otherwise the variants are run one by one.
+        If `data_extend_columns` is given, the data of TERM ~ TERM is saved
+        by columns with it.
+        """
+        if not self.batch:
+            for variant in block.variants:
+                self.run(variant, vcf, data_append, data_extend)
+            return
+
+        contigs = self.contigs()
+        if contigs is not None and not numpy.isin(
+            block.CHROM, list(contigs)
+        ).any():
+            return
+
+        if isinstance(self.Y, Term) and isinstance(self.X, Term):
+            yvar, ymask = self.Y.run_block(block, vcf, self.passed)
+            xvar, xmask = self.X.run_block(block, vcf, self.passed)
+            mask = ymask & xmask
+            if not mask.any():
                 return
-            lenx = len(xvar)
-            leny = len(yvar)
+            lenx = xvar.shape[1]
+            leny = yvar.shape[1]
             if leny != lenx and leny != 1 and lenx != 1:
                 raise RuntimeError(
                     "Unmatched length of MACRO results: Y({}), X({})".format(
                         leny, lenx
                     )
                 )
-            if lenx == 1:
-                xvar = xvar * leny
-            if leny == 1:
-                yvar = yvar * lenx
-
-            data_extend(((yvar[i], rvar) for i, rvar in enumerate(xvar)))
-        elif isinstance(self.Y, Aggr) and isinstance(self.X, Aggr):
-            self.Y.run(variant, vcf, self.passed)
-            self.X.run(variant, vcf, self.passed)
-        elif isinstance(self.Y, Aggr) and isinstance(self.X, Term):
-            self.Y.run(variant, vcf, self.passed)
+            yvar, xvar = numpy.broadcast_arrays(yvar[mask], xvar[mask])
+            if data_extend_columns is not None:
+                data_extend_columns(yvar.ravel(), xvar.ravel())
+            else:
+                data_extend(
+                    zip(yvar.ravel().tolist(), xvar.ravel().tolist())
+                )
         else:
-            raise TypeError(
-                "Cannot do 'TERM ~ AGGREGATION'. "
-                "If you want to do that, transpose it to "
-                "'AGGREGATION ~ TERM'"
-            )
+            self.Y.run_block(block, vcf, self.passed)
+            if isinstance(self.X, Aggr):
+                self.X.run_block(block, vcf, self.passed)
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the states of the
+        aggregations"""
+        return sum(
+            part.nbytes for part in (self.Y, self.X) if isinstance(part, Aggr)
+        )
+
+    def state(self):
+        """Get the cached aggregation data as the partial state"""
+        return {
+            "Y": self.Y.cache if isinstance(self.Y, Aggr) else None,
+            "X": self.X.cache if isinstance(self.X, Aggr) else None,
+        }
+
+    def merge(self, state):
+        """Merge the partial state from a run over other variants"""
+        if state["Y"] is not None:
+            self.Y.merge(state["Y"])
+        if state["X"] is not None:
+            self.X.merge(state["X"])
 
     def done(self, data_append, data_extend):
         """Done iteration, start summarizing"""
@@ -2,36 +2,49 @@
 from os import path
 from types import ModuleType
 
-import pandas
-import plotnine as p9
-import plotnine_prism as p9p
-from datar.base import (
-    as_character,
-    cumsum,
-    factor,
-    levels,
-    make_unique,
-    paste0,
-    rev,
-    unique,
-)
 from diot import Diot
 from slugify import slugify
 
+from .columns import Bins, Columns, Reservoir, Summaries
 from .formula import Aggr, Formula, Term
 from .utils import capture_c_msg, capture_python_msg, logger
 
-GGS_ENV = {
-    **{
-        attr: getattr(p9, attr) for attr in dir(p9) if not attr.startswith("_")
-    },
-    **{
-        attr: getattr(p9p, attr)
-        for attr in dir(p9p)
-        if not attr.startswith("_")
-        and not isinstance(getattr(p9p, attr), ModuleType)
-    },
-}
+_GGS_ENV = None
+
+
+def get_ggs_env():
+    """Get the environment to evaluate the `ggs` expressions in, with
+    everything from plotnine and plotnine_prism.
+
+    The plotting libraries take a while to import, so they are imported
+    when the first figure is plotted, not when vcfstats is imported.
+    """
+    global _GGS_ENV
+    if _GGS_ENV is None:
+        import plotnine as p9
+        import plotnine_prism as p9p
+
+        _GGS_ENV = {
+            **{
+                attr: getattr(p9, attr)
+                for attr in dir(p9)
+                if not attr.startswith("_")
+            },
+            **{
+                attr: getattr(p9p, attr)
+                for attr in dir(p9p)
+                if not attr.startswith("_")
+                and not isinstance(getattr(p9p, attr), ModuleType)
+            },
+        }
+    return _GGS_ENV
+
+
+def __getattr__(name):
+    # GGS_ENV is built lazily, see get_ggs_env()
+    if name == "GGS_ENV":
+        return get_ggs_env()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_plot_type(formula, figtype):
@@ -44,16 +57,15 @@ def get_plot_type(formula, figtype):
             "using plots other than scatter"
         )
     if isinstance(formula.Y, Aggr) and isinstance(formula.X, Term):
-        if figtype in ("", None, "col", "bar", "pie"):
+        if figtype in ("", None, "col", "bar", "pie", "line"):
             figtype = "col" if figtype == "bar" else figtype
-            return (
-                (figtype or "pie")
-                if formula.X.name == "ONE"
-                else (figtype or "col")
-            )
+            if formula.X.name == "ONE":
+                return figtype or "pie"
+            # windows are plotted along the positions
+            return figtype or ("col" if formula.X.window is None else "line")
         raise TypeError(
             "Don't know how to plot AGGREGATION ~ CATEGORICAL "
-            "using plots other than col/pie"
+            "using plots other than col/pie/line"
         )
     # all are terms, 'cuz we cannot have Term ~ Aggr
     # if isinstance(formula.Y, Term) and isinstance(formula.X, Term):
@@ -131,6 +143,11 @@ class Instance:
         passed,
         savedata=False,
         figfmt="png",
+        bins=0,
+        binrange=None,
+        max_points=0,
+        sketch=0,
+        lengths=None,
     ):
 
         logger.info(
@@ -139,20 +156,60 @@ class Instance:
             extra={"markup": True},
         )
         self.title = title
-        self.formula = Formula(formula, samples, passed, title)
+        self.formula = Formula(formula, samples, passed, title, lengths)
         self.outprefix = path.join(outdir, slugify(title))
         self.devpars = devpars
         self.ggs = ggs or ""
-        self.data = []
         self.savedata = savedata
         self.datacols = [self.formula.Y.name, self.formula.X.name]
+        datatypes = [
+            "continuous" if isinstance(part, Aggr) else part.term["type"]
+            for part in (self.formula.Y, self.formula.X)
+        ]
         if isinstance(self.formula.Y, Aggr) and (
             (isinstance(self.formula.X, Term) and self.formula.Y.xgroup)
             or isinstance(self.formula.X, Aggr)
         ):
             self.datacols.append("Group")
+            datatypes.append("categorical")
         self.figtype = get_plot_type(self.formula, figtype)
         self.figfmt = figfmt
+        # the column to split the figure into facets by, i.e. FILE for
+        # the data combined from multiple VCF files
+        self.facet = None
+        # only distribution plots can be binned
+        self.bins = (
+            bins
+            if self.figtype in ("histogram", "density", "freqpoly")
+            and isinstance(self.formula.Y, Term)
+            else 0
+        )
+        # only scatter plots are downsampled
+        self.max_points = max_points if self.figtype == "scatter" else 0
+        # only boxplots are summarized
+        self.sketch = (
+            sketch
+            if self.figtype == "boxplot" and isinstance(self.formula.Y, Term)
+            else 0
+        )
+        # the categorical values are stored as the codes of the levels
+        # for the macros with declared levels, until the frame is built
+        levels = self.formula.levels()
+        if self.sketch:
+            self.data = Summaries(self.datacols, self.sketch, levels)
+        elif self.bins:
+            self.data = Bins(
+                self.datacols,
+                self.bins,
+                self.get_binrange(binrange),
+                levels,
+            )
+        elif self.max_points:
+            self.data = Reservoir(
+                self.datacols, datatypes, self.max_points, levels=levels
+            )
+        else:
+            self.data = Columns(self.datacols, datatypes, levels)
         logger.info(
             "[r]%s[/r]: plot type: %s",
             self.title,
@@ -175,11 +232,48 @@ class Instance:
     def __del__(self):
         del self.data
 
+    def get_binrange(self, binrange):
+        """Get the range of the bins, from the given range, the subsets
+        of the term, or the bounds declared by the macro.
+        None to decide it from the values."""
+        if binrange:
+            return binrange
+        subsets = self.formula.Y.subsets
+        if subsets and subsets[0] is not None and subsets[1] is not None:
+            return subsets
+        return self.formula.Y.term.get("bounds")
+
     def iterate(self, variant, vcf):
         """Iterate over each variant"""
         # Y
         self.formula.run(variant, vcf, self.data.append, self.data.extend)
 
+    def iterate_block(self, block, vcf):
+        """Iterate over a block of variants"""
+        self.formula.run_block(
+            block,
+            vcf,
+            self.data.append,
+            self.data.extend,
+            self.data.extend_columns,
+        )
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the plotting data and the
+        states of the aggregations"""
+        return self.data.nbytes + self.formula.nbytes
+
+    def state(self):
+        """Get the partial state, which can be merged into another instance
+        with the same formula"""
+        return {"data": self.data, "formula": self.formula.state()}
+
+    def merge(self, state):
+        """Merge the partial state from a run over other variants"""
+        self.data.merge(state["data"])
+        self.formula.merge(state["formula"])
+
     def summarize(self):
         """Calculate the aggregations"""
         logger.info(
@@ -191,13 +285,42 @@ class Instance:
 
     def plot(self):
         """Plot the figures using R"""
-        df = pandas.DataFrame(
-            self.data,
-            columns=self.datacols,
+        import pandas
+        import plotnine as p9
+        from pandas.api.types import is_numeric_dtype
+        from datar.base import (
+            as_character,
+            cumsum,
+            factor,
+            levels,
+            make_unique,
+            paste0,
+            rev,
+            unique,
         )
+
+        df = self.data.to_frame()
         with capture_c_msg("datar", prefix=f"[r]{self.title}[/r]: "):
             df.columns = make_unique(df.columns.tolist())
 
+        comments = []
+        if self.max_points:
+            for group, (kept, seen) in self.data.rates().items():
+                comments.append(
+                    "# sampled {} of {} points ({:.4g}%){}".format(
+                        kept,
+                        seen,
+                        100.0 * kept / seen if seen else 100.0,
+                        "" if group is None else f" in group {group}",
+                    )
+                )
+            logger.info(
+                "[r]%s[/r]: %s",
+                self.title,
+                comments[0][2:],
+                extra={"markup": True},
+            )
+
         if self.savedata:
             datafile = self.outprefix + ".csv"
             logger.info(
@@ -206,16 +329,30 @@ class Instance:
                 datafile,
                 extra={"markup": True},
             )
-            df.to_csv(datafile, index=False)
+            with open(datafile, "w", newline="") as fdata:
+                for comment in comments:
+                    fdata.write(comment + "\n")
+                df.to_csv(fdata, index=False)
 
         if df.shape[0] == 0:
             logger.warning("No data points to plot")
             return
 
+        # the number of columns, without the facet column
+        ncols = df.shape[1] - (self.facet is not None)
+
+        if self.bins:
+            self.plot_bins(df)
+            return
+
+        if self.sketch:
+            self.plot_summaries(df)
+            return
+
         aes_for_geom_fill = None
         aes_for_geom_color = None
         theme_elems = p9.theme(axis_text_x=p9.element_text(angle=60, hjust=2))
-        if df.shape[1] > 2:
+        if ncols > 2:
             aes_for_geom_fill = p9.aes(fill=df.columns[2])
             aes_for_geom_color = p9.aes(color=df.columns[2])
         plt = p9.ggplot(df, p9.aes(y=df.columns[0], x=df.columns[1]))
@@ -223,7 +360,29 @@ class Instance:
             plt = plt + p9.geom_point(aes_for_geom_color)
             theme_elems = None
         elif self.figtype == "line":
-            pass
+            xcol = df.iloc[:, 1]
+            if isinstance(
+                xcol.dtype, pandas.CategoricalDtype
+            ) and is_numeric_dtype(xcol.cat.categories):
+                # i.e. the starts of the windows, along the positions
+                df[xcol.name] = xcol.astype(xcol.cat.categories.dtype)
+                plt = p9.ggplot(df, p9.aes(y=df.columns[0], x=xcol.name))
+            # points for the lines of a single window
+            if ncols > 2:
+                plt = (
+                    plt
+                    + p9.geom_line(
+                        p9.aes(color=df.columns[2], group=df.columns[2])
+                    )
+                    + p9.geom_point(aes_for_geom_color, size=0.5)
+                )
+                theme_elems = None
+            else:
+                plt = (
+                    plt
+                    + p9.geom_line(p9.aes(group=1))
+                    + p9.geom_point(size=0.5)
+                )
         elif self.figtype == "bar":
             plt = plt + p9.geom_bar(p9.aes(fill=df.columns[0]))
         elif self.figtype == "col":
@@ -234,7 +393,7 @@ class Instance:
                 "plotting bar chart instead."
             )
             col0 = df.iloc[:, 0]
-            if df.shape[1] > 2:
+            if ncols > 2:
                 plt = plt + p9.geom_bar(
                     p9.aes(x=df.columns[2], y=col0.name, fill=df.columns[2]),
                     stat="identity",
@@ -284,7 +443,67 @@ class Instance:
         plt = plt + p9.ggtitle(self.title)
         self.save_plot(plt, theme_elems)
 
+    def plot_bins(self, df):
+        """Plot the distribution from the bins"""
+        import plotnine as p9
+
+        value, group, count = df.columns[:3]
+        grouped = group != "ONE"
+        if self.figtype == "density":
+            # normalize the counts of each group into densities
+            by = [group] if self.facet is None else [group, self.facet]
+            totals = df.groupby(by, sort=False)[count].transform("sum")
+            df[count] = df[count] / (totals * self.data.width)
+
+        plt = p9.ggplot(df, p9.aes(x=value, y=count))
+        if self.figtype == "histogram":
+            geom = p9.geom_col(
+                p9.aes(fill=group) if grouped else None,
+                width=self.data.width,
+                alpha=0.6,
+            )
+        elif self.figtype == "density":
+            geom = p9.geom_area(
+                p9.aes(fill=group) if grouped else None,
+                position="identity",
+                alpha=0.6,
+            )
+        else:  # freqpoly
+            geom = p9.geom_line(p9.aes(color=group) if grouped else None)
+        plt = plt + geom + p9.ggtitle(self.title)
+        theme_elems = None if grouped else p9.theme(legend_position="none")
+        self.save_plot(plt, theme_elems)
+
+    def plot_summaries(self, df):
+        """Plot the boxes from the five-number summaries of the groups"""
+        import plotnine as p9
+
+        group, ymin, lower, middle, upper, ymax = df.columns[:6]
+        plt = (
+            p9.ggplot(df)
+            + p9.geom_boxplot(
+                p9.aes(
+                    x=group,
+                    ymin=ymin,
+                    lower=lower,
+                    middle=middle,
+                    upper=upper,
+                    ymax=ymax,
+                ),
+                stat="identity",
+            )
+            + p9.labs(y=self.datacols[0])
+            + p9.ggtitle(self.title)
+        )
+        theme_elems = p9.theme(axis_text_x=p9.element_text(angle=60, hjust=2))
+        self.save_plot(plt, theme_elems)
+
     def save_plot(self, plt, theme_elems):
+        """Add the ggs expressions and the theme to the plot, and save it"""
+        import plotnine as p9
+        import plotnine_prism as p9p
+
+        ggs_env = get_ggs_env()
         has_theme = False
         theme_frags = []
         for i, gg in enumerate(self.ggs.split(";")):
@@ -295,11 +514,11 @@ class Instance:
                 f"__gg__ = {gg}", f"<vcfstats-ggs-{i}>", mode="exec"
             )
             try:
-                exec(ggcode, GGS_ENV)
+                exec(ggcode, ggs_env)
             except Exception as exc:
                 raise ValueError(f"Invalid ggs expression: {gg}") from exc
 
-            ggexpr = GGS_ENV.pop("__gg__")
+            ggexpr = ggs_env.pop("__gg__")
             # avoid user theme fragments being overriden by theme_prism
             if gg.startswith("theme("):
                 theme_frags.append(ggexpr)
@@ -308,6 +527,8 @@ class Instance:
                 if gg.startswith("theme_"):
                     has_theme = True
 
+        if self.facet is not None:
+            plt = plt + p9.facet_wrap(self.facet)
         if not has_theme:
             plt = plt + p9p.theme_prism(base_size=12, base_family="monospace")
         plt = plt + theme_elems
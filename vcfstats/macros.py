@@ -1,8 +1,13 @@
 """Builtin marcros for vcfstats"""
+import math
+import operator
 import warnings
 from inspect import signature
 from functools import partial
 
+import numpy
+
+from .sketch import MAX_P, MIN_CAPACITY, MIN_P, HyperLogLog, KLLSketch
 from .utils import MACROS
 
 
@@ -11,45 +16,253 @@ def _nargs(func):
     return len(signature(func).parameters)
 
 
-def categorical(func=None, alias=None, _name=None):
-    """Categorical decorator"""
-    if alias:
-        return partial(categorical, _name=alias)
+# Which samples the value of a macro depends on:
+# - "site": none, the value is from the site only (i.e. QUAL)
+# - "sample": a value for each sample, from that sample only (i.e. GQs),
+#   so that only the samples selected by `{...}` are needed
+# - None: unknown or all the samples (i.e. AAF), the default
+SCOPES = ("site", "sample", None)
+
+
+def _check_scope(scope):
+    """Check if the scope of a macro is valid"""
+    if scope not in SCOPES:
+        raise ValueError(
+            f"Expect scope to be one of {SCOPES}, got {scope!r}."
+        )
+
+
+def _check_fields(fields):
+    """Check the fields that a macro reads, other than the fixed fields
+    (CHROM, POS, ID, REF, ALT, QUAL and FILTER), which are always read:
+
+    - "INFO/KEY": the INFO field KEY
+    - "FORMAT/KEY": the FORMAT field KEY of the samples
+    - "GT": the genotypes of the samples
+
+    `()` for a macro that reads only the fixed fields, and None (default)
+    for a macro that may read anything, so all fields are decoded.
+    Returns the fields as a tuple, or None.
+    """
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = (fields,)
+    for field in fields:
+        if field != "GT" and not field.startswith(("INFO/", "FORMAT/")):
+            raise ValueError(
+                "Expect fields to be 'GT', 'INFO/KEY' or 'FORMAT/KEY', "
+                f"got {field!r}."
+            )
+    return tuple(fields)
+
+
+def _check_levels(levels):
+    """Check the levels of a categorical macro that returns the codes of
+    the values. The codes are kept as they are while scanning (subset
+    checks, grouping and the plotting data), and only turned into the
+    levels when the data frame is built for plotting.
+
+    Returns the levels as a tuple, or None.
+    """
+    if levels is None:
+        return None
+    if isinstance(levels, str):
+        levels = (levels,)
+    levels = tuple(levels)
+    if not levels or len(set(levels)) != len(levels):
+        raise ValueError(
+            f"Expect levels to be non-empty and unique, got {levels!r}."
+        )
+    return levels
+
+
+def _register_batch(func):
+    """Register the batch version of a macro with the same name"""
+    funcname = func.__name__
+    if funcname not in MACROS:
+        raise ValueError(
+            f"Macro {funcname!r} has to be registered before "
+            "its batch version."
+        )
+    MACROS[funcname]["batch"] = func
+    MACROS[funcname]["batch_nargs"] = _nargs(func)
+    return MACROS[funcname]["func"]
+
+
+def categorical(
+    func=None,
+    alias=None,
+    _name=None,
+    batch=False,
+    scope=None,
+    fields=None,
+    window=None,
+    levels=None,
+):
+    """Categorical decorator
+
+    With `batch=True`, the function is registered as the batch version of
+    the macro with the same name, see `vcfstats.block.Block`.
+    `scope` declares which samples the macro depends on, see `SCOPES`.
+    `fields` declares the fields the macro reads, see `_check_fields`.
+    `window` declares that the values are 0-based positions, which are
+    bucketed into fixed-size windows by the terms, with the size given as
+    the subset (i.e. `WINDOW[1000000]`), or `window` by default.
+    `levels` declares the table of the values, then the macro (and its
+    batch version) returns the integer codes of the values (indices into
+    `levels`) instead of the values, see `_check_levels`.
+    """
+    if func is None:
+        return partial(
+            categorical,
+            _name=alias,
+            batch=batch,
+            scope=scope,
+            fields=fields,
+            window=window,
+            levels=levels,
+        )
+    if batch:
+        return _register_batch(func)
+    _check_scope(scope)
+    fields = _check_fields(fields)
+    if window is not None and (not isinstance(window, int) or window < 1):
+        raise ValueError(
+            f"Expect window to be a positive integer, got {window!r}."
+        )
+    levels = _check_levels(levels)
     funcname = func.__name__
     if funcname not in MACROS:
         MACROS[funcname] = {}
         MACROS[funcname]["func"] = MACROS[funcname].get("func", func)
         MACROS[funcname]["type"] = "categorical"
         MACROS[funcname]["nargs"] = _nargs(func)
+        MACROS[funcname]["scope"] = scope
+        MACROS[funcname]["fields"] = fields
+        if window is not None:
+            MACROS[funcname]["window"] = window
+        if levels is not None:
+            MACROS[funcname]["levels"] = levels
     if _name:
         MACROS[_name] = MACROS[funcname]
     return MACROS[funcname]["func"]
 
 
-def continuous(func=None, alias=None, _name=None):
-    """Continuous decorator"""
-    if alias:
-        return partial(continuous, _name=alias)
+def continuous(
+    func=None,
+    alias=None,
+    _name=None,
+    batch=False,
+    bounds=None,
+    scope=None,
+    fields=None,
+):
+    """Continuous decorator
+
+    With `batch=True`, the function is registered as the batch version of
+    the macro with the same name, see `vcfstats.block.Block`.
+    `bounds` declares the (lower, upper) bounds of the values, which are
+    used as the range of the bins of distribution plots with `--bins`.
+    `scope` declares which samples the macro depends on, see `SCOPES`.
+    `fields` declares the fields the macro reads, see `_check_fields`.
+    """
+    if func is None:
+        return partial(
+            continuous,
+            _name=alias,
+            batch=batch,
+            bounds=bounds,
+            scope=scope,
+            fields=fields,
+        )
+    if batch:
+        return _register_batch(func)
+    _check_scope(scope)
+    fields = _check_fields(fields)
     funcname = func.__name__
     if funcname not in MACROS:
         MACROS[funcname] = {}
         MACROS[funcname]["func"] = MACROS[funcname].get("func", func)
         MACROS[funcname]["type"] = "continuous"
         MACROS[funcname]["nargs"] = _nargs(func)
+        MACROS[funcname]["scope"] = scope
+        MACROS[funcname]["fields"] = fields
+        if bounds is not None:
+            MACROS[funcname]["bounds"] = tuple(bounds)
     if _name:
         MACROS[_name] = MACROS[funcname]
     return MACROS[funcname]["func"]
 
 
-def aggregation(func=None, alias=None, _name=None):
-    """Aggregation decorator"""
-    if alias:
-        return partial(aggregation, _name=alias)
+def aggregation(
+    func=None,
+    alias=None,
+    _name=None,
+    init=None,
+    update=None,
+    merge=None,
+    finalize=None,
+    categorical=False,
+    ranges=None,
+    integers=(),
+):
+    """Aggregation decorator
+
+    The decorated function aggregates the list of all values in a group.
+    To aggregate the values as they stream in, keeping only a state for
+    each group, provide the hooks:
+
+    - `init()`: returns the initial state of a group
+    - `update(state, value)`: returns the state with the value added
+    - `merge(state, other)`: returns the state merged with the state of
+        the same group from other variants
+    - `finalize(state)`: returns the aggregated value from the state.
+        Optional, the state itself is used by default.
+
+    Keyword arguments with defaults of the function (or of `init` and
+    `finalize` with the hooks) are the numeric parameters of the
+    aggregation in the formulas, i.e. `q` of `QUANTILE(QUAL, q=0.9)`.
+    `ranges` declares the {name: (lower, upper)} ranges (inclusive, None
+    for no bound) of the parameters, and `integers` the names of the
+    parameters that have to be integers, which are checked when the
+    formulas are parsed, so that a bad value fails before the scan.
+
+    Aggregations work on continuous terms only, unless `categorical` is
+    True, then they work on categorical terms as well (i.e. `DISTINCT`).
+    """
+    if func is None:
+        return partial(
+            aggregation,
+            _name=alias,
+            init=init,
+            update=update,
+            merge=merge,
+            finalize=finalize,
+            categorical=categorical,
+            ranges=ranges,
+            integers=integers,
+        )
+    if (init, update, merge).count(None) not in (0, 3):
+        raise ValueError(
+            "Hooks init, update and merge have to be provided together "
+            f"for aggregation: {func.__name__}"
+        )
     funcname = func.__name__
     if funcname not in MACROS:
         MACROS[funcname] = {}
         MACROS[funcname]["func"] = MACROS[funcname].get("func", func)
         MACROS[funcname]["aggr"] = True
+        MACROS[funcname]["categorical"] = categorical
+        MACROS[funcname]["ranges"] = {
+            name: tuple(bounds) for name, bounds in (ranges or {}).items()
+        }
+        MACROS[funcname]["integers"] = tuple(integers)
+        if update is not None:
+            MACROS[funcname]["init"] = init
+            MACROS[funcname]["update"] = update
+            MACROS[funcname]["merge"] = merge
+            MACROS[funcname]["finalize"] = finalize
     if _name:
         MACROS[_name] = MACROS[funcname]
     return MACROS[funcname]["func"]
@@ -60,13 +273,37 @@ cont = continuous
 aggr = aggregation
 
 
-@categorical
+# the types of the variants that cyvcf2 reports
+VARTYPES = ("snp", "indel", "mnp", "sv", "unknown")
+_VARTYPE_CODES = {vartype: code for code, vartype in enumerate(VARTYPES)}
+
+
+def _vartype_code(vartype):
+    """Get the code of a variant type"""
+    try:
+        return _VARTYPE_CODES[vartype]
+    except KeyError:
+        raise ValueError(
+            f"Unknown variant type {vartype!r}, expect one of {VARTYPES}."
+        ) from None
+
+
+@categorical(scope="site", fields=(), levels=VARTYPES)
 def VARTYPE(variant):
-    """Variant type, one of deletion, indel, snp or sv"""
-    return variant.var_type
+    """Variant type, one of snp, indel, mnp, sv or unknown"""
+    return _vartype_code(variant.var_type)
+
+
+@categorical(batch=True)
+def VARTYPE(block):
+    """Variant type, one of snp, indel, mnp, sv or unknown"""
+    return numpy.array(
+        [_vartype_code(vartype) for vartype in block.var_type],
+        dtype=numpy.int64,
+    )
 
 
-@categorical
+@categorical(scope="site", fields=())
 def TITV(variant):
     """Tell if a variant is a transition or transversion.
     The variant has to be an snp first."""
@@ -75,66 +312,127 @@ def TITV(variant):
     return "transition" if variant.is_transition else "transversion"
 
 
-@categorical(alias="CHROM")
+@categorical(alias="CHROM", scope="site", fields=())
 def CONTIG(variant):
     """Get the config/chromosome of a variant. Alias: CHROM"""
     return variant.CHROM
 
 
-@categorical(alias="GT_TYPEs")
+@categorical(batch=True)
+def CONTIG(block):
+    """Get the config/chromosome of a variant. Alias: CHROM"""
+    return block.CHROM
+
+
+GTTYPES = ("HOM_REF", "HET", "HOM_ALT", "UNKNOWN")
+
+
+@categorical(
+    alias="GT_TYPEs", scope="sample", fields=("GT",), levels=GTTYPES
+)
 def GTTYPEs(variant):
     """Get the genotypes(HOM_REF,HET,HOM_ALT,UNKNOWN)
     of a variant for each sample"""
-    gttypes = variant.gt_types
-    return [
-        "HOM_REF"
-        if gttype == 0
-        else "HET"
-        if gttype == 1
-        else "HOM_ALT"
-        if gttype == 2
-        else "UNKNOWN"
-        for gttype in gttypes
-    ]
-
-
-@categorical
+    # the codes are small ints, which are not created for each sample
+    return numpy.clip(variant.gt_types, 0, 3).tolist()
+
+
+@categorical(batch=True)
+def GTTYPEs(block):
+    """Get the genotypes(HOM_REF,HET,HOM_ALT,UNKNOWN)
+    of a variant for each sample"""
+    return numpy.clip(block.gt_types, 0, 3)
+
+
+@categorical(scope="site", fields=())
 def FILTER(variant):
     """Get the FILTER of a variant."""
     return variant.FILTER or "PASS"
 
 
-@categorical
+@categorical(batch=True)
+def FILTER(block):
+    """Get the FILTER of a variant."""
+    filters = block.FILTER.copy()
+    filters[block.passed] = "PASS"
+    return filters
+
+
+@categorical(scope="site", fields=())
 def SUBST(variant):
     """Substitution of the variant, including all types of varinat"""
     return "{}>{}".format(variant.REF, ",".join(variant.ALT))
 
 
-@categorical
+@categorical(fields=("GT",))
 def SAMPLES(variant):
     """Get the sample indices"""
     return list(range(len(variant.genotypes)))
 
 
-@continuous
+@continuous(scope="site", fields=())
+def POS(variant):
+    """The 1-based position of the variant"""
+    return variant.POS
+
+
+@continuous(batch=True)
+def POS(block):
+    """The 1-based position of the variant"""
+    return block.POS
+
+
+@categorical(scope="site", fields=(), window=1_000_000)
+def WINDOW(variant):
+    """The fixed-size window of the position, as the 0-based start of it.
+    Use `WINDOW[size]` for the size (default: 1000000)"""
+    return variant.POS - 1
+
+
+@categorical(batch=True)
+def WINDOW(block):
+    """The fixed-size window of the position, as the 0-based start of it.
+    Use `WINDOW[size]` for the size (default: 1000000)"""
+    return block.POS - 1
+
+
+@continuous(scope="site", fields=())
 def NALT(variant):
     """Number of alternative alleles"""
     return len(variant.ALT)
 
 
-@continuous
+@continuous(batch=True)
+def NALT(block):
+    """Number of alternative alleles"""
+    return block.nalt
+
+
+@continuous(scope="sample", fields=("FORMAT/GQ",))
 def GQs(variant):
     """get the GQ for each sample as a numpy array."""
     return variant.gt_quals
 
 
-@continuous
+@continuous(batch=True)
+def GQs(block):
+    """get the GQ for each sample as a numpy array."""
+    return block.gt_quals
+
+
+@continuous(scope="site", fields=())
 def QUAL(variant):
     """Variant quality from QUAL field."""
     return variant.QUAL
 
 
-@continuous(alias="DPs")
+@continuous(batch=True)
+def QUAL(block):
+    """Variant quality from QUAL field."""
+    return block.QUAL
+
+
+@continuous(alias="DPs", scope="sample", fields=("FORMAT/DP",))
 def DEPTHs(variant):
     """Get the read-depth for each sample as a numpy array."""
     try:
@@ -149,40 +447,220 @@ def DEPTHs(variant):
         return None
 
 
-@continuous
+@continuous(bounds=(0, 1), fields=("GT",))
 def AAF(variant):
     """Alternate allele frequency across samples in this VCF."""
     return variant.aaf
 
 
-@continuous
+@continuous(batch=True)
+def AAF(block):
+    """Alternate allele frequency across samples in this VCF."""
+    return block.aaf
+
+
+@continuous(scope="sample")
 def AFs(variant):
     """get the freq of alternate reads as a numpy array."""
     return variant.gt_alt_freqs
 
 
-@continuous
+@continuous(batch=True)
+def AFs(block):
+    """get the freq of alternate reads as a numpy array."""
+    return block.gt_alt_freqs
+
+
+@continuous(scope="site", fields=())
 def _ONE(variant):
     """Return 1 for a variant, usually used in aggregation,
     or indication of a distribution plot"""
     return 1
 
 
-@aggregation
+@continuous(batch=True)
+def _ONE(block):
+    """Return 1 for a variant, usually used in aggregation,
+    or indication of a distribution plot"""
+    return numpy.ones(len(block), dtype=numpy.int64)
+
+
+def _sum_update(partials, value):
+    """Add a value to the partial sums of a group.
+
+    The partials are kept the way `math.fsum` does, so that the sum is
+    exact and does not depend on the order in which the values, or the
+    partial sums from other variants, are added.
+    """
+    if not math.isfinite(value) or not math.isfinite(partials[-1]):
+        partials[:] = [partials[-1] + value]
+        return partials
+    i = 0
+    for partial in partials:
+        if abs(value) < abs(partial):
+            value, partial = partial, value
+        high = value + partial
+        low = partial - (high - value)
+        if low:
+            partials[i] = low
+            i += 1
+        value = high
+    partials[i:] = [value]
+    return partials
+
+
+def _sum_merge(partials, other):
+    """Merge the partial sums from other variants"""
+    for value in other:
+        _sum_update(partials, value)
+    return partials
+
+
+def _sum_finalize(partials):
+    """Get the sum from the partial sums"""
+    # integers are always summed into one partial
+    return partials[0] if len(partials) == 1 else math.fsum(partials)
+
+
+def _mean_update(state, value):
+    """Add a value to the partial sums and count of a group"""
+    _sum_update(state[0], value)
+    state[1] += 1
+    return state
+
+
+def _mean_merge(state, other):
+    """Merge the partial sums and count from other variants"""
+    _sum_merge(state[0], other[0])
+    state[1] += other[1]
+    return state
+
+
+def _mean_finalize(state):
+    """Get the mean from the partial sums and count"""
+    if not state[1]:
+        return 0.0
+    return _sum_finalize(state[0]) / state[1]
+
+
+@aggregation(
+    init=int,
+    update=lambda count, _: count + 1,
+    merge=operator.add,
+)
 def COUNT(entries):
     """Count the variants in groups"""
     return len(entries)
 
 
-@aggregation
+@aggregation(
+    init=lambda: [0],
+    update=_sum_update,
+    merge=_sum_merge,
+    finalize=_sum_finalize,
+)
 def SUM(entries):
     """Sum up the values in groups"""
     return sum(entries)
 
 
-@aggregation(alias="AVG")
+@aggregation(
+    alias="AVG",
+    init=lambda: [[0], 0],
+    update=_mean_update,
+    merge=_mean_merge,
+    finalize=_mean_finalize,
+)
 def MEAN(entries):
     """Get the mean of the values"""
     if not entries:
         return 0.0
     return sum(entries) / len(entries)
+
+
+def _sketch_update(sketch, value):
+    """Add a value to the quantile sketch of a group"""
+    return sketch.update(value)
+
+
+def _sketch_merge(sketch, other):
+    """Merge the quantile sketch from other variants"""
+    return sketch.merge(other)
+
+
+def _quantile_finalize(sketch, q=0.5):
+    """Get the quantile from the sketch"""
+    if not 0 <= q <= 1:
+        raise ValueError(f"Expect q to be in [0, 1], got {q}.")
+    return sketch.quantile(q)
+
+
+def _median_finalize(sketch):
+    """Get the median from the sketch"""
+    return sketch.quantile(0.5)
+
+
+@aggregation(
+    init=KLLSketch,
+    update=_sketch_update,
+    merge=_sketch_merge,
+    finalize=_median_finalize,
+    ranges={"k": (MIN_CAPACITY, None)},
+    integers=("k",),
+)
+def MEDIAN(entries):
+    """Get the median of the values, estimated with a KLL sketch"""
+    return QUANTILE(entries, 0.5)
+
+
+@aggregation(
+    init=KLLSketch,
+    update=_sketch_update,
+    merge=_sketch_merge,
+    finalize=_quantile_finalize,
+    ranges={"q": (0, 1), "k": (MIN_CAPACITY, None)},
+    integers=("k",),
+)
+def QUANTILE(entries, q=0.5):
+    """Get the quantile (q=, 0.5 by default) of the values, estimated
+    with a KLL sketch"""
+    if not entries:
+        return math.nan
+    return numpy.quantile(entries, q, method="inverted_cdf").item()
+
+
+def _distinct_update(sketch, value):
+    """Add a value to the distinct-count sketch of a group"""
+    return sketch.update(value)
+
+
+def _distinct_merge(sketch, other):
+    """Merge the distinct-count sketch from other variants"""
+    return sketch.merge(other)
+
+
+def _distinct_finalize(sketch):
+    """Get the number of distinct values from the sketch"""
+    return sketch.count()
+
+
+@aggregation(
+    init=HyperLogLog,
+    update=_distinct_update,
+    merge=_distinct_merge,
+    finalize=_distinct_finalize,
+    categorical=True,
+    ranges={"p": (MIN_P, MAX_P), "exact": (0, None)},
+    integers=("p", "exact"),
+)
+def DISTINCT(entries):
+    """Count the distinct values in groups, estimated with a HyperLogLog
+    sketch (p=, 14 by default) for large counts"""
+    # missing values (None and NaN) are not counted
+    return len(
+        {
+            str(entry)
+            for entry in entries
+            if entry is not None and entry == entry
+        }
+    )
@@ -0,0 +1,175 @@
+"""Profiling the macros, aggregations, instances and phases of a run"""
+import json
+import resource
+import sys
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+from rich.console import Console
+from rich.table import Table
+
+# the kinds of the timers, in the order of the report
+KINDS = ("phase", "macro", "aggregation", "instance")
+
+# seconds between the records of the memory while scanning, see
+# `Profiler.sample_memory`
+MEMORY_INTERVAL = 1.0
+
+
+class Profiler:
+    """Collect the cumulative wall time and the number of calls of the
+    macros (`Term.run`), the aggregations (`Aggr.run`/`dump`), the
+    instances and the phases of a run, and the peak memory of the data
+    (the plotting data and the states of the aggregations) of each
+    instance.
+
+    Nothing is timed unless it is enabled, the functions are wrapped when
+    the formulas are compiled, so that there is no overhead per variant
+    when it is disabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}
+        self.memory = {}
+        # when the memory was last sampled
+        self.sampled = perf_counter()
+
+    def enable(self):
+        """Enable the profiler, it has to be enabled before the instances
+        are created"""
+        self.enabled = True
+
+    def reset(self):
+        """Clear the timers and the memory records"""
+        self.timers = {}
+        self.memory = {}
+        self.sampled = perf_counter()
+
+    def timer_of(self, kind, name):
+        """Get the timer, a list of [seconds, calls], of kind/name"""
+        return self.timers.setdefault((kind, name), [0.0, 0])
+
+    def wrap(self, kind, name, func):
+        """Wrap a function to be timed as kind/name,
+        the function itself is returned if the profiler is disabled"""
+        if not self.enabled:
+            return func
+        timer = self.timer_of(kind, name)
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer[0] += perf_counter() - start
+                timer[1] += 1
+
+        return timed
+
+    def timer(self, kind, name):
+        """A context manager timing the code in it as kind/name"""
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(self.timer_of(kind, name))
+
+    @staticmethod
+    @contextmanager
+    def _timer(timer):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            timer[0] += perf_counter() - start
+            timer[1] += 1
+
+    def track_memory(self, ones):
+        """Record the memory used by the data of the instances (see
+        `Instance.nbytes`), keeping the peak of each instance"""
+        for instance in ones:
+            nbytes = instance.nbytes
+            if nbytes > self.memory.get(instance.title, 0):
+                self.memory[instance.title] = nbytes
+
+    def sample_memory(self, ones):
+        """Record the memory like `track_memory`, but at most once every
+        `MEMORY_INTERVAL` seconds, as it walks all the states of the
+        aggregations. Called while scanning, with `track_memory` called
+        at the end of the scan, as the data mostly grows."""
+        now = perf_counter()
+        if now - self.sampled >= MEMORY_INTERVAL:
+            self.sampled = now
+            self.track_memory(ones)
+
+    def stats(self):
+        """Get the timers and the memory records,
+        which can be merged into another profiler"""
+        return {"timers": self.timers, "memory": self.memory}
+
+    def merge(self, stats):
+        """Merge the stats of another profiler, i.e. from a worker"""
+        for key, (seconds, calls) in stats["timers"].items():
+            timer = self.timer_of(*key)
+            timer[0] += seconds
+            timer[1] += calls
+        for title, nbytes in stats["memory"].items():
+            if nbytes > self.memory.get(title, 0):
+                self.memory[title] = nbytes
+
+    def report(self):
+        """Get the report as a dict that can be dumped as JSON"""
+        report = {kind: {} for kind in KINDS}
+        for (kind, name), (seconds, calls) in self.timers.items():
+            report[kind][name] = {"time": seconds, "calls": calls}
+        for title, nbytes in self.memory.items():
+            report["instance"].setdefault(title, {"time": 0.0, "calls": 0})
+            report["instance"][title]["peak_bytes"] = nbytes
+        # in KB on linux, in bytes on macos
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            maxrss *= 1024
+        report["peak_rss"] = maxrss
+        return report
+
+    def save(self, outfile):
+        """Save the report to a JSON file"""
+        with open(outfile, "w") as fout:
+            json.dump(self.report(), fout, indent=2)
+
+    def print(self):
+        """Print the report as tables"""
+        report = self.report()
+        console = Console()
+        for kind in KINDS:
+            if not report[kind]:
+                continue
+            with_memory = kind == "instance"
+            table = Table(title=f"Profile: {kind}")
+            table.add_column("Name")
+            table.add_column("Time (s)", justify="right")
+            table.add_column("Calls", justify="right")
+            table.add_column("Per call (µs)", justify="right")
+            if with_memory:
+                table.add_column("Peak memory (MB)", justify="right")
+            for name, stat in sorted(
+                report[kind].items(), key=lambda item: -item[1]["time"]
+            ):
+                row = [
+                    name,
+                    f"{stat['time']:.4f}",
+                    str(stat["calls"]),
+                    f"{stat['time'] / stat['calls'] * 1e6:.2f}"
+                    if stat["calls"]
+                    else "-",
+                ]
+                if with_memory:
+                    row.append(f"{stat.get('peak_bytes', 0) / 1024 ** 2:.2f}")
+                table.add_row(*row)
+            console.print(table)
+        console.print(
+            "Peak memory of the process: "
+            f"{report['peak_rss'] / 1024 ** 2:.2f} MB"
+        )
+
+
+PROFILER = Profiler()
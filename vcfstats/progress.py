@@ -0,0 +1,249 @@
+"""Reporting the progress of the scan: throughput and ETA"""
+import gzip
+import json
+import os
+import struct
+from pathlib import Path
+from time import perf_counter, time
+
+from .regions import parse_region
+from .utils import logger
+
+
+def _read(fin, fmt):
+    """Read a struct from the index file"""
+    return struct.unpack(fmt, fin.read(struct.calcsize(fmt)))
+
+
+def read_index_counts(vcffile, contigs=None):
+    """Read the number of records on each contig from the pseudo-bins of
+    the tabix (.tbi) or CSI (.csi) index of the vcf file.
+
+    `contigs` are the names of the contigs in the order of the index, for
+    indexes that don't keep the names (i.e. the CSI index of a BCF file).
+    Returns a dict of {contig: number of records}, or None if the vcf file
+    is not indexed or the index can't be read.
+    """
+    for ext in (".tbi", ".csi"):
+        index = Path(f"{vcffile}{ext}")
+        if index.is_file():
+            break
+    else:
+        return None
+
+    try:
+        with gzip.open(index, "rb") as fin:
+            magic = fin.read(4)
+            if magic == b"TBI\1":
+                n_ref, = _read(fin, "<i")
+                # format, col_seq, col_beg, col_end, meta, skip
+                fin.read(24)
+                l_nm, = _read(fin, "<i")
+                names = fin.read(l_nm).split(b"\0")[:n_ref]
+                names = [name.decode() for name in names]
+                pseudo = 37450
+                loffset = False
+            elif magic == b"CSI\1":
+                _, depth, l_aux = _read(fin, "<3i")
+                aux = fin.read(l_aux)
+                names = None
+                if l_aux >= 28:
+                    # the same header as a tabix index, with the names
+                    l_nm, = struct.unpack("<i", aux[24:28])
+                    names = [
+                        name.decode()
+                        for name in aux[28 : 28 + l_nm].split(b"\0")
+                        if name
+                    ]
+                n_ref, = _read(fin, "<i")
+                pseudo = ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+                loffset = True
+            else:
+                return None
+
+            counts = []
+            for _ in range(n_ref):
+                count = 0
+                n_bin, = _read(fin, "<i")
+                for _ in range(n_bin):
+                    bin_id, = _read(fin, "<I")
+                    if loffset:
+                        fin.read(8)
+                    n_chunk, = _read(fin, "<i")
+                    chunks = _read(fin, f"<{n_chunk * 2}Q")
+                    if bin_id == pseudo and n_chunk == 2:
+                        # (off_beg, off_end), (n_mapped, n_unmapped)
+                        count = chunks[2]
+                counts.append(count)
+                if not loffset:
+                    n_intv, = _read(fin, "<i")
+                    fin.read(n_intv * 8)
+    except (OSError, EOFError, struct.error):  # pragma: no cover
+        return None
+
+    names = names or contigs
+    if not names or len(names) < n_ref:
+        return None
+    return dict(zip(names, counts))
+
+
+def expected_records(counts, regions):
+    """Estimate the number of records in the regions from the counts of
+    the records on each contig. A region covering part of a contig is
+    counted as the whole contig, so it is an upper bound."""
+    if not regions:
+        return sum(counts.values())
+    contigs = dict.fromkeys(parse_region(region)[0] for region in regions)
+    return sum(counts.get(contig, 0) for contig in contigs)
+
+
+def file_offsets(vcffile):
+    """Get the offsets of the file descriptors of this process that are
+    opened for the vcf file, from /proc/self/fdinfo (linux only).
+    Returns a dict of {fd: offset}, empty if not available."""
+    offsets = {}
+    realpath = os.path.realpath(vcffile)
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:  # pragma: no cover
+        return offsets
+    for fd in fds:
+        try:
+            if os.readlink(f"/proc/self/fd/{fd}") != realpath:
+                continue
+            with open(f"/proc/self/fdinfo/{fd}") as finfo:
+                for line in finfo:
+                    if line.startswith("pos:"):
+                        offsets[fd] = int(line.split()[1])
+                        break
+        except OSError:  # pragma: no cover
+            continue
+    return offsets
+
+
+def format_seconds(seconds):
+    """Format the seconds as H:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Progress:
+    """Report the throughput and the ETA of the scan periodically, in the
+    log and/or as JSON lines in a status file.
+
+    The ETA is derived from the compressed offset of the vcf file, or from
+    the number of records on each contig in the index when regions are
+    given, the offset is not available (i.e. not on linux), or the vcf
+    file is not read by this process (`use_offset=False`, i.e. with
+    parallel jobs, where the variants merged from the workers are counted).
+    """
+
+    def __init__(
+        self,
+        vcffile,
+        regions=None,
+        interval=10.0,
+        log=True,
+        status_file=None,
+        contigs=None,
+        use_offset=True,
+    ):
+        self.vcffile = vcffile
+        self.use_offset = use_offset
+        self.interval = interval
+        self.log = log
+        self.status_file = status_file
+        self.regions = regions
+        self.total_bytes = None if regions else os.path.getsize(vcffile)
+        counts = read_index_counts(vcffile, contigs)
+        self.total_records = (
+            None if counts is None else expected_records(counts, regions)
+        )
+        self.start_time = self.last_time = perf_counter()
+        self.start_offsets = {}
+        if status_file:
+            # start a new status file for the run
+            open(status_file, "w").close()
+
+    def start(self):
+        """Start timing, after the vcf file is opened"""
+        self.start_time = self.last_time = perf_counter()
+        self.start_offsets = file_offsets(self.vcffile)
+
+    def bytes_read(self):
+        """Get the (compressed) offset of the vcf file and the number of
+        bytes read since the start, from the file descriptor that has
+        advanced the most. (None, None) if not available, or the vcf file
+        is not read by this process."""
+        if not self.use_offset:
+            return None, None
+        offsets = file_offsets(self.vcffile)
+        if not offsets:
+            return None, None
+        fd = max(
+            offsets, key=lambda fd: offsets[fd] - self.start_offsets.get(fd, 0)
+        )
+        return offsets[fd], offsets[fd] - self.start_offsets.get(fd, 0)
+
+    def status(self, n_variants, state="scanning"):
+        """Get the status as a dict"""
+        elapsed = perf_counter() - self.start_time
+        offset, nbytes = self.bytes_read()
+        fraction = None
+        if state == "done":
+            fraction = 1.0
+        elif self.total_bytes and offset is not None and not self.regions:
+            fraction = offset / self.total_bytes
+        elif self.total_records:
+            fraction = n_variants / self.total_records
+        if fraction is not None:
+            fraction = min(fraction, 1.0)
+        eta = None
+        if fraction and elapsed > 0:
+            eta = elapsed * (1.0 - fraction) / fraction
+        return {
+            "time": time(),
+            "state": state,
+            "elapsed": elapsed,
+            "variants": n_variants,
+            "variants_per_sec": n_variants / elapsed if elapsed else None,
+            "bytes": nbytes,
+            "bytes_per_sec": (
+                nbytes / elapsed if elapsed and nbytes is not None else None
+            ),
+            "fraction": fraction,
+            "eta": eta,
+        }
+
+    def update(self, n_variants, force=False):
+        """Report the progress if `interval` seconds passed since the last
+        report"""
+        now = perf_counter()
+        if not force and now - self.last_time < self.interval:
+            return
+        self.last_time = now
+        self.report(self.status(n_variants))
+
+    def finish(self, n_variants):
+        """Report the final status"""
+        self.report(self.status(n_variants, "done"))
+
+    def report(self, status):
+        """Log the status and/or write it to the status file"""
+        if self.status_file:
+            with open(self.status_file, "a") as fout:
+                fout.write(json.dumps(status) + "\n")
+        if not self.log or status["state"] == "done":
+            return
+
+        message = [
+            f"{status['variants']} variants read",
+            f"{status['variants_per_sec'] or 0:.0f} variants/s",
+        ]
+        if status["bytes_per_sec"] is not None:
+            message.append(f"{status['bytes_per_sec'] / 1024 ** 2:.2f} MB/s")
+        if status["fraction"] is not None:
+            message.append(f"{status['fraction'] * 100:.1f}%")
+        if status["eta"] is not None:
+            message.append(f"ETA {format_seconds(status['eta'])}")
+        logger.info("Progress: %s", ", ".join(message))
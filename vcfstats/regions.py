@@ -0,0 +1,101 @@
+"""Sorting, merging and iterating over the regions"""
+import re
+
+# intervals closer than this (in bp) are fetched with a single index query
+REGION_BATCH_GAP = 10000
+
+REGION_PATTERN = re.compile(r"^(.+):([\d,]+)(?:-([\d,]*))?$")
+
+
+def parse_region(region):
+    """Parse a region (CHR, CHR:START, CHR:START- or CHR:START-END)
+    into (chrom, start, end), with 1-based inclusive coordinates.
+    end is None if the region goes to the end of the contig."""
+    matched = REGION_PATTERN.match(region)
+    if not matched:
+        return region, 1, None
+    chrom, start, end = matched.groups()
+    start = int(start.replace(",", ""))
+    end = int(end.replace(",", "")) if end else None
+    return chrom, max(start, 1), end
+
+
+def format_region(chrom, start, end):
+    """Format (chrom, start, end) back into a region string"""
+    if end is None:
+        return chrom if start <= 1 else f"{chrom}:{start}-"
+    return f"{chrom}:{start}-{end}"
+
+
+def merge_regions(regions, contigs=None):
+    """Sort the regions in the order of the contigs (the index order),
+    and merge the overlapping or adjacent ones.
+
+    Contigs not in `contigs` are put after the others, in the order they
+    first appear. Returns the merged regions as strings.
+    """
+    order = {contig: i for i, contig in enumerate(contigs or [])}
+    intervals = []
+    for region in regions:
+        chrom, start, end = parse_region(region)
+        order.setdefault(chrom, len(order))
+        intervals.append((order[chrom], start, end, chrom))
+    intervals.sort(key=lambda itv: itv[:2])
+
+    merged = []
+    for _, start, end, chrom in intervals:
+        if merged and merged[-1][0] == chrom:
+            last_end = merged[-1][2]
+            if last_end is None:
+                continue
+            if start <= last_end + 1:
+                merged[-1][2] = None if end is None else max(last_end, end)
+                continue
+        merged.append([chrom, start, end])
+    return [format_region(*itv) for itv in merged]
+
+
+def batch_regions(regions, gap=REGION_BATCH_GAP):
+    """Group the sorted, merged regions into batches, each to be fetched
+    with a single index query. Regions on the same contig that are no more
+    than `gap` apart are put in the same batch.
+    Returns a list of (chrom, [(start, end), ...])."""
+    batches = []
+    for region in regions:
+        chrom, start, end = parse_region(region)
+        if batches and batches[-1][0] == chrom:
+            last_end = batches[-1][1][-1][1]
+            if last_end is not None and start - last_end <= gap:
+                batches[-1][1].append((start, end))
+                continue
+        batches.append((chrom, [(start, end)]))
+    return batches
+
+
+def iter_regions(vcf, regions, gap=REGION_BATCH_GAP):
+    """Iterate over the variants in the sorted, merged regions with one
+    flat generator.
+
+    Nearby regions are fetched with a single index query, and the variants
+    in the gaps between them are dropped. A variant overlapping more than
+    one batch (i.e. a long deletion) is only yielded once.
+    """
+    last_chrom = last_end = None
+    for chrom, intervals in batch_regions(regions, gap):
+        query = format_region(chrom, intervals[0][0], intervals[-1][1])
+        dedup = chrom == last_chrom
+        i = 0
+        for variant in vcf(query):
+            pos = variant.POS
+            # yielded by the previous batch
+            if dedup and pos <= last_end:
+                continue
+            # intervals that end before the variant are done
+            while intervals[i][1] is not None and intervals[i][1] < pos:
+                i += 1
+            # the variant ends before the next interval starts
+            if variant.end < intervals[i][0]:
+                continue
+            yield variant
+        last_chrom = chrom
+        last_end = intervals[-1][1]
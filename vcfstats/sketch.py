@@ -0,0 +1,355 @@
+"""Mergeable sketches of bounded memory: quantiles and distinct counts"""
+import math
+from hashlib import blake2b
+
+import numpy
+
+# the default size of the sketches
+DEFAULT_K = 200
+# the capacity of a level shrinks by this factor from the top level down
+DECAY = 2.0 / 3.0
+# the smallest capacity of a level
+MIN_CAPACITY = 2
+
+# the default precision of the HyperLogLog sketches, and its range
+DEFAULT_P = 14
+MIN_P = 4
+MAX_P = 18
+
+_LCG_MULTIPLIER = 6364136223846793005
+_LCG_INCREMENT = 1442695040888963407
+_LCG_MASK = (1 << 64) - 1
+
+
+def rank_error(k=DEFAULT_K):
+    """The normalized rank error of a sketch of size `k`, with 99%
+    confidence (the empirical bound of the KLL sketch, the same as the
+    one of Apache DataSketches): a quantile returned for rank `q` has a
+    true rank within `q ± rank_error(k)`.
+
+    It is about 1.33% for the default `k` (200), and shrinks about
+    linearly with `k`.
+    """
+    return 2.296 / k ** 0.9723
+
+
+class KLLSketch:
+    """The KLL quantile sketch (Karnin, Lang and Liberty, 2016).
+
+    The values are added to level 0. When the sketch is full, the lowest
+    level over its capacity is sorted and every other value of it is
+    promoted to the next level (from a random offset), where each value
+    stands for twice as many values. The top level has a capacity of `k`
+    and each level below has `2/3` of the capacity of the level above,
+    so the sketch keeps `O(k)` values no matter how many are added.
+
+    Sketches of the same `k` are merged by concatenating the levels and
+    compacting again, so the values can be sketched in parts (i.e. by
+    parallel jobs) with the same error bound, see `rank_error`.
+
+    The exact minimum and maximum are kept, and the sketch is exact
+    until more than `k` values are added.
+    """
+
+    __slots__ = (
+        "k",
+        "levels",
+        "count",
+        "min",
+        "max",
+        "size",
+        "full",
+        "_seed",
+    )
+
+    def __init__(self, k=DEFAULT_K, seed=8525):
+        if k < MIN_CAPACITY:
+            raise ValueError(
+                f"Expect the size of the sketch to be at least "
+                f"{MIN_CAPACITY}, got {k}."
+            )
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        self.min = self.max = None
+        # the number of values kept, and the number when it is full
+        self.size = 0
+        self.full = self._total_capacity()
+        self._seed = seed
+
+    def __len__(self):
+        return self.count
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the sketch"""
+        # a float object and a list slot for each value kept
+        return 32 * self.size + 56 * len(self.levels)
+
+    def capacity(self, level):
+        """The capacity of a level"""
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, math.ceil(self.k * DECAY ** depth))
+
+    def _total_capacity(self):
+        """The number of values the levels can keep"""
+        return sum(self.capacity(level) for level in range(len(self.levels)))
+
+    def _coin(self):
+        """Flip a coin, with a 64-bit LCG, so that the sketch is
+        reproducible and cheap to pickle"""
+        self._seed = (
+            self._seed * _LCG_MULTIPLIER + _LCG_INCREMENT
+        ) & _LCG_MASK
+        return self._seed >> 63
+
+    def _compress(self):
+        """Compact the lowest level over its capacity until the sketch is
+        not full"""
+        while self.size >= self.full:
+            for level, values in enumerate(self.levels):
+                if len(values) >= self.capacity(level):
+                    break
+            else:  # pragma: no cover
+                return
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.full = self._total_capacity()
+            values.sort()
+            # keep the odd one out at this level
+            rest = [values.pop()] if len(values) % 2 else []
+            promoted = values[self._coin() :: 2]
+            self.levels[level + 1].extend(promoted)
+            self.levels[level] = rest
+            self.size -= len(values) - len(promoted)
+
+    def update(self, value):
+        """Add a value, missing (None) and NaN values are ignored"""
+        if value is None or value != value:
+            return self
+        if self.count == 0:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self.levels[0].append(value)
+        self.size += 1
+        if self.size >= self.full:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch of the same size into this one"""
+        if other.k != self.k:
+            raise ValueError(
+                "Cannot merge sketches of different sizes: "
+                f"{self.k} and {other.k}."
+            )
+        if not other.count:
+            return self
+        if not self.count:
+            self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        self.full = self._total_capacity()
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self.size += other.size
+        self._compress()
+        return self
+
+    def _sorted_weights(self):
+        """The values kept, sorted, with their weights, which add up to the
+        number of values added"""
+        return sorted(
+            (value, 1 << level)
+            for level, values in enumerate(self.levels)
+            for value in values
+        )
+
+    def quantiles(self, qs):
+        """Get the quantiles of ranks `qs` (from 0 to 1).
+
+        The quantile of rank `q` is the smallest value that at least
+        `q` of the values are less than or equal to (the inverse of the
+        empirical distribution function), so it is always one of the
+        values added. Ranks 0 and 1 give the exact minimum and maximum.
+        Returns NaN for the quantiles of an empty sketch.
+        """
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError(f"Expect the rank to be in [0, 1], got {q}.")
+        if not self.count:
+            return [math.nan for _ in qs]
+
+        items = self._sorted_weights()
+        ret = []
+        for q in qs:
+            if q == 0:
+                ret.append(self.min)
+                continue
+            if q == 1:
+                ret.append(self.max)
+                continue
+            target = q * self.count
+            cumulative = 0
+            for value, weight in items:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            ret.append(value)
+        return ret
+
+    def quantile(self, q):
+        """Get the quantile of rank `q`, see `quantiles`"""
+        return self.quantiles([q])[0]
+
+    def summary(self):
+        """The five-number summary: minimum, lower quartile, median,
+        upper quartile and maximum"""
+        return self.quantiles([0.0, 0.25, 0.5, 0.75, 1.0])
+
+
+def _hash64(value):
+    """Hash a value to 64 bits, by its string form, so that the hashes are
+    the same in all processes (unlike `hash()` of strings)"""
+    return int.from_bytes(
+        blake2b(str(value).encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HyperLogLog:
+    """The HyperLogLog sketch (Flajolet et al., 2007) to count the
+    distinct values.
+
+    The values are hashed to 64 bits (see `_hash64`). The first `p` bits
+    of a hash choose one of the `2^p` registers, which keeps the maximum
+    position of the first 1-bit in the rest of the bits. The registers
+    are one byte each, so a sketch takes `2^p` bytes (16KB for the
+    default `p`, 14), and the relative standard error of the count is
+    `1.04 / sqrt(2^p)` (0.81% for `p=14`), see `relative_error`.
+
+    The hashes are kept as they are until there are more than `exact`
+    of them (`2^p / 16` by default), so small counts are exact (barring
+    64-bit hash collisions).
+
+    Sketches of the same `p` are merged by taking the maximum of the
+    registers, with the same error as sketching all the values at once.
+    """
+
+    __slots__ = ("p", "exact", "hashes", "registers")
+
+    def __init__(self, p=DEFAULT_P, exact=None):
+        if not MIN_P <= p <= MAX_P:
+            raise ValueError(
+                f"Expect the precision to be in [{MIN_P}, {MAX_P}], got {p}."
+            )
+        self.p = int(p)
+        self.exact = (1 << (self.p - 4)) if exact is None else int(exact)
+        # the hashes in the exact mode, None after switching to registers
+        self.hashes = set()
+        self.registers = None
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    @property
+    def nbytes(self):
+        """Approximate number of bytes used by the sketch"""
+        if self.registers is None:
+            # the int object and the hash table slots for each hash
+            return 64 * len(self.hashes)
+        return len(self.registers)
+
+    def relative_error(self):
+        """The relative standard error of the count, 0 in the exact mode"""
+        if self.registers is None:
+            return 0.0
+        return 1.04 / math.sqrt(1 << self.p)
+
+    def _add_hash(self, hashed):
+        """Add a hash to the registers"""
+        rest_bits = 64 - self.p
+        index = hashed >> rest_bits
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _to_registers(self):
+        """Switch from the exact mode to the registers"""
+        self.registers = bytearray(1 << self.p)
+        for hashed in self.hashes:
+            self._add_hash(hashed)
+        self.hashes = None
+
+    def update(self, value):
+        """Add a value, missing (None) and NaN values are ignored"""
+        if value is None or value != value:
+            return self
+        hashed = _hash64(value)
+        if self.registers is not None:
+            self._add_hash(hashed)
+            return self
+        self.hashes.add(hashed)
+        if len(self.hashes) > self.exact:
+            self._to_registers()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch of the same precision into this one"""
+        if other.p != self.p:
+            raise ValueError(
+                "Cannot merge sketches of different precisions: "
+                f"{self.p} and {other.p}."
+            )
+        if other.registers is None:
+            if self.registers is None:
+                self.hashes |= other.hashes
+                if len(self.hashes) > self.exact:
+                    self._to_registers()
+            else:
+                for hashed in other.hashes:
+                    self._add_hash(hashed)
+            return self
+
+        if self.registers is None:
+            self._to_registers()
+        numpy.maximum(
+            numpy.frombuffer(self.registers, dtype=numpy.uint8),
+            numpy.frombuffer(other.registers, dtype=numpy.uint8),
+            out=numpy.frombuffer(self.registers, dtype=numpy.uint8),
+        )
+        return self
+
+    def count(self):
+        """Estimate the number of distinct values, with the small range
+        correction (linear counting)"""
+        if self.registers is None:
+            return len(self.hashes)
+        m = 1 << self.p
+        registers = numpy.frombuffer(self.registers, dtype=numpy.uint8)
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        powers = numpy.ldexp(1.0, -registers.astype(numpy.int64))
+        estimate = alpha * m * m / powers.sum()
+        zeros = int(numpy.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))